@@ -8,6 +8,8 @@
 from cmds import *
 from estCard import *
 from common import *
+from otcCard.metrics import dump_at_exit
+import logging
 general_help = u"""
   Aplicación para la configuración de las Tarjetas de control de Estabilizador EstCard.
 
@@ -46,6 +48,9 @@ general_help = u"""
     - Respaldo de la Configuración :
           >> EstApp.py -b [-mch | -intelhex | -source |
                                               -dump | -bin [<bacup_filename>]]
+          >> EstApp.py -b -restore <bacup_filename> [-all]
+          >> EstApp.py -b -fleet [-port p1 -port p2 ...] [-formato] [directorio]
+          >> EstApp.py -b -fleet [-port p1 -port p2 ...] -restore <archivo> [-all]
     - Operación Manual de los taps :
           >> EstApp.py -manual
 
@@ -59,6 +64,7 @@ general_help = u"""
          -cal , -calibration, - calibración
          -s , scale, escala
          -b, -respaldo, -backup
+         -fleet, -flota
          -g, -gain', -ganancia
          -m, -mode, -modo
          -manual, -settap
@@ -90,6 +96,54 @@ general_help = u"""
         Esta opción es útil para nombres de puertos serie no estándares, como
         en el caso de algunos adaptadores USB o Bluetooth.
 
+  El monitor (-mon) acepta varias opciones -port, para monitorear simultánea-
+  mente varias tarjetas (un solo registro y una línea por tarjeta en la
+  consola) :
+
+        >> EstApp.py -mon -port COM3 -port COM4 -port COM5 [log_file]
+
+  De igual forma el respaldo (y la restauración) de la EEPROM de varias tarje-
+  tas a la vez (-b -fleet), con todos los puertos del sistema si no se espe-
+  cifican :
+
+        >> EstApp.py -b -fleet -port COM3 -port COM4 respaldos
+
+  Si el adaptador del puerto serie no honra los bits de parada, la opción
+  -bytexmit transmite las ordenes byte a byte (mas lento) :
+
+        >> EstApp.py  ...  -bytexmit ...
+
+  Los parámetros de la EEPROM de cada tarjeta (identificada por su modelo y
+  número de serie) se conservan entre ejecuciones en el directorio ~/.estapp,
+  para evitar leerlos cada vez. La opción -nocache lee todos los parámetros
+  de la tarjeta (por ejemplo si fue modificada por otros medios) :
+
+        >> EstApp.py  ...  -nocache ...
+
+  Durante la medición, la opción -rate limita el número de lecturas por
+  segundo (por defecto se leen tan rápido como lo permite la comunicación) :
+
+        >> EstApp.py  ...  -rate 20 ...
+
+  La opción -metrics presenta al terminar las métricas de la comunicación
+  (ordenes, bytes, repeticiones, rechazos y los percentiles de la latencia
+  de cada tipo de orden), o las exporta en formato JSON si se especifica el
+  archivo. La opción -logbytes registra (en el reporte) los bytes
+  transmitidos y recibidos :
+
+        >> EstApp.py  ...  -metrics [metricas.json] ...
+        >> EstApp.py  ...  -logbytes ...
+
+  El reporte detallado (report.log) se puede limitar a un nivel (DEBUG, INFO,
+  WARNING o ERROR) con la opción -loglevel, y escribirse desde un hilo sepa-
+  rado con la opción -logqueue, para que la comunicación no espere por el
+  disco. La opción -wire registra los bytes transmitidos y recibidos en un
+  archivo binario compacto, en lugar de las líneas de texto de -logbytes, que
+  puede reproducirse fuera de línea (python -m bench.replay_bench archivo) :
+
+        >> EstApp.py  ...  -loglevel INFO -logqueue ...
+        >> EstApp.py  ...  -wire captura.wire ...
+
   Nótese que se utilizan los puntos suspensivos para indicar otras opciones de
   trabajo.
 
@@ -107,12 +161,87 @@ def main(args):
     else:
         throughput_limit = False
 
+    # Algunos adaptadores USB no honran los bits de parada, con la opción
+    # '-bytexmit' se transmite cada byte por separado :
+    if '-bytexmit' in args:
+        args.pop(args.index(u'-bytexmit'))
+        OTCProtocol.default_xmit_mode = XMIT_BYTE
+
+    # La opción '-rate' limita la taza de lectura de las mediciones (lecturas
+    # por segundo) :
+    if '-rate' in args:
+        i = args.index(u'-rate')
+        args.pop(i)
+        try:
+            MeasureTask.default_rate = float(args.pop(i))
+        except (IndexError, ValueError):
+            print('Error : La opción -rate requiere el número de lecturas '
+                  'por segundo.')
+            sys.exit(1)
+
+    # La opción '-nocache' deshabilita la imagen persistente de la EEPROM, todos
+    # los parámetros se leen de la tarjeta :
+    if '-nocache' in args:
+        args.pop(args.index(u'-nocache'))
+        EstCard1V0.use_image = False
+
+    # La opción '-metrics' presenta (o exporta en formato JSON, si le sigue el
+    # nombre del archivo) las métricas de la comunicación al terminar :
+    if '-metrics' in args:
+        i = args.index(u'-metrics')
+        args.pop(i)
+        filename = None
+        if (i < len(args)) and args[i].lower().endswith('.json'):
+            filename = args.pop(i)
+        dump_at_exit(filename)
+
+    # La opción '-logbytes' registra los bytes transmitidos y recibidos :
+    if '-logbytes' in args:
+        args.pop(args.index(u'-logbytes'))
+        OTCProtocol.log_bytes = True
+
+    # Las opciones '-loglevel', '-logqueue' y '-wire' configuran el sistema de
+    # reporte (ver report()) :
+    log_level = logging.DEBUG
+    if '-loglevel' in args:
+        i = args.index(u'-loglevel')
+        args.pop(i)
+        try:
+            log_level = getattr(logging, args.pop(i).upper())
+            if not isinstance(log_level, int):
+                raise ValueError()
+        except (IndexError, AttributeError, ValueError):
+            print('Error : La opción -loglevel requiere el nivel del reporte '
+                  '(DEBUG, INFO, WARNING o ERROR).')
+            sys.exit(1)
+
+    log_queued = '-logqueue' in args
+    if log_queued:
+        args.pop(args.index(u'-logqueue'))
+
+    wire = None
+    if '-wire' in args:
+        i = args.index(u'-wire')
+        args.pop(i)
+        try:
+            wire = args.pop(i)
+        except IndexError:
+            print('Error : La opción -wire requiere el nombre del archivo.')
+            sys.exit(1)
+
     # En Windows y Linux, la especificación del puerto es obligatoria para
     # ciertas opciones (y por lo tanto parsePort() debe interrogar al usuario :
-    port, args = parsePort(args, ['-u', '-t', u'-g', u'-s'])
+    # Con mas de una opción '-port' (monitor de varias tarjetas) se reconocen
+    # todos los puertos, el primero se utiliza como el puerto principal :
+    ports = []
+    if args.count(u'-port') > 1:
+        ports, args = parsePorts(args)
+        port = ports[0]
+    else:
+        port, args = parsePort(args, ['-u', '-t', u'-g', u'-s'])
 
     # Inicializa el sistema de reporte :
-    report('EstCard')
+    report('EstCard', level=log_level, queued=log_queued, wire=wire)
     logger = report.getLogger()
 
     if len(args) == 1:
@@ -137,6 +266,10 @@ def main(args):
             print((BackupCmd.__doc__))
             sys.exit(0)
 
+        if topic in ['fleet', 'flota']:
+            print((FleetCmd.__doc__))
+            sys.exit(0)
+
         if topic in ['g', 'gain', 'ganancia']:
             print((GainCmd.__doc__))
             sys.exit(0)
@@ -175,7 +308,10 @@ def main(args):
     # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
     # Lectura de la EEPROM y generación de su respaldo :
     elif args[1] == '-b':
-        BackupCmd(args, port, throughput_limit)
+        if (len(args) > 2) and (args[2] == '-fleet'):
+            FleetCmd(args, ports or ([port] if port else []), throughput_limit)
+        else:
+            BackupCmd(args, port, throughput_limit)
 
     # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
     # TODO : Medición de la Relación de Taps :
@@ -221,7 +357,10 @@ def main(args):
         ThresholdCmd(args, port, throughput_limit)
 
     elif args[1] == u'-mon':
-        card = MonCmd(args, port, throughput_limit)
+        if len(ports) > 1:
+            MultiMonCmd(args, ports, throughput_limit)
+        else:
+            card = MonCmd(args, port, throughput_limit)
 
     elif args[1] == '-test':
         TestCmd(args, port, throughput_limit)
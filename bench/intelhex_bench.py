@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+intelhex_bench.py
+
+Mide el tiempo de la codificación IntelHex (IntelHexWriter) y de su inter-
+pretación (IntelHex, IntelHexRecord.iterparse()) de una imagen aleatoria de
+size Kbytes (por defecto 4 Mbytes, como la de una memoria flash), y de la
+codificación del respaldo de la EEPROM (cmds.backupMgmt.get_intelhex()).
+
+Uso :
+    > python -m bench.intelhex_bench [size]
+"""
+
+import io
+import os
+import sys
+import time
+import timeit
+
+import common
+from cmds import intelhex
+from cmds.backupMgmt import get_intelhex
+
+
+def main(args):
+    size = 1024 * (int(args[1]) if len(args) > 1 else 4096)
+    image = os.urandom(size)
+
+    start = time.perf_counter()
+    txt = io.StringIO()
+    intelhex.write_intelhex(txt, image, 0x08000000)
+    elapsed = time.perf_counter() - start
+    print('%-31s: %8.1f ms (%.1f Mbytes de texto)'
+          % ('Codificación de %d Kbytes' % (size // 1024), 1000 * elapsed,
+             len(txt.getvalue()) / 1e6))
+
+    txt.seek(0)
+    start = time.perf_counter()
+    hex = intelhex.IntelHex(txt)
+    memory = hex.memory(0x08000000, size)
+    elapsed = time.perf_counter() - start
+    print('Interpretación                 : %8.1f ms (%s)'
+          % (1000 * elapsed, 'correcta' if memory == image else 'INCORRECTA'))
+
+    eeprom = bytes(256)
+    t = min(timeit.repeat(lambda: get_intelhex(eeprom), number=100, repeat=5))
+    print('Respaldo de la EEPROM          : %8.1f us' % (t / 100 * 1e6))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+multimon_bench.py
+
+Mide cuantas tarjetas puede atender (a la taza máxima) el monitor asíncrono
+de varias tarjetas desde un solo bucle de eventos : para 1, 2, 4, ... tarje-
+tas (sustitutas, ver bench.simulator) mide el número de lecturas de la medi-
+ción por segundo (total y por tarjeta) y la fracción del tiempo de procesa-
+dor que consume el hilo del bucle de eventos.
+
+Nótese que los sustitutos se ejecutan en hilos del mismo proceso, por lo que
+compiten con el bucle de eventos, los resultados son un límite inferior.
+
+Uso :
+    > python -m bench.multimon_bench [máximo_de_tarjetas [duración]]
+"""
+
+import os
+import sys
+import time
+import asyncio
+
+import common
+from common.report import report
+from otcCard.AsyncOTCProtocol import AsyncOTCProtocol
+from estCard.EstCard import EstCard1V0
+from estCard.AsyncMeasure import AsyncMeasure
+from bench.simulator import CardSimulator
+
+
+async def run(count, duration):
+    simulators = [CardSimulator() for n in range(count)]
+    for simulator in simulators:
+        simulator.start()
+
+    measures = [AsyncMeasure(AsyncOTCProtocol(simulator.port),
+                             EstCard1V0._measure_record)
+                for simulator in simulators]
+
+    start, cpu = time.perf_counter(), time.thread_time()
+    tasks = [asyncio.ensure_future(m.run()) for m in measures]
+
+    await asyncio.sleep(duration)
+    for m in measures:
+        m.stop()
+    await asyncio.gather(*tasks)
+
+    elapsed = time.perf_counter() - start
+    cpu = time.thread_time() - cpu
+
+    samples = sum(m.buffer.head for m in measures)
+    for m, simulator in zip(measures, simulators):
+        m.dev.close()
+        simulator.close()
+
+    return samples / elapsed, cpu / elapsed
+
+
+def main(args):
+    limit = int(args[1]) if len(args) > 1 else 16
+    duration = float(args[2]) if len(args) > 2 else 2.0
+
+    report('EstBench', os.devnull)
+
+    print('Lecturas de la medición, %.1f s por prueba :' % duration)
+    print('  Tarjetas  Lecturas/s  Por tarjeta   CPU (bucle)')
+
+    count = 1
+    while count <= limit:
+        rate, cpu = asyncio.run(run(count, duration))
+        print('  %8d  %10.1f  %11.1f   %9.1f%%' % (count, rate, rate / count,
+                                                  100 * cpu))
+        count *= 2
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+replay_bench.py
+
+Reproduce una sesión registrada en el registro binario (ver common.report.
+WireTrace y otcCard.ReplayDevice) por medio de OTCProtocol : sin esperas,
+para medir el número de ordenes por segundo que se decodifican, y a la
+velocidad registrada, para comparar su duración con la de la sesión.
+
+Si no se especifica el registro, se registra una sesión contra el simulador
+(bench.simulator) : la conexión de EstCard, la lectura de la EEPROM, lec-
+turas de la medición y secuencias de lecturas (batch()), transmitiendo las
+ordenes en una sola escritura y byte a byte (XMIT_BYTE). En este caso además
+se verifican los datos reproducidos de las lecturas de la EEPROM.
+
+Uso :
+    > python -m bench.replay_bench [registro [puerto [repeticiones]]]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+import common
+from common.report import report
+from otcCard.ReplayDevice import replay
+from otcCard.OTCProtocol import XMIT_BURST, XMIT_BYTE
+from estCard.EstCard import EstCard, EstCard1V0
+from bench.simulator import CardSimulator
+
+
+def record(filename, reads):
+    u"""
+    Registra en filename una sesión contra el simulador, devuelve su duración
+    y los datos de las lecturas de la EEPROM (por dirección y tamaño).
+    """
+    report('EstBench', os.devnull, wire=filename)
+    EstCard1V0.use_image = False
+
+    simulator = CardSimulator(latency=0.001, baudrate=57600)
+    simulator.start()
+
+    start = time.perf_counter()
+    card = EstCard(simulator.port)
+    card.eeprom
+    measure = type(card)._measure_record
+    for n in range(reads):
+        card.dev.getData(measure.adr, measure.size)
+
+    expected = {}
+    commands = [('G', adr, 16) for adr in range(0xF000, 0xF0A0, 16)]
+    for mode in (XMIT_BURST, XMIT_BYTE):
+        card.dev.xmit_mode = mode
+        for cmd, data in zip(commands, card.dev.batch(commands)):
+            expected[cmd[1:]] = bytes(data)
+        expected[(0xF0A0, 32)] = bytes(card.dev.getData(0xF0A0, 32))
+    elapsed = time.perf_counter() - start
+
+    card.close()
+    simulator.close()
+
+    # Se completa la escritura del registro :
+    report.stop()
+    return elapsed, expected
+
+
+def verify(outcomes, expected):
+    u"""
+    Devuelve el número de lecturas reproducidas (de outcomes) cuyos datos
+    difieren de los esperados (expected, ver record()).
+    """
+    wrong = 0
+    for commands, result in outcomes:
+        if isinstance(result, Exception):
+            continue
+        results = result if len(commands) > 1 else [result]
+        for cmd, data in zip(commands, results):
+            if cmd[1:] in expected and bytes(data) != expected[cmd[1:]]:
+                wrong += 1
+    return wrong
+
+
+def main(args):
+    channel = args[2] if len(args) > 2 else None
+    repeat = int(args[3]) if len(args) > 3 else 3
+
+    expected = {}
+    if len(args) > 1:
+        filename = args[1]
+        report('EstBench', os.devnull)
+    else:
+        filename = os.path.join(tempfile.mkdtemp(), 'session.wire')
+        elapsed, expected = record(filename, 200)
+        print('Sesión registrada en %s (%.1f ms)' % (filename, 1000 * elapsed))
+
+    best = None
+    for n in range(repeat):
+        start = time.perf_counter()
+        dev, outcomes = replay(filename, channel, strict=False)
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+
+    commands = sum(len(c) for c, r in outcomes)
+    errors = sum(1 for c, r in outcomes if isinstance(r, Exception))
+    print('  Secuencias    : %d (%d ordenes, %d fallidas, %d incorrectas, '
+          '%d diferencias)' % (len(outcomes), commands, errors,
+                               verify(outcomes, expected), dev.mismatches))
+    print('  Sin esperas   : %8.1f ms, %8.1f ordenes/s'
+          % (1000 * best, commands / best))
+
+    start = time.perf_counter()
+    replay(filename, channel, speed=1.0, strict=False)
+    print('  Velocidad 1x  : %8.1f ms' % (1000 * (time.perf_counter() - start)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
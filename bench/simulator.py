@@ -0,0 +1,215 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+simulator.py
+
+Simulador de la tarjeta EstCard (núcleo CtrEst 1V0) para las pruebas de
+rendimiento, reemplaza al simulador de Proteus : abre un pseudo-terminal
+(pty) y responde a las ordenes GET y SET del protocolo OTCProtocol (con sus
+secuencias de escape y respuestas ACK/NACK) que recibe en el extremo maestro,
+el extremo esclavo (port) se abre como cualquier puerto serie.
+
+La memoria simulada sigue el mapa de EstCard1V0 : la identificación en
+0x0000 (memoria Flash, solo lectura), la RAM en 0xE000 (y sus variables en
+0xE400) y la EEPROM en 0xF000 (de lectura y escritura), las ordenes fuera de estas áreas se
+rechazan (NACK). El registro de la medición (_measure_record en 0xE408) se
+genera en cada lectura, con tensiones senoidales (en torno a vLN y vUV,
+moduladas a 0.2 Hz) y el tap activo cambiando cada 10 segundos.
+
+La latencia (latency, segundos antes de cada respuesta) y la velocidad del
+puerto (baudrate, el tiempo de transmisión de las ordenes y respuestas a 11
+bits por caracter, None para no limitarla) son configurables.
+
+Solo disponible en los sistemas POSIX.
+"""
+
+import os
+import math
+import time
+import random
+import struct
+import threading
+import tty
+
+ESC = 0x1B
+GET = ord('G')
+SET = ord('S')
+ACK = b'\x17'
+NACK = b'\x15'
+
+# Bytes que se transmiten como secuencias de escape en las respuestas :
+ESCAPED = (ESC, ACK[0], NACK[0])
+
+# Mapa de memoria (EstCard1V0) :
+FLASH = (0x0000, 0x1000)
+RAM = (0xE000, 0x0100)
+# Variables de la RAM con direcciones virtuales (clave, medición y tap activo) :
+VARIABLES = (0xE400, 0x0100)
+EEPROM = (0xF000, 0x0100)
+MEASURE_ADR = 0xE408
+TAP_STATUS_ADR = 0xE40D
+
+
+class CardSimulator(threading.Thread):
+    u"""
+    Simulador de la tarjeta del modelo model (número de serie serie), con la
+    escala scale, en un pseudo-terminal (ver port).
+    """
+
+    def __init__(self, model='EstCard 2V5', serie='SIM0001', scale=2.0,
+                 latency=0.0, baudrate=None, vLN=220.0, vUV=380.0, taps=5):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.latency = latency
+        self.baudrate = baudrate
+        self.vLN, self.vUV = vLN, vUV
+        self.taps = taps
+        self.scale = scale
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        # Número de ordenes atendidas (GET y SET) :
+        self.commands = 0
+        self.gets = 0
+        self.sets = 0
+
+        self.memory = bytearray(0x10000)
+        self._load(model, serie)
+        self._start = time.monotonic()
+
+    def _store(self, adr, fmt, *values):
+        struct.pack_into(fmt, self.memory, adr, *values)
+
+    def _load(self, model, serie):
+        # Identificación :
+        for adr, text in [(0x0000, model), (0x0012, '1'),
+                          (0x0024, 'CtrEst 1V0'), (0x0036, '1.0'),
+                          (0x0048, 'sim')]:
+            self._store(adr, '<18s', text.encode('latin-1'))
+
+        # EEPROM : tiempos, taps operativos, modo, ganancias y escala :
+        self._store(0xF000, '<4H', 30, 30, 5, 5)
+        self._store(0xF008, '<BB', self.taps, 0)
+        self._store(0xF00A, '<HHB', 50362, 50362, 0xC4)
+        self._store(0xF00F, '<16s', ('%9.7f' % self.scale).encode('latin-1'))
+
+        # Umbrales de los taps (inferior y superior, descendentes) :
+        for n in range(12):
+            self._store(0xF01F + 4*n, '<HH', 0x6000 - 0x400*n,
+                        0x5C00 - 0x400*n)
+
+        for adr, fmt, text in [(0xF053, '<18s', 'Simulador'),
+                               (0xF064, '<10s', '2024-01-01'),
+                               (0xF06B, '<7s', serie)]:
+            self._store(adr, fmt, text.encode('latin-1'))
+
+        self._store(0xF080, '<12B', *range(12))
+
+    def _measure(self):
+        u"""
+        Actualiza el registro de la medición (tap, LN, UV), las tensiones se
+        representan (como en la tarjeta) por el cuadrado de su valor eficaz
+        en unidades de la escala.
+        """
+        t = time.monotonic() - self._start
+        mod = 1.0 + 0.02*math.sin(2*math.pi*0.2*t)
+        tap = 1 + int(t / 10) % self.taps
+
+        samples = []
+        for v in (self.vLN, self.vUV):
+            v = v * mod * (1.0 + random.gauss(0, 0.002)) / self.scale
+            samples.append(min(0xFFFF, int(v*v)))
+
+        self._store(MEASURE_ADR, '<BHH', tap, *samples)
+        self._store(TAP_STATUS_ADR, '<H', tap)
+
+    @staticmethod
+    def _inside(adr, size, *areas):
+        return any((start <= adr) and (adr + size <= start + length)
+                   for start, length in areas)
+
+    def _reply(self, cmd, body):
+        adr, size = struct.unpack_from('<HB', body)
+
+        if cmd == GET:
+            self.gets += 1
+            if not self._inside(adr, size, FLASH, RAM, VARIABLES, EEPROM):
+                return NACK
+            if adr <= MEASURE_ADR + 4 and MEASURE_ADR < adr + size:
+                self._measure()
+
+            reply = bytearray()
+            for b in self.memory[adr:adr + size]:
+                if b in ESCAPED:
+                    reply += bytes([ESC, b ^ ESC ^ 0x55])
+                else:
+                    reply.append(b)
+            return bytes(reply) + ACK
+
+        self.sets += 1
+        if not self._inside(adr, size, RAM, VARIABLES, EEPROM):
+            return NACK
+        self.memory[adr:adr + size] = body[3:]
+        return ACK
+
+    def _send(self, request_size, reply):
+        # Tiempo de transmisión de la orden y la respuesta, y latencia :
+        delay = self.latency
+        if self.baudrate:
+            delay += (request_size + len(reply)) * 11.0 / self.baudrate
+        if delay > 0:
+            time.sleep(delay)
+
+        os.write(self._master, reply)
+
+    def run(self):
+        cmd = None
+        body = bytearray()
+        raw = 0
+        esc = False
+        while True:
+            try:
+                chunk = os.read(self._master, 4096)
+            except OSError:
+                return
+
+            for b in chunk:
+                # Los caracteres 'G' y 'S' (sin escape) solo pueden iniciar
+                # una orden :
+                if not esc and b in (GET, SET):
+                    cmd, body, raw = b, bytearray(), 1
+                    continue
+
+                if cmd is None:
+                    continue
+
+                raw += 1
+                if esc:
+                    body.append(b ^ ESC ^ 0x55)
+                    esc = False
+                elif b == ESC:
+                    esc = True
+                    continue
+                else:
+                    body.append(b)
+
+                complete = (len(body) == 3) if cmd == GET else \
+                    (len(body) >= 3) and (len(body) == 3 + body[2])
+                if not complete:
+                    continue
+
+                try:
+                    self._send(raw, self._reply(cmd, body))
+                except OSError:
+                    return
+
+                self.commands += 1
+                cmd = None
+
+    def close(self):
+        os.close(self._slave)
+        os.close(self._master)
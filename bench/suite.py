@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+suite.py
+
+Pruebas de rendimiento de la comunicación con la tarjeta, contra el simulador
+(bench.simulator) a la velocidad del puerto y con la latencia dadas :
+
+  - Conexión : identificación de la tarjeta y lectura de la escala y las
+    ganancias (EstCard()), sin la imagen persistente de la EEPROM.
+  - Lectura completa de la EEPROM (EstCard1V0.eeprom).
+  - Escritura de la tabla de umbrales (_threshold, 24 palabras / 48 bytes)
+    palabra por palabra, directa y en una escritura diferida (staged()).
+  - Lecturas de la medición por segundo (MeasureTask).
+
+Uso :
+    > python -m bench.suite [baudrate [latencia_ms [repeticiones]]]
+
+Con baudrate 0 no se limita la velocidad del puerto.
+"""
+
+import os
+import sys
+import time
+
+import common
+from common.report import report
+from otcCard.OTCCard import CardParameter
+from estCard.EstCard import EstCard, EstCard1V0
+from bench.simulator import CardSimulator
+
+
+def timed(fun, repeat):
+    u"""
+    Devuelve el menor tiempo de ejecución de fun() en repeat repeticiones.
+    """
+    best = None
+    for n in range(repeat):
+        start = time.perf_counter()
+        fun()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def threshold_words(card):
+    # Parámetros de cada palabra de la tabla de umbrales :
+    return [CardParameter(card.thresholdsAdr + 2*n, '<H', u'Umbral %d' % n)
+            for n in range(24)]
+
+
+def write_thresholds(card, words, staged):
+    def write():
+        for n, word in enumerate(words):
+            word.__set__(card, 0x5000 + n)
+
+    if staged:
+        with card.staged():
+            write()
+    else:
+        write()
+
+
+def measure_rate(card, duration):
+    card.StartMeasure()
+    start, head = time.perf_counter(), card.measure.buffer.head
+    time.sleep(duration)
+    samples = card.measure.buffer.head - head
+    elapsed = time.perf_counter() - start
+    card.StopMeasure()
+    return samples / elapsed
+
+
+def main(args):
+    baudrate = int(args[1]) if len(args) > 1 else 57600
+    latency = float(args[2]) / 1000 if len(args) > 2 else 0.001
+    repeat = int(args[3]) if len(args) > 3 else 3
+
+    report('EstBench', os.devnull)
+
+    # La imagen persistente evitaría las lecturas que se miden :
+    EstCard1V0.use_image = False
+
+    simulator = CardSimulator(latency=latency, baudrate=baudrate or None)
+    simulator.start()
+
+    print('Simulador : %s baudios, latencia %.1f ms, %s'
+          % (baudrate or 'sin límite de', latency * 1000, simulator.port))
+
+    cards = []
+
+    def connect():
+        cards.append(EstCard(simulator.port))
+
+    t = timed(connect, repeat)
+    for card in cards[:-1]:
+        card.dev.close()
+    card = cards[-1]
+    print('  Conexión                   : %8.1f ms' % (1000 * t))
+
+    t = timed(lambda: card.eeprom, repeat)
+    print('  Lectura de la EEPROM       : %8.1f ms' % (1000 * t))
+
+    words = threshold_words(card)
+    t = timed(lambda: write_thresholds(card, words, False), repeat)
+    print('  Umbrales (24 palabras)     : %8.1f ms' % (1000 * t))
+    t = timed(lambda: write_thresholds(card, words, True), repeat)
+    print('  Umbrales (diferida)        : %8.1f ms' % (1000 * t))
+
+    rate = measure_rate(card, 2.0)
+    print('  Medición                   : %8.1f lecturas/s' % rate)
+
+    card.close()
+    simulator.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
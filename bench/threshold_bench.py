@@ -0,0 +1,61 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+threshold_bench.py
+
+Mide el tiempo de la presentación de la tabla de umbrales (str(card.threshold))
+con los parámetros ya leídos (sin comunicación), y el de la conversión de
+los 24 umbrales a su valor natural, uno a uno y en una sola operación
+(ThresholdTable.naturals()), contra el simulador (bench.simulator).
+
+Uso :
+    > python -m bench.threshold_bench [repeticiones]
+"""
+
+import os
+import sys
+import timeit
+
+import common
+from common.report import report
+from estCard.EstCard import EstCard, EstCard1V0
+from bench.simulator import CardSimulator
+
+
+def best(fun, number, repeat=5):
+    u"""
+    Devuelve el menor tiempo por ejecución de fun() (en microsegundos).
+    """
+    return min(timeit.repeat(fun, number=number, repeat=repeat)) / number * 1e6
+
+
+def main(args):
+    number = int(args[1]) if len(args) > 1 else 1000
+
+    report('EstBench', os.devnull)
+    EstCard1V0.use_image = False
+
+    simulator = CardSimulator()
+    simulator.start()
+    card = EstCard(simulator.port)
+
+    # Se leen los umbrales (y el número de taps operativos) :
+    print(card.threshold)
+
+    print('Tabla de umbrales (%d taps)    : %8.1f us'
+          % (card.threshold.len, best(lambda: str(card.threshold), number)))
+
+    table = card.threshold
+    internals = table.internal
+    print('Conversión de 24 umbrales      : %8.1f us'
+          % best(lambda: [table.naturals([v])[0] for v in internals], number))
+    print('Conversión (naturals())        : %8.1f us'
+          % best(lambda: table.naturals(internals), number))
+
+    card.close()
+    simulator.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
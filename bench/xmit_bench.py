@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+xmit_bench.py
+
+Mide el número de ordenes por segundo que se completan en cada modo de trans-
+misión de OTCProtocol (XMIT_BURST y XMIT_BYTE), contra un sustituto de la
+tarjeta en un pseudo-terminal (bench.simulator).
+
+Uso :
+    > python -m bench.xmit_bench [número_de_ordenes]
+"""
+
+import os
+import sys
+import time
+
+import common
+from common.report import report
+from otcCard.OTCProtocol import OTCProtocol, XMIT_BURST, XMIT_BYTE
+from bench.simulator import CardSimulator
+
+
+def run(mode, count):
+    simulator = CardSimulator()
+    simulator.start()
+
+    dev = OTCProtocol(simulator.port, xmit_mode=mode)
+    data = bytes(range(0x20, 0x30))
+
+    start = time.perf_counter()
+    for n in range(count):
+        dev.setData(0xF000 + 16*(n % 16), data)
+    elapsed = time.perf_counter() - start
+
+    dev.close()
+    simulator.close()
+    return count / elapsed
+
+
+def main(args):
+    count = int(args[1]) if len(args) > 1 else 200
+
+    report('EstBench', os.devnull)
+
+    print('Orden SET de 16 bytes, %d ordenes :' % count)
+    for mode in [XMIT_BYTE, XMIT_BURST]:
+        print('   %-6s : %8.1f ordenes/s' % (mode, run(mode, count)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
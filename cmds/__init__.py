@@ -1,7 +1,7 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-from .backupMgmt import BackupCmd
+from .backupMgmt import BackupCmd, FleetCmd
 from .tapMgmt import SetTapCmd
 from .scaleMgmt import ScaleCmd
 from .thresholdMgmt import ThresholdCmd
@@ -9,5 +9,5 @@ from .timersMgmt import TimersCmd
 from .modeMgmt import ModeCmd
 from .gainMgmt import GainCmd
 from .calMgmt import CalCmd
-from .monMgmt import MonCmd
+from .monMgmt import MonCmd, MultiMonCmd
 from .tapOrder import OrderingTapCmd
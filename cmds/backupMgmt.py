@@ -1,9 +1,21 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import io
+import os
+import re
 import sys
+import time
+import errno
+import logging
+import collections
+from concurrent.futures import ThreadPoolExecutor
 from cmds import intelhex
 from common import openCard
+from common.report import report
+from otcCard.OTCProtocolError import OTCProtocolError
+from otcCard.OTCProtocol import com_list
+from estCard.EstCard import EstCard, EstCard1V0
 
 
 # Dirección de Inicip del Volcado de la EEPROM :
@@ -27,6 +39,11 @@ def get_dump(data) :
   return str
 
 
+# En el formato IntelHex, Microchip asigna a la EEPROM en un segmento de
+# direcciones lineal y con la dirección EEPROM_ADDRESS :
+EEPROM_ADDRESS = 0x0001E000
+
+
 def get_intelhex(data) :
   """
   Genera la representación en el formato IEEE754 del contenido de la EEPROM
@@ -40,34 +57,30 @@ def get_intelhex(data) :
   # de cada posición considerándola como de dos bytes, donde el byte LSB
   # anteceda al byte (virtual) MSB, nuevamente iniciando desde 0 y hasta 2*N-1
   # donde N es el número de bytes de la EEPROM.
+  data_16bit = bytearray(2 * len(data))
+  data_16bit[0::2] = data
 
-  data_16bit = [data[n // 2] if n % 2 == 0 else 0 for n in range(2 * len(data))]
-
-  # En el formato IntelHex, Microchip asigna a la EEPROM en un segmento de
-  # direcciones lineal y con la dirección EEPROM_ADDRESS.
-  EEPROM_ADDRESS = 0x0001E000
-
-  # Se inicia los registros IntelHex, definiendo la dirección base del segmento
-  # de direcciones lineal :
-  records = [intelhex.UlbaRecord(EEPROM_ADDRESS//65536)]
-
-  # Se continua definiendo los registros Intelhex con el contenido de la EEPROM
-  # cada 16 bytes :
-  BYTES_PER_RECORD = 16
-  for n in range(0, len(data_16bit), BYTES_PER_RECORD) :
-    records += [intelhex.DataRecord(
-               (EEPROM_ADDRESS % 65536) + (2*n + EEPROM_START),
-               [data_16bit[i] for i in range(n, n+BYTES_PER_RECORD)
-                                                      if i < len(data_16bit)])]
+  # Los registros se codifican directamente desde el contenido, con la
+  # dirección base del segmento de direcciones lineal, 16 bytes por registro
+  # y el registro de fin :
+  txt = io.StringIO()
+  intelhex.write_intelhex(txt, data_16bit, EEPROM_ADDRESS + EEPROM_START)
 
-  # Finalmente el registro de fin :
-  records += [intelhex.EndRecord()]
+  return txt.getvalue()
 
-  # Se crea la representación paramétrica del conjunto de registros ...
-  hex = intelhex.IntelHex(records)
 
-  # y se devuelve su representación textual :
-  return hex.__str__()
+def read_intelhex(txt, size) :
+  u"""
+  Devuelve el contenido de la EEPROM de size bytes, de su representación en
+  el formato IntelHex de Microchip (ver get_intelhex()). Levanta ValueError
+  si los registros no definen todo el contenido (e.g. un archivo truncado).
+  """
+  hex = intelhex.IntelHex(txt)
+  if not hex.covers(EEPROM_ADDRESS + EEPROM_START, 2 * size) :
+    raise ValueError(u'Error : El respaldo IntelHex no define los %d bytes '
+                     u'de la EEPROM (desde 0x%08X).' %
+                                       (size, EEPROM_ADDRESS + EEPROM_START))
+  return hex.memory(EEPROM_ADDRESS + EEPROM_START, 2 * size, 0x00)[0::2]
 
 
 def get_source(data) :
@@ -78,6 +91,7 @@ def get_source(data) :
   # La macro función __EPROM_DATA necesita un argumento de 8 bytes, se completa
   # el programa añadiendo bytes de valor 0x00, a fin de completar su longitud
   # de manera que sea un múltiplo de 8 :
+  data = list(data)
   if (len(data) % 8) > 0 :
     data += [0x00]*(8 - len(data) % 8)
 
@@ -91,7 +105,7 @@ def get_source(data) :
   return str
 
 
-def BackupData2str(data, format = None, backup_filename = None) :
+def BackupData2str(data, format = None, backup_filename = None, verbose = True) :
   if format is None :
     # Por defecto se presenta el contenido hexadecimal :
     txt = get_dump(data)
@@ -118,11 +132,12 @@ def BackupData2str(data, format = None, backup_filename = None) :
     if backup_filename is not None :
       with open(backup_filename, 'wb') as file :
         if (format == '-bin') :
-          file.write(str(bytearray(data)))
+          file.write(bytes(data))
         else :
           file.write(txt.encode('utf-8'))
 
-      print('Se genero el archivo : %s\n' % backup_filename)
+      if verbose :
+        print('Se genero el archivo : %s\n' % backup_filename)
     else :
       print('Advertencia : No se específico el archivo de salida.\n')
 
@@ -149,12 +164,102 @@ def BackupData2str(data, format = None, backup_filename = None) :
       sp = u'Error : Permiso de escritura rechazado.'
 
     else :
-      print('Error : %s.' % e.args[1])
+      sp = u'Error : %s.' % e.args[1]
 
     raise IOError(e.errno, sp)
 
   return txt
 
+
+def backup_format(backup_filename, raw, format = None) :
+  u"""
+  Devuelve el formato (opción) del respaldo backup_filename de contenido raw :
+  el especificado (format), el que corresponde a su extensión (ver BACKUP_
+  EXTENSIONS) o, si esta no identifica un formato legible, el que se deduce
+  del contenido : si es texto (ASCII) IntelHex o Microchip, sino binario.
+  """
+  if format is None :
+    extension = os.path.splitext(backup_filename)[1].lower()
+    format = dict((ext, f) for f, ext in BACKUP_EXTENSIONS.items()
+                  if f in RESTORE_FORMATS).get(extension)
+
+  if format is None :
+    try :
+      txt = raw.decode('ascii')
+    except UnicodeDecodeError :
+      return '-bin'
+
+    # El formato IntelHex se inicia con el marcador de registro ':' y el de
+    # Microchip es un byte (en hexadecimal) por linea :
+    if txt.lstrip().startswith(':') :
+      return '-intelhex'
+    if re.fullmatch(r'\s*(0[xX][0-9A-Fa-f]{1,2}\s+)*0[xX][0-9A-Fa-f]{1,2}\s*',
+                    txt) :
+      return '-mch'
+    return '-bin'
+
+  if format not in RESTORE_FORMATS :
+    raise ValueError(u"Error : El formato '%s' no se puede restaurar." % format)
+  return format
+
+
+def read_backup(backup_filename, size, format = None) :
+  u"""
+  Lee el contenido de size bytes del archivo de respaldo backup_filename, en
+  el formato binario (opción -bin), en el de Microchip (opción -mch) o en el
+  formato IntelHex (opción -intelhex), según format o, si no se especifica,
+  según la extensión del archivo o su contenido (ver backup_format()).
+  """
+  with open(backup_filename, 'rb') as file :
+    raw = file.read()
+
+  format = backup_format(backup_filename, raw, format)
+  if format == '-intelhex' :
+    return read_intelhex(raw.decode('ascii', 'replace'), size)
+
+  if format == '-mch' :
+    try :
+      data = bytearray(int(b, 16) for b in raw.split())
+    except ValueError :
+      raise ValueError(u'Error : El respaldo no esta en el formato de '
+                       u'Microchip.')
+  else :
+    data = bytearray(raw)
+
+  if len(data) != size :
+    raise ValueError(u'Error : El respaldo contiene %d bytes, se esperaban '
+                     u'%d bytes.' % (len(data), size))
+  return data
+
+
+def RestoreCmd(card, args) :
+  u"""
+  Restaura la EEPROM con el contenido del archivo de respaldo args[0], salvo
+  el número de serie de la tarjeta (excepto con la opción -all), en el forma-
+  to de la opción -bin, -mch o -intelhex si se especifica (ver read_backup()).
+  """
+  if len(args) < 1 :
+    print('Error : No se específico el archivo de respaldo.\n')
+    sys.exit(1)
+
+  try :
+    data = read_backup(args[0], card.eepromSize, restore_format(args[1:]))
+  except IOError as e :
+    print(u'Error : %s.' % e.strerror)
+    sys.exit(1)
+  except ValueError as e :
+    print(e.args[0])
+    sys.exit(1)
+
+  try :
+    crc = card.restore(data, keep_serie = '-all' not in args[1:])
+  except OTCProtocolError as e :
+    print(u'Error : No se pudo restaurar la configuración.')
+    card.close()
+    sys.exit(1)
+
+  print(u'Se restauro la configuración de %s (CRC 0x%08X).\n' % (args[0], crc))
+
 def BackupCmd(args, port, throughput_limit) :
   """
   EstApp : Resguardo de la configuración
@@ -166,6 +271,7 @@ def BackupCmd(args, port, throughput_limit) :
   en particular  :
      >> EstApp.py -b [-mch | -intelhex | -source | -dump [<backup_filename>] ]
      >> EstApp.py -b -bin <backup_filename>]
+     >> EstApp.py -b -restore <backup_filename> [-bin | -mch | -intelhex] [-all]
 
   Lee toda la configuración y la presenta o almacena (opcionalmente) en un archivo.
   (Es decir todo el contenido de la EEPROM del microcontrolador).
@@ -195,6 +301,15 @@ def BackupCmd(args, port, throughput_limit) :
   El nombre del archivo de resguardo es opcional, en todos los casos excepto
   en el formato binario para la cual es obligatoria.
 
+  Restauración (opción -restore)
+     Escribe en la EEPROM el contenido del archivo de respaldo en el formato
+     binario (-bin), de Microchip (-mch) o IntelHex (-intelhex), según la
+     opción o, si no se especifica, según la extensión del archivo (.bin,
+     .mch o .hex) o su contenido. Solo se escriben las páginas que difieren
+     del contenido actual y el resultado se verifica (CRC). Salvo con la opción -all, se conserva el número de
+     serie de la tarjeta, de manera que se puede copiar la configuración de
+     una tarjeta a otras.
+
   Ejemplos :
       - Respaldo de la configuración y presentación solo en la consola,
         en el formato simple :
@@ -204,9 +319,17 @@ def BackupCmd(args, port, throughput_limit) :
         formato INTELHEX :
           >> EstApp.py  -b  -intelhex  respaldo.txt
 
+      - Copia de la configuración del respaldo 'respaldo.bin' :
+          >> EstApp.py  -b  -restore  respaldo.bin
+
 """
   card = openCard(port, throughput_limit)
 
+  if (len(args) > 2) and (args[2] == '-restore') :
+    RestoreCmd(card, args[3:])
+    card.close()
+    return
+
   if len(args) > 4 :
     print('Advertencia : Demasiados argumentos.\n')
 
@@ -216,7 +339,7 @@ def BackupCmd(args, port, throughput_limit) :
   try :
     backup_txt = BackupData2str(*arg)
   except AttributeError as e :
-    print(e.message)
+    print(e.args[0])
     sys.exit(1)
   except IOError as e :
     print(e.args[1])
@@ -229,4 +352,210 @@ def BackupCmd(args, port, throughput_limit) :
   card.close()
 
 
+# Extensión de los archivos de respaldo de cada formato (ver FleetCmd()) :
+BACKUP_EXTENSIONS = {'-bin' : '.bin', '-mch' : '.mch', '-intelhex' : '.hex',
+                     '-source' : '.c', '-dump' : '.txt'}
+
+# Formatos de los respaldos que se pueden restaurar (ver read_backup()) :
+RESTORE_FORMATS = ('-bin', '-mch', '-intelhex')
+
+
+def restore_format(args) :
+  u"""
+  Devuelve la opción de formato (RESTORE_FORMATS) de los argumentos args de
+  la restauración, o None si no se especifica.
+  """
+  return next((a for a in args if a in RESTORE_FORMATS), None)
 
+# Resultado de la operación en una tarjeta de la flota, con el contenido
+# leído (contents) y el archivo de respaldo (filename) :
+FleetResult = collections.namedtuple('FleetResult',
+            'port serie model connect transfer crc contents filename error')
+
+
+def file_name(text) :
+  u"""
+  Devuelve text (número de serie o nombre del puerto) apto para el nombre de
+  un archivo.
+  """
+  return re.sub(r'[^0-9A-Za-z.-]+', '-', text).strip('-')
+
+
+def fleet_task(port, throughput_limit, data = None, keep_serie = True) :
+  u"""
+  Lee (o restaura con data, si se especifica) la EEPROM de la tarjeta conec-
+  tada al puerto port. Devuelve el resultado (FleetResult) con los tiempos de
+  la conexión y de la transferencia, los fallos se informan en el atributo
+  error.
+  """
+  card, serie, model, crc, contents = None, '', '', None, None
+  connect = transfer = None
+
+  try :
+    start = time.perf_counter()
+    card = EstCard(port, throughput_limit)
+    if not isinstance(card, EstCard1V0) :
+      return FleetResult(port, serie, model, None, None, None, None, None,
+                         u'Núcleo de software desconocido (%s).' %
+                                                   card.id['software_kernel'])
+    serie = file_name(card._serie.split('\x00')[0])
+    model = card.id['hardware_model'].strip('\x00 ')
+    connect = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if data is None :
+      contents = card.eeprom
+      crc = card.eepromRegion().crc(contents)
+    else :
+      crc = card.restore(data, keep_serie = keep_serie)
+    transfer = time.perf_counter() - start
+
+  # Cualquier fallo (del protocolo, del puerto serie o de los datos) solo
+  # afecta a esta tarjeta, y se informa en la tabla :
+  except Exception as e :
+    msg = e.msg if isinstance(e, OTCProtocolError) else \
+          u'%s: %s' % (type(e).__name__, e)
+    return FleetResult(port, serie, model, connect, transfer, None, None, None,
+                       msg.split('\n')[0])
+
+  finally :
+    if card is not None :
+      try :
+        card.close()
+      except Exception :
+        pass
+
+  return FleetResult(port, serie, model, connect, transfer, crc, contents,
+                     None, None)
+
+
+def fleet_files(results, folder, format) :
+  u"""
+  Almacena en el directorio folder los respaldos de los resultados results,
+  en archivos nominados por el número de serie de cada tarjeta (o su puerto,
+  si no lo tiene o se repite). Devuelve los resultados con el nombre del
+  archivo, o el fallo de su escritura.
+  """
+  series = collections.Counter(r.serie for r in results)
+
+  stored = []
+  for r in results :
+    if r.error is None :
+      base = r.serie if (r.serie and series[r.serie] == 1) else \
+                                 '_'.join(n for n in (r.serie, file_name(r.port)) if n)
+      filename = os.path.join(folder, base + BACKUP_EXTENSIONS[format])
+      try :
+        BackupData2str(r.contents, format, filename, verbose = False)
+        r = r._replace(filename = filename)
+      except IOError as e :
+        r = r._replace(error = e.args[-1])
+    stored.append(r)
+
+  return stored
+
+
+def fleet_summary(results) :
+  u"""
+  Devuelve la tabla (texto) de los resultados de cada tarjeta de la flota.
+  """
+  def seconds(t) :
+    return '%8.2f' % t if t is not None else '%8s' % '-'
+
+  txt = u'  %-14s %-8s %-18s %8s %8s  %-10s  %s\n' % ('Puerto', 'Serie',
+                 'Modelo', 'Conexión', 'Transf.', 'CRC', 'Resultado')
+  for r in results :
+    txt += u'  %-14s %-8s %-18s %s %s  %-10s  %s\n' % (r.port, r.serie,
+                 r.model, seconds(r.connect), seconds(r.transfer),
+                 '0x%08X' % r.crc if r.crc is not None else '-',
+                 r.error or r.filename or 'Correcto')
+
+  failed = sum(1 for r in results if r.error)
+  txt += u'\n  %d tarjetas, %d correctas, %d fallidas.\n' % (len(results),
+                 len(results) - failed, failed)
+  return txt
+
+
+def FleetCmd(args, ports, throughput_limit) :
+  u"""
+  EstApp : Respaldo y restauración de varias tarjetas
+  ===================================================
+
+  Uso :
+     >> EstApp.py -b -fleet [-port p1 -port p2 ...] [-formato] [directorio]
+     >> EstApp.py -b -fleet [-port p1 -port p2 ...] -restore <archivo>
+                                            [-bin | -mch | -intelhex] [-all]
+
+  Respalda simultáneamente (un hilo de ejecución por tarjeta) la EEPROM de
+  las tarjetas conectadas a los puertos especificados o, si no se especifi-
+  can, a todos los puertos serie del sistema. Cada respaldo se almacena en
+  el directorio especificado (por defecto el actual), en un archivo cuyo
+  nombre es el número de serie de la tarjeta, en el formato especificado
+  (-bin por defecto, -mch, -intelhex, -source o -dump).
+
+  Con la opción -restore se restaura en todas las tarjetas el archivo de
+  respaldo especificado (ver -b -restore), conservando el número de serie
+  de cada una (excepto con la opción -all).
+
+  Al terminar se presenta una tabla con los tiempos de la conexión y de la
+  transferencia, el CRC del contenido y el resultado de cada tarjeta.
+  """
+  args = args[3:]
+
+  if not ports :
+    ports = [p for p in com_list().values() if p is not None]
+  if not ports :
+    print('Error : El Sistema no tiene puertos serie.')
+    sys.exit(1)
+
+  kwargs = {}
+  if args and (args[0] == '-restore') :
+    if len(args) < 2 :
+      print('Error : No se específico el archivo de respaldo.\n')
+      sys.exit(1)
+    try :
+      kwargs['data'] = read_backup(args[1], EstCard1V0.eepromSize,
+                                   restore_format(args[2:]))
+    except IOError as e :
+      print(u'Error : %s.' % e.strerror)
+      sys.exit(1)
+    except ValueError as e :
+      print(e.args[0])
+      sys.exit(1)
+    kwargs['keep_serie'] = '-all' not in args[2:]
+
+  else :
+    format = '-bin'
+    if args and (args[0] in BACKUP_EXTENSIONS) :
+      format = args.pop(0)
+    elif args and args[0].startswith('-') :
+      print(u"Error : Formato '%s' desconocido." % args[0])
+      sys.exit(1)
+    folder = args[0] if args else '.'
+    if not os.path.isdir(folder) :
+      print('Error : No existe el directorio %s.' % folder)
+      sys.exit(1)
+
+  # El respaldo y la restauración requieren el contenido actual de cada
+  # tarjeta, no se utiliza la imagen persistente de la EEPROM (que además
+  # compartirían las tarjetas con el mismo número de serie) :
+  EstCard1V0.use_image = False
+
+  print('%s de %d tarjetas ...\n' % ('Restauración' if kwargs else 'Respaldo',
+                                     len(ports)))
+
+  # Los fallos se presentan en la tabla de resultados y no en la consola :
+  report.consoleSetLevel(logging.CRITICAL)
+  try :
+    with ThreadPoolExecutor(max_workers = len(ports)) as pool :
+      results = list(pool.map(lambda port : fleet_task(port, throughput_limit,
+                                                       **kwargs), ports))
+  finally :
+    report.consoleSetLevel(logging.ERROR)
+
+  if not kwargs :
+    results = fleet_files(results, folder, format)
+
+  print(fleet_summary(results))
+
+  if any(r.error for r in results) :
+    sys.exit(1)
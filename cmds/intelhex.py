@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 
 # IntelHex
-# version 0.0.5
+# version 0.1.0
 
 # Formato IntelHex :
 # Esta formado por un secuencia de líneas con el siguiente formato :
@@ -127,6 +127,9 @@
 # consecutivamente en cada linea del archivo. No exite especificación adicional,
 # ni siquiera de la dirección de inicio.
 
+import io
+
+
 def BuildRecord(**farg) :
    """
    Devuelve un registro en el fomato IntelHex, puede invocarse de las
@@ -158,7 +161,7 @@ def BuildRecord(**farg) :
 
    elif len(farg.keys()) == 1 :
       if 'usba' in farg.keys() :
-         if isinstance(farg['usba'], (int, long)) :
+         if isinstance(farg['usba'], int) :
             # Extended Segment Address Record (16- or 32-bit formats)
             if (farg['usba'] >= 0) and (farg['usba'] <= 0xFFFF) :
                load_offset = 0
@@ -171,7 +174,7 @@ def BuildRecord(**farg) :
 
       elif 'ulba' in farg.keys() :
          # Extended Linear Address Record (32-bit format only)
-         if isinstance(farg['ulba'], (int, long)) :
+         if isinstance(farg['ulba'], int) :
             if (farg['ulba'] >= 0) and (farg['ulba'] <= 0xFFFF) :
                load_offset = 0
                rectype = 4
@@ -183,7 +186,7 @@ def BuildRecord(**farg) :
 
       elif 'csip' in farg.keys() :
          # Start Segment Address Record (16- or 32-bit formats)
-         if isinstance(farg['csip'], (int, long)) :
+         if isinstance(farg['csip'], int) :
             if (farg['csip'] >= 0) and (farg['csip'] <= 0xFFFFFFFF) :
                load_offset = 0
                rectype = 3
@@ -194,11 +197,11 @@ def BuildRecord(**farg) :
             else :
                raise ValueError("'csip' fuera de rango.")
          else :
-            raise TypeError("'csip' debe ser del tipo int/long.")
+            raise TypeError("'csip' debe ser del tipo int.")
 
       elif 'eip' in farg.keys() :
          # Start Linear Address Record (32-bit format only)
-         if isinstance(farg['eip'], (int, long)) :
+         if isinstance(farg['eip'], int) :
             if (farg['eip'] >= 0) and (farg['eip'] <= 0xFFFFFFFF) :
                load_offset = 0
                rectype = 5
@@ -209,7 +212,7 @@ def BuildRecord(**farg) :
             else :
                raise ValueError("'eip' fuera de rango.")
          else :
-            raise TypeError("'eip' debe ser del tipo int/long.")
+            raise TypeError("'eip' debe ser del tipo int.")
 
       elif 'data' in farg.keys() :
          raise TypeError("Falta el valor del argumento 'offset'.")
@@ -226,8 +229,8 @@ def BuildRecord(**farg) :
          rectype = 0
 
          load_offset = farg['offset']
-         if not isinstance(load_offset, (int, long)) :
-            raise TypeError("'offset' debe ser del tipo int/long.")
+         if not isinstance(load_offset, int) :
+            raise TypeError("'offset' debe ser del tipo int.")
 
          info = farg['data']
 
@@ -235,8 +238,8 @@ def BuildRecord(**farg) :
             raise TypeError("'data' debe ser una lista (de bytes).")
 
          for i in range(0, len(info)) :
-            if not isinstance(info[i], (int,long)) :
-               raise TypeError("El %d-esimo valor de 'data' contiene un valor del tipo invalido (no 'int/long')." % i)
+            if not isinstance(info[i], int) :
+               raise TypeError("El %d-esimo valor de 'data' contiene un valor del tipo invalido (no 'int')." % i)
             if (info[i] < 0) or (info[i] > 255) :
                raise TypeError("El %d-esimo valor de 'data' contiene un valor fuera de rango." % i)
 
@@ -274,17 +277,20 @@ def BuildRecord(**farg) :
 # Valores del Identificador del tipos de registro :
 RecordTypeDict = {'data' : 0, 'end_of_file' : 1, 'usba' : 2, 'csip' : 3, 'ulba' : 4, 'eip' : 5}
 
+# Tipo (nombre) de registro de cada identificador :
+RecordTypeName = {id : typ for typ, id in RecordTypeDict.items()}
+
+END_RECTYPE = 'end_of_file'
+
+# Número de bytes de datos por registro (ver IntelHexWriter) :
+RECORD_SIZE = 16
+
 def WordAt(list_bytes, idx) :
-   if type(list_bytes) == 'list' :
-      val = list_bytes[idx]*256 + list_bytes[idx+1]
-   return val
+   return list_bytes[idx]*256 + list_bytes[idx+1]
 
 
-def DWordAt(list_bytes, indx) :
-   if type(list_bytes) == 'list' :
-      val = long(list_bytes[idx]*256 + list_bytes[idx+1])*65536
-      val += list_bytes[idx+2]*256 + list_bytes[idx+3]
-   return val
+def DWordAt(list_bytes, idx) :
+   return WordAt(list_bytes, idx)*65536 + WordAt(list_bytes, idx+2)
 
 def BytesOf(val, len) :
    list_bytes = [0]*len
@@ -294,10 +300,26 @@ def BytesOf(val, len) :
    return list_bytes
 
 def IsListofBytes(L) :
+   # Las secuencias de bytes (bytes, bytearray o memoryview) no requieren
+   # verificar sus elementos :
+   if isinstance(L, (bytes, bytearray, memoryview)) :
+      return True
    return (isinstance(L, (list, tuple)) and
             all([isinstance(x, (int)) and (x >= 0) and (x < 256) for x in L]))
 
 
+def EncodeRecord(rectype, offset, info) :
+   '''
+   Devuelve la línea (terminada en '\n') del registro del tipo rectype
+   (identificador), con el campo LOAD OFFSET offset y el campo INFO info
+   (secuencia de bytes).
+   '''
+   rec = bytearray((len(info), offset >> 8, offset & 0xFF, rectype))
+   rec += info
+   rec.append(-sum(rec) & 0xFF)
+   return ':' + rec.hex().upper() + '\n'
+
+
 class IntelHexRecord(object) :
    '''
    Clase base para la representación paramétrica de los registros IntelHex.
@@ -311,15 +333,8 @@ class IntelHexRecord(object) :
       '''
       Devuelve la representación en el formato IntelHex del registro.
       '''
-      chksum = 256 - ((len(self.info) + (self.offset//256) + (self.offset % 256) +
-                              RecordTypeDict[self.typ] + sum(self.info)) % 256)
-
-      return ':' +                                                  \
-             '{0:02X}'.format(len(self.info)) +                     \
-             '{0:04X}'.format(self.offset) +                        \
-             '{0:02X}'.format(RecordTypeDict[self.typ]) +           \
-             ''.join(['{0:02X}'.format(b) for b in self.info]) +    \
-             '{0:02X}'.format(chksum)
+      return EncodeRecord(RecordTypeDict[self.typ], self.offset,
+                          bytes(self.info))[:-1]
 
    @staticmethod
    def __parse_record(rec_txt) :
@@ -330,38 +345,34 @@ class IntelHexRecord(object) :
       if (len(rec_txt) == 0) or (rec_txt[0] != ':') :
          raise ValueError(u'El registro no se inicia con el caracter ":".')
 
-      # Elimina los espacios en blanco al final del texto del registro :
-      rec_str = rec_txt.rstrip()
-
-      # Separa los caracteres que definen los bytes del formato ...
-      bytes_str = [rec_txt[i:i+2] for i in range(1, len(rec_str.rstrip()), 2)]
-
-      # y los convierte a sus valores :
+      # Elimina los espacios en blanco al final del texto del registro y
+      # convierte los pares de caracteres a los bytes que representan :
       try :
-         bytes = list(map(int, bytes_str, [16 for i in range(0, len(bytes_str))]))
+         bytes_ = bytes.fromhex(rec_txt[1:].rstrip())
       except ValueError as e :
-         raise ValueError(u'%s no puede interpretarse como un byte' % e.args[0][-5:-1])
+         raise ValueError(u'El registro contiene caracteres que no pueden '
+                          u'interpretarse como bytes (%s).' % e.args[0])
 
       # Verifica que el registro defina el mínimo de bytes requeridos :
-      if len(bytes) < 5 :
+      if len(bytes_) < 5 :
          raise ValueError(u'El registro es muy corto.')
 
       # Identifica los campos del registro :
-      rec_len = bytes[0]
-      offset = bytes[1]*256 + bytes[2]
+      rec_len = bytes_[0]
+      offset = bytes_[1]*256 + bytes_[2]
 
       try :
-         typ = [typ for typ, id in RecordTypeDict.items() if id == bytes[3]][0]
-      except IndexError as e :
-         raise ValueError(u'El byte de tipo %02X es inválido.')
+         typ = RecordTypeName[bytes_[3]]
+      except KeyError as e :
+         raise ValueError(u'El byte de tipo %02X es inválido.' % bytes_[3])
 
-      info = bytes[4 : len(bytes) - 1]
-      chksum = bytes[-1]
+      info = bytes_[4 : -1]
+      chksum = bytes_[-1]
 
       # Verifica que la longitud del registro sea coherente con la carga del
       # registro :
       if rec_len != len(info) :
-         ValueError(u'La longitud del registro no es coherente.')
+         raise ValueError(u'La longitud del registro no es coherente.')
 
       # Verifica que el registro final tenga el formato correcto :
       if (typ == END_RECTYPE) and ((len(info) != 0) or
@@ -369,11 +380,9 @@ class IntelHexRecord(object) :
          raise ValueError('Registro \'End_of_File\' con mal formato.')
 
       # Verifica la suma de verificación :
-      if (sum(bytes) % 256) != 0 :
+      if (sum(bytes_) % 256) != 0 :
          raise ValueError('La suma de verificación es incorrecta.')
 
-      # [TO DO] Comprobar que los registros del tipo ISBA y ULBA tienen el formato correcto
-
       if typ == 'data' :
          return DataRecord(offset, info)
 
@@ -394,41 +403,46 @@ class IntelHexRecord(object) :
          elif typ == 'csip' :
             if len(info) != 4 :
                raise ValueError(u'En los registros del tipo CSIP el campo info/load debe contener 4 bytes')
-            return CsipRecord(info)
+            return CsipRecord(list(info))
 
          elif typ == 'eip' :
             if len(info) != 4 :
                raise ValueError(u'En los registros del tipo EIP el campo info/load debe contener 4 bytes')
-            return EipRecord(info)
+            return EipRecord(list(info))
 
          elif typ == 'end_of_file' :
-            if len(info) != 0 :
-               raise ValueError(u'En los registros del tipo End Of File el campo info/load debe estar vacio (no contiene ningún byte).')
             return EndRecord()
 
 
    @staticmethod
-   def parse(txt) :
+   def iterparse(lines) :
       '''
-      Interpreta el texto importado como una lista de registros IntelHex,
-      devuelve la lista de registros de la subclase de IntelHexRecord
-      correspondientes.
+      Interpreta las líneas lines (texto o un iterable de líneas, por ejemplo
+      un archivo abierto) como registros IntelHex, y produce (generador) los
+      registros de la subclase de IntelHexRecord correspondientes, sin
+      retener el texto, para los archivos de varios megabytes (e.g. las
+      imágenes de la memoria flash).
       '''
-      record_list = []
-      line_list = txt.splitlines()
-      rec_typ = None
-      line_num = 0
-      for line in line_list :
-         line_num += 1
+      if isinstance(lines, str) :
+         lines = lines.splitlines()
+
+      for line_num, line in enumerate(lines, 1) :
          # Se verifica si la linea debe ser ignorada :
          if (len(line) == 0) or (line[0] in [';','#']) or (line[0:2] == '//')  or (line.strip() == '') :
             continue
          try :
-            record_list.append(IntelHexRecord.__parse_record(line))
+            yield IntelHexRecord.__parse_record(line)
          except ValueError as e :
             raise ValueError(u'INTELHEX Error en la linea %d : %s' %(line_num, e))
 
-      return record_list
+   @staticmethod
+   def parse(txt) :
+      '''
+      Interpreta el texto importado (o un iterable de líneas, ver iterparse())
+      como una lista de registros IntelHex, devuelve la lista de registros de
+      la subclase de IntelHexRecord correspondientes.
+      '''
+      return list(IntelHexRecord.iterparse(txt))
 
 # [TO DO] : Verificar que los argumentos sean del tipo válido.
 class EndRecord(IntelHexRecord) :
@@ -519,38 +533,28 @@ class CsipRecord(IntelHexRecord) :
       self.typ = 'csip'
 
       if type(csip) == dict :
-         self.info = BytesOf(csip['cs'])
-         self.info.append(BytesOf(csip['ip']))
+         self.info = BytesOf(csip['cs'], 2) + BytesOf(csip['ip'], 2)
 
       elif type(csip) in [int] :
          self.info = BytesOf(csip, 4)
 
-      elif IsListofBytes(eip):
-         self.info = csip[0:4]
-         self.info = ([0]*(4 - len(csip)) + csip)
+      elif IsListofBytes(csip):
+         self.info = ([0]*(4 - len(csip)) + list(csip[0:4]))
 
       else :
          raise ValueError(u'CsipRecord.__init__ invocado con un argumento de tipo inválido.')
 
 
 class EipRecord(IntelHexRecord) :
-   def __init__(self, csip) :
-      '''
-
-      '''
+   def __init__(self, eip) :
       IntelHexRecord.__init__(self)
       self.typ = 'eip'
 
-      if (type(eip) == dict) and (eip.keys() or ('cs','ip')) == ('cs','ip') :
-         self.info = BytesOf(eip['cs'])
-         self.info.append(BytesOf(eip['ip']))
-
-      elif type(eip) in [int] :
+      if type(eip) in [int] :
          self.info = BytesOf(eip, 4)
 
       elif IsListofBytes(eip):
-         self.info = eip[0:4]
-         self.info = ([0]*(4 - len(eip)) + eip)
+         self.info = ([0]*(4 - len(eip)) + list(eip[0:4]))
 
       else :
          raise ValueError(u'EipRecord.__init__ invocado con un argumento de tipo inválido.')
@@ -558,7 +562,8 @@ class EipRecord(IntelHexRecord) :
 
 class BytesRange(object) :
    '''
-   Contenedor de una secuencia continua de bytes.
+   Contenedor de una secuencia continua de bytes (bytearray), desde la
+   dirección start hasta la dirección end (inclusive).
    '''
    def __init__(self, base_adr, rec) :
       if not(type(base_adr) in [int]) or (base_adr < 0):
@@ -567,12 +572,12 @@ class BytesRange(object) :
       if IsListofBytes(rec) :
             self.start = base_adr
             self.end   = self.start + len(rec) - 1
-            self.bytes = rec
+            self.bytes = bytearray(rec)
 
       elif type(rec) == DataRecord :
          self.start = base_adr + rec.offset
          self.end   = self.start + len(rec.info) - 1
-         self.bytes = rec.info
+         self.bytes = bytearray(rec.info)
 
       else :
          raise ValueError(u'BytesRange.__init__ : El segundo argumento no es un registro o lista/tupla de bytes.')
@@ -597,7 +602,7 @@ class BytesRange(object) :
    def IsOverlaping(self, bytes_range) :
       if type(bytes_range) != BytesRange :
          raise ValueError(u'BytesRange.Append : El argumento es de un tipo inválido.')
-      return ((self.start >= bytes_range.end) and (bytes_range.start >= self.end))
+      return ((self.start <= bytes_range.end) and (bytes_range.start <= self.end))
 
    def IsPreceding(self, bytes_range) :
       if type(bytes_range) != BytesRange :
@@ -607,63 +612,169 @@ class BytesRange(object) :
 class BytesBlock(object) :
    '''
    Contenedor de secuencias de bytes.
+
+   Las secuencias agregadas (add() y addBytes()) solo se registran, y se
+   ordenan por su dirección y se unen las adyacentes una sola vez, al
+   consultar el contenido (data), de manera que la adición de n registros
+   es de orden O(n log n) (y O(n) si se agregan en orden, como en los
+   archivos IntelHex usuales).
    '''
    def __init__(self, adr = None) :
       self.base_adr = adr
-      self.data = []
 
-   # TO DO : si rec es una lista de bytes debe incluirse como argumento adicional
-   # el offset
+      # Secuencias ordenadas y unidas, y las agregadas desde entonces :
+      self._data = []
+      self._pending = []
+
    def add(self, rec) :
       if self.base_adr is None :
          raise ValueError('BytesBlock.add invocada sin haber definido la dirección base.')
 
       if IsListofBytes(rec) :
-         raise ValueError('[TO DO] : BytesBlock.add invocada con una lista de bytes,\n debe incluirse el offset.')
+         raise ValueError('BytesBlock.add invocada con una lista de bytes, '
+                          'debe utilizarse addBytes().')
 
-      # Se calcula el rango de direcciones que cubre el registro :
-      new_data = BytesRange(self.base_adr, rec)
+      self._pending.append(BytesRange(self.base_adr, rec))
 
-      if self.data == [] :
-         self.data = [new_data]
+   def addBytes(self, adr, data) :
+      '''
+      Agrega la secuencia de bytes data desde la dirección (absoluta) adr.
+      '''
+      self._pending.append(BytesRange(adr, data))
 
-      else :
-         for i in range (len(self.data)) :
-            if new_data.IsPostAdjacent(self.data[i]) :
-                self.data[i].Append(new_data)
-                if (i+1) < len(self.data) :
-                   if self.data[i].IsOverlaping(self.data[i+1]) :
-                      raise ValueError('Los registros se sobreponen.')
-
-                   if self.data[i+1].IsPostAdjacent(self.data[i]) :
-                      self.data[i].Append(self.data.pop(i+1))
-                return
-
-            elif self.data[i].IsOverlaping(self.data[i]) :
-               raise ValueError('Los registros se sobreponen.')
-
-            elif new_data.IsPreceding(self.data[i]) :
-              break ;
-
-         if self.data[i].IsPostAdjacent(new_data) :
-            new_data.Append(self.data[i])
-            self.data[i] = new_data
-         else :
-            self.data.insert(i, new_data)
+   @property
+   def data(self) :
+      '''
+      Lista de las secuencias (BytesRange) del contenido, ordenadas por su
+      dirección, las secuencias adyacentes se unen en una sola. Levanta
+      ValueError si las secuencias se sobreponen.
+      '''
+      if self._pending :
+         ranges = self._data + self._pending
+         ranges.sort(key = lambda r : r.start)
+         self._pending = []
+
+         merged = []
+         for r in ranges :
+            if len(r.bytes) == 0 :
+               continue
+            if merged and (r.start <= merged[-1].end) :
+               raise ValueError('Los registros se sobreponen (0x%X).' % r.start)
+            if merged and merged[-1].IsPriorAdjacent(r) :
+               merged[-1].Append(r)
+            else :
+               merged.append(r)
+         self._data = merged
+
+      return self._data
+
+   def covers(self, adr, size) :
+      '''
+      Indica si todos los bytes de los size bytes desde la dirección adr
+      están definidos.
+      '''
+      return any((r.start <= adr) and (adr + size - 1 <= r.end)
+                 for r in self.data)
+
+   def memory(self, adr, size, fill = 0xFF) :
+      '''
+      Devuelve el contenido (bytearray) de los size bytes desde la dirección
+      adr, los bytes no definidos se completan con fill.
+      '''
+      memory = bytearray([fill]) * size
+      for r in self.data :
+         start, end = max(r.start, adr), min(r.end + 1, adr + size)
+         if start < end :
+            memory[start - adr : end - adr] = r.bytes[start - r.start : end - r.start]
+      return memory
+
+
+class IntelHexWriter(object) :
+   '''
+   Codificador IntelHex, escribe los registros en el archivo (de texto) file
+   a medida que se agregan los bytes (write()), directamente desde su
+   memoria (bytes, bytearray o memoryview) y sin construir los registros
+   (IntelHexRecord). Los registros ULBA (o USBA, si segmented) se emiten
+   cuando la dirección cambia de segmento de 64 Kbytes. Finalmente close()
+   emite el registro 'End of File'.
+   '''
+   # Número de líneas que se escriben a la vez en el archivo :
+   lines_per_write = 1024
+
+   def __init__(self, file, record_size = RECORD_SIZE, segmented = False) :
+      self.file = file
+      self.record_size = record_size
+      self.segmented = segmented
+
+      # Dirección base del segmento en curso :
+      self.base_adr = None
+
+   def _base(self, base_adr) :
+      '''
+      Devuelve el registro de la dirección base base_adr (ULBA o USBA).
+      '''
+      if self.segmented :
+         return EncodeRecord(RecordTypeDict['usba'], 0,
+                             (base_adr >> 4).to_bytes(2, 'big'))
+      return EncodeRecord(RecordTypeDict['ulba'], 0,
+                          (base_adr >> 16).to_bytes(2, 'big'))
+
+   def write(self, adr, data) :
+      '''
+      Codifica la secuencia de bytes data desde la dirección adr.
+      '''
+      view = memoryview(data).cast('B')
+      data_type = RecordTypeDict['data']
+
+      lines = []
+      n = 0
+      while n < len(view) :
+         base_adr = (adr + n) & ~0xFFFF
+         if base_adr != self.base_adr :
+            lines.append(self._base(base_adr))
+            self.base_adr = base_adr
+
+         offset = (adr + n) - base_adr
+         length = min(self.record_size, len(view) - n, 0x10000 - offset)
+         lines.append(EncodeRecord(data_type, offset, view[n : n + length]))
+         n += length
+
+         if len(lines) >= self.lines_per_write :
+            self.file.write(''.join(lines))
+            lines = []
+
+      self.file.write(''.join(lines))
+
+   def start(self, record) :
+      '''
+      Emite el registro de la dirección de ejecución record (CsipRecord o
+      EipRecord).
+      '''
+      self.file.write(str(record) + '\n')
+
+   def close(self) :
+      self.file.write(str(EndRecord()) + '\n')
+
+
+def write_intelhex(file, data, adr = 0, record_size = RECORD_SIZE) :
+   '''
+   Escribe en el archivo (de texto) file la representación IntelHex de la
+   secuencia de bytes data, desde la dirección (lineal) adr.
+   '''
+   writer = IntelHexWriter(file, record_size)
+   writer.write(adr, data)
+   writer.close()
 
 
-# [TO DO] : Clase IntelHex
-# Creación y Adición de contenido de memoria.
-# Creación y Adición de una secuencia de registros Intelhex (IntelHexRecord)
-#
-#
-#
-#
 class IntelHex(object) :
    '''
    Clase de soporte para la traducción y/o generación de texto en formato
    IntelHex y el contenido de memoria (lineal y virtual) que representa
    (adicionalmente de las direcciones de arranque lineal y virtual).
+
+   Se crea desde una lista de registros (IntelHexRecord), del texto en el
+   formato IntelHex o de un archivo (de texto) abierto, que se interpreta
+   línea a línea.
    '''
    def __init__(self, arg1, arg2 = None) :
       self.ulba = BytesBlock()
@@ -676,36 +787,20 @@ class IntelHex(object) :
             raise ValueError('Error : Algunos elementos del primer argumento no son registros IntelHex.')
          records = arg1
 
-      elif type(arg1) == str :
-         # Se identifican los registros del texto, para obtener la representación
-         # paramétrica de todos :
-         records = IntelHexRecord.parse(txt)
+      else :
+         # Se identifican los registros del texto (o de las líneas del
+         # archivo), a medida que se agregan :
+         records = IntelHexRecord.iterparse(arg1)
 
       self.addRecords(records)
 
-   def addULBAbytes(arg1, arg2= None) :
+   @classmethod
+   def fromfile(cls, filename) :
       '''
-      Agrega una (lista de) secuencia(s) de bytes al contenido de memoria del
-      tipo lineal. Se invoca de dos formas :
-        addBytes(L[0:n]), donde L[i] tiene la forma [start_address, byte[0:m]]
-      si n = 1, puede invocarse directamente :
-        addBytes(start_address, byte[0:n])
+      Devuelve el contenido del archivo IntelHex filename.
       '''
-      # [TO DO] Editar IntelHex.addULBAbytes()
-      pass
-
-
-   def addUSBAbytes(arg1, arg2= None) :
-      '''
-      Agrega una (lista de) secuencia(s) de bytes al contenido de memoria del
-      tipo lineal. Se invoca de dos formas :
-        addBytes(L[0:n]), donde L[i] tiene la forma [start_address, byte[0:m]]
-      si n = 1, puede invocarse directamente :
-        addBytes(start_address, byte[0:n])
-      '''
-      # [TO DO] Editar IntelHex.addUSBAbytes()
-      pass
-
+      with open(filename, 'r') as file :
+         return cls(file)
 
    def addRecords(self, records) :
       data_typ_parsing = None
@@ -716,9 +811,10 @@ class IntelHex(object) :
             elif data_typ_parsing == 'usba' :
                self.usba.add(rec)
             else :
-               ValueError('Error : Registro de datos (Data Record) sin asignación previa del tipo de memoria (i.e. sin un registro del tipo ULBA o USBA).')
-
-
+               # Sin un registro ULBA o USBA previo, la dirección base es 0 :
+               self.ulba.base_adr = 0
+               data_typ_parsing = 'ulba'
+               self.ulba.add(rec)
 
          elif rec.typ == 'end_of_file' :
             # [TO DO] : Verificar que no existan mas registros.
@@ -736,63 +832,60 @@ class IntelHex(object) :
             if self.csip  == None :
                self.csip = rec
             else :
-               ValueError('Error : Asignación CSIP duplicada.')
+               raise ValueError('Error : Asignación CSIP duplicada.')
 
          elif rec.typ == 'eip' :
             if self.eip  == None :
                self.eip = rec
             else :
-               ValueError('Error : Asignación EIP duplicada.')
-
-
-   def __str__(self) :
-      txt = ''
-      # Codifica la memoria ULBA :
-      if self.ulba.data != [] :
-         base_adr = self.ulba.data[0].start & 0xFFFF0000
-         txt += UlbaRecord(base_adr//65536).__str__() + '\n'
+               raise ValueError('Error : Asignación EIP duplicada.')
 
-         for data_range in self.ulba.data :
-            adr = data_range.start
+      # Se ordenan y unen las secuencias agregadas (y se verifica que no se
+      # sobrepongan) :
+      self.ulba.data
+      self.usba.data
 
-            while adr < data_range.end :
-               if (adr - base_adr) >= 0x10000 :
-                  base_adr += adr & 0xFFFF0000
-                  txt += UlbaRecord(base_adr//65536).__str__() + '\n'
-                  continue
+   def memory(self, adr, size, fill = 0xFF) :
+      '''
+      Devuelve el contenido (bytearray) de la memoria lineal de size bytes
+      desde la dirección adr, los bytes no definidos se completan con fill.
+      '''
+      return self.ulba.memory(adr, size, fill)
 
-               length = min(16, data_range.end + 1 - adr, base_adr + 0x10000 - adr)
-               txt += DataRecord(adr - base_adr, data_range.bytes[adr - data_range.start : ], length).__str__() + '\n'
+   def covers(self, adr, size) :
+      '''
+      Indica si todos los bytes de la memoria lineal de size bytes desde la
+      dirección adr están definidos.
+      '''
+      return self.ulba.covers(adr, size)
 
-               adr += length
+   def write(self, file) :
+      '''
+      Escribe la representación IntelHex del contenido en el archivo (de
+      texto) file.
+      '''
+      # Codifica la memoria ULBA :
+      writer = IntelHexWriter(file)
+      for data_range in self.ulba.data :
+         writer.write(data_range.start, data_range.bytes)
 
       # Codifica la memoria USBA :
-      if self.usba.data != [] :
-         base_adr = self.ulba.data[0].start & 0xFFFFFFF0
-         txt += UsbaRecord(base_adr//16).__str__() + '\n'
-
-         for data_range in self.usba.data :
-            adr = data_range.start
-            while adr < data_range.end :
-               if (adr - base_adr) >= 0x10000 :
-                  base_adr += adr & 0xFFFFFFF0
-                  txt += UlbaRecord(base_adr//16).__str__() + '\n'
-                  continue
-
-               length = min(16, data_range.end + 1 - adr, base_adr + 0x10000 - adr)
-               txt += DataRecord(adr - base_adr, data_range[adr - data_range.start : ], length).__str__() + '\n'
-
-               adr += length
+      writer = IntelHexWriter(file, segmented = True)
+      for data_range in self.usba.data :
+         writer.write(data_range.start, data_range.bytes)
 
       # Codifica la dirección de ejecución real (CSIP) :
       if self.csip is not None :
-         txt += self.csip.__str__() + '\n'
+         writer.start(self.csip)
 
-      # Codifica la dirección de ejecución real (CSIP) :
+      # Codifica la dirección de ejecución lineal (EIP) :
       if self.eip is not None :
-         txt += self.eip.__str__() + '\n'
+         writer.start(self.eip)
 
       # Fin del registro
-      txt += EndRecord().__str__() + '\n'
+      writer.close()
 
-      return txt
+   def __str__(self) :
+      txt = io.StringIO()
+      self.write(txt)
+      return txt.getvalue()
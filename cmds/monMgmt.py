@@ -4,59 +4,111 @@
 import sys
 from common import openCard
 from estCard.EstCard import *
+import os
 import queue
+import asyncio
+import logging
 import threading
+from estCard.Capture import CaptureWriter, to_csv
+from estCard.AsyncMeasure import AsyncMeasure
+from otcCard.AsyncOTCProtocol import AsyncOTCProtocol
+from common.report import report
 from datetime import datetime
 from time import sleep
 
 class RecordReadingTask(threading.Thread) :
+  u"""
+  Registra las mediciones en la captura (ver estCard.Capture) filename, en
+  bloques de las mediciones de cada block_period segundos.
+  """
+  block_period = 0.5
+
   def __init__(self, card, filename) :
     self.card = card
     self.filename = filename
 
-    # Abre el archivo ...
+    # Abre el archivo de la captura, con la cabecera con la identificación del
+    # modelo de la tarjeta, escala y ganancias de las entradas de tensión :
     try :
-      self.file = open(filename, 'w')
-    except :
+      self.capture = CaptureWriter(filename, card)
+    except Exception :
       print('El archivo "%s" no se pudo abrir.' %self.filename)
-
-    # y define la cabecera con la identificación del modelo de la tarjeta,
-    # escala  y ganancias de las entradas de tensión.
-    try :
-      self.file.write('# Modelo       : %s\n' %card.id['hardware_model'])
-      self.file.write('# Escala       : %s\n' % card.scale)
-      for g in map(lambda x : '_gain%s' %x , card.inputs_available()) :
-        self.file.write('# Ganancia %s-N : %d\n' %(g[-1], getattr(card, g)))
-      self.file.write('# Hora         : %s\n#\n' % str(datetime.now()))
-      self.file.write('#  TAP   V(L-N)   V(U-V) \n')
-
-    except :
-      print("No se pudo escribir en el archivo de registro.")
       sys.exit(1)
 
     # Se prepara el hilo de ejecución, para su arranque :
     threading.Thread.__init__(self)
 
-    self.setDaemon(True)
-    self.started = False
+    self.daemon = True
+    self.stopped = threading.Event()
 
   def run(self) :
-    self.started = True
-    while self.started :
-      if not self.card.measure.queue.empty() :
-        measure = self.card.measure.queue.get()
-        try  :
-          self.file.writelines('%5d,%8d,%8d\n' %(measure[0], measure[1],
-                                                                measure[2]))
-        except :
-          print("No se pudo escribir en el archivo de registro.")
-          break
-      sleep(0.001)
-
-    self.file.close()
+    ring = self.card.measure.buffer
+    cursor = ring.cursor(oldest = True)
+    while True :
+      # Se escriben los registros pendientes (en bloques) y se espera el
+      # siguiente periodo (o que se detenga la medición) :
+      done = ring.closed or self.stopped.is_set()
+      try :
+        while True :
+          seq, view = cursor.drain()
+          if not view : break
+          self.capture.write_block(view, seq)
+      except Exception :
+        print("No se pudo escribir en el archivo de registro.")
+        break
+
+      if done : break
+      self.stopped.wait(self.block_period)
+
+    cursor.close()
+    self.capture.close()
+
+    if cursor.dropped :
+      print('Se perdieron %d registros (de %d).' %(cursor.dropped, ring.head))
 
   def stop(self) :
-    self.started = False
+    self.stopped.set()
+
+
+def ReplayCapture(args) :
+  if len(args) < 1 :
+    print('Error : Falta el nombre de la captura.')
+    sys.exit(1)
+
+  # En la captura multiplexada se reproduce cada tarjeta :
+  try :
+    from estCard.Replay import CaptureReplay
+    replays = [CaptureReplay(args[0])]
+    cards = len(replays[0].capture.metadata.get('cards', [None]))
+    replays += [CaptureReplay(args[0], card) for card in range(1, cards)]
+  except ImportError :
+    print('Error : La reproducción de las capturas requiere numpy.')
+    sys.exit(1)
+  except (OSError, ValueError) as e :
+    print('Error : No se pudo abrir "%s" (%s).' %(args[0], e))
+    sys.exit(1)
+
+  start_time = replays[0].metadata['start_time']
+  start = start_time + float(args[1]) if len(args) > 1 else None
+  end = start_time + float(args[2]) if len(args) > 2 else None
+
+  for replay in replays :
+    print('Captura %s%s : %s, %d registros.\n'
+          %(args[0], '' if replay.card is None else ' [%d]' %replay.card,
+            replay.metadata['model'], len(replay)))
+
+    for phase in ('LN', 'UV') :
+      stats = replay.statistics(phase, start, end)
+      if stats.count() :
+        print('[%s] rms %.1f, max %.1f, min %.1f, [%d]'
+              %(phase, stats.rms(), stats.max(), stats.min(), stats.count()))
+
+    print('\n   Desde    Hasta  TAP')
+    for t0, t1, tap in replay.tap_intervals(start, end) :
+      print('%8.1f %8.1f  %3d' %(t0 - start_time, t1 - start_time, tap))
+    print('')
+
+    replay.close()
 
 
 def MonCmd(args, port, throughput_limit) :
@@ -66,21 +118,62 @@ def MonCmd(args, port, throughput_limit) :
 
     Uso :
       >> EstApp.py -mon [log_file]
+      >> EstApp.py -mon csv capture_file [csv_file]
+      >> EstApp.py -mon replay capture_file [desde hasta]
+      >> EstApp.py -mon -port puerto_1 -port puerto_2 ... [log_file]
 
     Presenta en la consola la medición y las estadísticas básicas de las
     tensiones LN y UV, a una taza de 1 seg.
 
-     Simultáneamente registra el resultado en el archivo log_file (por
-     defecto 'cycle_sampling.csv') de cada lectura.
+     Simultáneamente registra el resultado de cada lectura en la captura
+     (formato binario) log_file, por defecto 'cycle_sampling.cap'. Si el
+     nombre de log_file termina en '.csv', al finalizar además se convierte
+     al formato CSV.
+
+     La segunda forma convierte la captura capture_file al formato CSV, en
+     el archivo csv_file (por defecto el mismo nombre con la extensión .csv).
+
+     La tercera forma presenta las estadísticas de las tensiones LN y UV y
+     los intervalos de cada tap de la captura capture_file, entre los segun-
+     dos desde y hasta (desde el inicio de la captura), por defecto toda la
+     captura. Requiere numpy.
+
+     La última forma monitorea simultáneamente varias tarjetas, desde un solo
+     hilo de ejecución, en una sola captura multiplexada (ver MultiMonCmd).
 
 
   """
 
+  # Conversión de una captura al formato CSV :
+  if (len(args) > 2) and (args[2] == 'csv') :
+    if len(args) < 4 :
+      print('Error : Falta el nombre de la captura.')
+      sys.exit(1)
+
+    csv_name = args[4] if len(args) > 4 else os.path.splitext(args[3])[0] + '.csv'
+    try :
+      to_csv(args[3], csv_name)
+    except (OSError, ValueError) as e :
+      print('Error : No se pudo convertir "%s" (%s).' %(args[3], e))
+      sys.exit(1)
+
+    print('La captura se convirtió en %s' %csv_name)
+    return
+
+  # Reproducción (análisis) de una captura :
+  if (len(args) > 2) and (args[2] == 'replay') :
+    ReplayCapture(args[3:])
+    return
+
   card = openCard(port, throughput_limit)
 
   # Verifica los parámetros de trabajo :
 
-  filename = args[2] if len(args) > 2 else 'cycle_sampling.csv'
+  filename = args[2] if len(args) > 2 else 'cycle_sampling.cap'
+  csv_name = None
+  if filename.lower().endswith('.csv') :
+    filename, csv_name = os.path.splitext(filename)[0] + '.cap', filename
+
   record_task = RecordReadingTask(card, filename)
 
   print('El registro de muestreo por ciclo se almacenará en %s\n' %filename)
@@ -101,20 +194,146 @@ def MonCmd(args, port, throughput_limit) :
     while card.measure.is_alive() :
       sleep(1.000)
 
-      # Captura las lecturas de tensión :
-      vLN = str(card.LN)
-      vUV = str(card.UV)
-
-      # Se requiere que las estádisticas no sean acumuladas en todo el
-      # periodo de medición, sino con cada lectura :
-      card.LN.stats.arm()
-      card.UV.stats.arm()
+      # Captura las lecturas de tensión desde la presentación anterior (no
+      # acumuladas en todo el periodo de medición) :
+      card.LN.lap()
+      card.UV.lap()
+      vLN = card.LN.text(window = Measure_Statistics.LAP)
+      vUV = card.UV.text(window = Measure_Statistics.LAP)
 
       # Presenta los resultados en la consola :
-      print('[L-N] %s, [U-V] %s, [%2d]' %(vLN, vUV, card.LN.stats._count))
+      print('[L-N] %s, [U-V] %s, [%2d]' %(vLN, vUV,
+                          card.LN.stats.count(window = Measure_Statistics.LAP)))
 
   except KeyboardInterrupt :
       pass
 
   record_task.stop()
   card.close()
+  record_task.join()
+
+  if csv_name is not None :
+    to_csv(filename, csv_name)
+    print('El registro se convirtió en %s' %csv_name)
+
+
+def MultiMonCmd(args, ports, throughput_limit) :
+  u"""
+    EstApp : Monitor de Tensión de varias tarjetas
+    ==============================================
+
+    Uso :
+      >> EstApp.py -mon -port puerto_1 -port puerto_2 ... [log_file]
+
+    Presenta en la consola la medición de las tensiones LN y UV de cada una
+    de las tarjetas, una línea por tarjeta a una taza de 1 seg, y registra
+    las lecturas de todas ellas en una sola captura (multiplexada) log_file,
+    por defecto 'cycle_sampling.cap'.
+
+    Todas las tarjetas se atienden desde un solo hilo de ejecución (asyncio).
+  """
+
+  filename = args[2] if len(args) > 2 else 'cycle_sampling.cap'
+  csv_name = None
+  if filename.lower().endswith('.csv') :
+    filename, csv_name = os.path.splitext(filename)[0] + '.cap', filename
+
+  # Se identifican las tarjetas (y se leen su escala y ganancias) por medio
+  # de la comunicación sincrónica habitual :
+  cards = []
+  for port in ports :
+    card = openCard(port, throughput_limit, report = False)
+    print('[%s] %s' %(port, card.id['hardware_model']))
+    cards.append(card)
+
+  try :
+    capture = CaptureWriter(filename, cards)
+  except Exception :
+    print('El archivo "%s" no se pudo abrir.' %filename)
+    sys.exit(1)
+
+  print('\nEl registro de muestreo se almacenará en %s\n' %filename)
+
+  # Los puertos se liberan, para la comunicación asíncrona :
+  for card in cards :
+    card.dev.close()
+
+  # Durante la medición se toleran errores, solo los críticos se presentan en
+  # la consola (como en MeasureTask) :
+  report.consoleSetLevel(logging.CRITICAL)
+  try :
+    asyncio.run(_multi_monitor(cards, ports, capture, throughput_limit))
+  except KeyboardInterrupt :
+    pass
+  finally :
+    report.consoleSetLevel(logging.ERROR)
+
+  capture.close()
+  for card in cards :
+    card.close()
+
+  if csv_name is not None :
+    to_csv(filename, csv_name)
+    print('El registro se convirtió en %s' %csv_name)
+
+
+async def _multi_monitor(cards, ports, capture, throughput_limit) :
+  loop = asyncio.get_running_loop()
+
+  measures = []
+  for card, port in zip(cards, ports) :
+    dev = AsyncOTCProtocol(port, throughput_limit)
+    measure = AsyncMeasure(dev, type(card)._measure_record, MeasureTask.default_rate)
+    card.LN.attach(measure.buffer)
+    card.UV.attach(measure.buffer)
+    measures.append(measure)
+
+  tasks = [loop.create_task(m.run()) for m in measures]
+  recorder = loop.create_task(_record_captures(measures, capture))
+
+  try :
+    while not all(t.done() for t in tasks) :
+      await asyncio.sleep(1.000)
+
+      for card, port, measure in zip(cards, ports, measures) :
+        card.LN.lap()
+        card.UV.lap()
+        vLN = card.LN.text(window = Measure_Statistics.LAP)
+        vUV = card.UV.text(window = Measure_Statistics.LAP)
+        count = card.LN.stats.count(window = Measure_Statistics.LAP)
+
+        print('[%s] [L-N] %s, [U-V] %s, [%2d]' %(port, vLN, vUV, count))
+      print('')
+
+  finally :
+    for m in measures :
+      m.stop()
+    await asyncio.gather(*tasks, return_exceptions = True)
+    await recorder
+
+    for port, m in zip(ports, measures) :
+      m.dev.close()
+      if m.error :
+        print('[%s] %s' %(port, m.error))
+
+
+async def _record_captures(measures, capture) :
+  u"""
+  Registra en la captura capture las mediciones de todas las tarjetas, en
+  bloques de las mediciones de cada RecordReadingTask.block_period segundos.
+  """
+  cursors = [m.buffer.cursor(oldest = True) for m in measures]
+
+  while True :
+    done = all(m.buffer.closed for m in measures)
+    for n, cursor in enumerate(cursors) :
+      while True :
+        seq, view = cursor.drain()
+        if not view : break
+        capture.write_block(view, seq, card = n)
+
+    if done : break
+    await asyncio.sleep(RecordReadingTask.block_period)
+
+  for cursor in cursors :
+    cursor.close()
@@ -197,17 +197,19 @@ class ThresholdList(list):
                 raise ValueError(
                     f'El umbral inferior del tap { n+1} no es un número.')
 
-            if sup <= inf:
-                raise ValueError(
-                    'Los umbrales del tap {n+1} estan invertidos.')
+            super().append(Threshold(sup, inf))
 
-            if super().__len__() > 1:
-                if self[-1].sup < inf:
-                    msg = f'Los taps {n} y {n+1} no se traslapan.\n' +                                \
-                          f'(El umbral superior del tap {n} es menor que el inferior del tap {n+1})'
-                    raise ValueError(msg)
+        # Las inversiones, los traslapes y los rangos se validan sobre la
+        # tabla completa (ver ThresholdTable.validate()) :
+        card.threshold.validate(self.sups, self.infs)
 
-            super().append(Threshold(sup, inf))
+    @property
+    def sups(self):
+        return [th.sup for th in self]
+
+    @property
+    def infs(self):
+        return [th.inf for th in self]
 
 
 def read_xls(card, xls_name):
@@ -218,11 +220,9 @@ def read_xls(card, xls_name):
         card.close()
         sys.exit(1)
 
-    for n, th in enumerate(threshold_list):
-        setattr(card.threshold[n], 'sup', th.sup)
-        setattr(card.threshold[n], 'inf', th.inf)
-
-    card.threshold.len = len(threshold_list)
+    # Los umbrales y el número de taps se escriben juntos, en un bloque :
+    with card.staged(verify=True):
+        card.threshold.write(threshold_list.sups, threshold_list.infs)
 
 
 def write_xls(card, xls_name):
@@ -243,14 +243,16 @@ def write_xls(card, xls_name):
     for c in 'A1 B1 C1'.split():
         ws[c].border = Border(top=thick, left=thick, right=thick, bottom=thick)
 
-    for n, th in enumerate(card.threshold[:card.threshold.len]):
-        ws[f'A{n+2}'], ws[f'B{n+2}'], ws[f'C{n+2}'] = n+1, th.sup, th.inf
+    # Los umbrales se leen en una sola orden :
+    thresholds = card.threshold.values()
+    for n, (sup, inf) in enumerate(thresholds):
+        ws[f'A{n+2}'], ws[f'B{n+2}'], ws[f'C{n+2}'] = n+1, float(sup), float(inf)
         ws[f'A{n+2}'].alignment = Alignment(wrapText='True',
                                             horizontal='center', vertical='center')
         ws[f'B{n+2}'].number_format = accounting_format
         ws[f'C{n+2}'].number_format = accounting_format
 
-        bottom = thick if n == (card.threshold.len - 1) else thin
+        bottom = thick if n == (len(thresholds) - 1) else thin
         ws[f'A{n+2}'].border = Border(top=thin,
                                       left=thick, right=thick, bottom=bottom)
         ws[f'B{n+2}'].border = Border(top=thin,
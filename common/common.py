@@ -39,6 +39,21 @@ def openCard(port, throughput_limit=False, report=True):
         sys.exit(1)
 
 
+def parsePorts(args):
+    """
+    Reconoce todas las especificaciones de puertos ('-port' seguido del nombre
+    del puerto) en args, devuelve una tupla cuyo primer elemento es la lista
+    de los nombres de los puertos y el segundo la lista args sin ellas.
+    """
+    ports = []
+    while u'-port' in args[:-1]:
+        i = args.index(u'-port')
+        args.pop(i)
+        ports.append(args.pop(i).upper())
+
+    return (ports, args)
+
+
 # Reconoce la especificación del puerto serie en la línea de comandos args como:
 #  En el primer argumento como '-COMx', donde x es el número del puerto.
 #  Como la opción que sigue a '-port'
@@ -2,19 +2,125 @@
 # -*- coding: utf-8  -*-
 
 import sys
+import time
+import queue
+import atexit
+import struct
+import threading
 import logging
+import logging.handlers
+
+
+# Registro binario de los bytes transmitidos y recibidos (ver WireTrace) :
+WIRE_MAGIC = b'OTCWIRE1'
+WIRE_TX, WIRE_RX, WIRE_CHANNEL = 0, 1, 2
+_wire_record = struct.Struct('<dBBH')
+
+
+class WireTrace :
+   u"""
+   Registro binario (compacto) de los bytes transmitidos y recibidos por los
+   puertos serie, en lugar de las líneas de texto (hexadecimal) del reporte.
+
+   El archivo comienza con WIRE_MAGIC y la hora de inicio (segundos desde la
+   época, '<d'), seguidos de los registros : el tiempo desde el inicio ('<d'),
+   el canal, la dirección (WIRE_TX, WIRE_RX o WIRE_CHANNEL) y el número de
+   bytes ('<BBH'), y los bytes. Los registros WIRE_CHANNEL asignan el nombre
+   (del puerto) a su canal.
+
+   Los registros se escriben en un hilo separado, por lo que record() solo
+   encola los bytes.
+   """
+
+   def __init__(self, filename) :
+      self.filename = filename
+      self._file = open(filename, 'wb')
+      self._start = time.perf_counter()
+      self._file.write(WIRE_MAGIC + struct.pack('<d', time.time()))
+
+      self._channels = {}
+      self._channels_lock = threading.Lock()
+      self._queue = queue.SimpleQueue()
+      self._thread = threading.Thread(target = self._run, name = 'WireTrace',
+                                      daemon = True)
+      self._thread.start()
+
+   def channel(self, name) :
+      u"""
+      Devuelve el canal del puerto name (y lo registra si es nuevo). Puede
+      llamarse desde varios hilos (ver backupMgmt.FleetCmd).
+      """
+      with self._channels_lock :
+         if name not in self._channels :
+            self._channels[name] = len(self._channels)
+            self.record(self._channels[name], WIRE_CHANNEL,
+                        str(name).encode('utf-8'))
+         return self._channels[name]
+
+   def record(self, channel, direction, data) :
+      self._queue.put((time.perf_counter() - self._start, channel, direction,
+                       bytes(data)))
+
+   def _run(self) :
+      while True :
+         item = self._queue.get()
+         if item is None :
+            break
+         t, channel, direction, data = item
+         self._file.write(_wire_record.pack(t, channel, direction, len(data)))
+         self._file.write(data)
+      self._file.close()
+
+   def close(self) :
+      if self._thread.is_alive() :
+         self._queue.put(None)
+         self._thread.join()
+
+
+def read_wire(filename) :
+   u"""
+   Devuelve (generador) los registros del archivo filename de WireTrace como
+   tuplas (tiempo desde el inicio, nombre del canal, dirección, bytes), sin
+   los registros WIRE_CHANNEL.
+   """
+   channels = {}
+   with open(filename, 'rb') as f :
+      if f.read(len(WIRE_MAGIC)) != WIRE_MAGIC :
+         raise ValueError(u'%s no es un registro de WireTrace.' % filename)
+      f.read(8)
+
+      while True :
+         header = f.read(_wire_record.size)
+         if len(header) < _wire_record.size :
+            return
+         t, channel, direction, size = _wire_record.unpack(header)
+         data = f.read(size)
+
+         if direction == WIRE_CHANNEL :
+            channels[channel] = data.decode('utf-8')
+         else :
+            yield t, channels.get(channel, channel), direction, data
 
 
 class report :
    parent_logger = None
    console_handler = None
+   listener = None
+   wire = None
 
-   def __init__(self, parent_logger, filename = 'report.log') :
+   def __init__(self, parent_logger, filename = 'report.log',
+                level = logging.DEBUG, queued = False, wire = None) :
       """
       Inicializa el sistema de reporte, el cual es dual, dirigido
       a la consola con un reporte sumario de incidencias y uno
       detallado al archivo filename, el que si no se especifica
       tiene el nombre por defecto 'report.log'.
+
+      El nivel del reporte detallado es level (por defecto DEBUG), con
+      queued el archivo se escribe desde un hilo separado (QueueHandler y
+      QueueListener), de manera que la comunicación no espere por el disco.
+      Con wire (nombre de archivo) los bytes transmitidos y recibidos se
+      registran en formato binario (ver WireTrace y report.wire).
       """
       # Solo se permite un sistema de reporte :
       if report.parent_logger is not None :
@@ -23,7 +129,7 @@ class report :
 
       # Crea la raíz de reporte :
       report.parent_logger = logging.getLogger(parent_logger)
-      report.parent_logger.setLevel(logging.DEBUG)
+      report.parent_logger.setLevel(min(level, logging.ERROR))
 
       # Se utilizan dos manejadores, uno para la consola con mensajes de error
       # graves :
@@ -32,7 +138,7 @@ class report :
 
       # y un segundo para un archivo de texto, con un detalle exhaustivo :
       file_handler = logging.FileHandler(filename, 'w')
-      file_handler.setLevel(logging.DEBUG)
+      file_handler.setLevel(level)
 
       # Se utiliza el mismo formato para ambos manejadores :
       formatter = logging.Formatter('\n%(asctime)s - %(name)s - '
@@ -40,11 +146,41 @@ class report :
       report.console_handler.setFormatter(formatter)
       file_handler.setFormatter(formatter)
 
+      # El archivo se escribe en el hilo de QueueListener, los registros solo
+      # se encolan :
+      if queued :
+         log_queue = queue.SimpleQueue()
+         report.listener = logging.handlers.QueueListener(log_queue,
+                                 file_handler, respect_handler_level = True)
+         report.listener.start()
+         file_handler = logging.handlers.QueueHandler(log_queue)
+         file_handler.setLevel(level)
+
+      if wire is not None :
+         report.wire = WireTrace(wire)
+
+      if queued or (wire is not None) :
+         atexit.register(report.stop)
+
       # como parte del reporte :
       report.parent_logger.addHandler(report.console_handler)
       report.parent_logger.addHandler(file_handler)
 
 
+   @staticmethod
+   def stop() :
+      """
+      Completa la escritura de los registros pendientes (de QueueListener y
+      WireTrace).
+      """
+      if report.listener is not None :
+         report.listener.stop()
+         report.listener = None
+      if report.wire is not None :
+         report.wire.close()
+         report.wire = None
+
+
    @staticmethod
    def getLogger(child_logger = None) :
       """
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+AsyncMeasure.py
+
+Medición asíncrona (asyncio) de las tensiones, análoga a MeasureTask pero
+sin un hilo de ejecución por tarjeta : las lecturas de la medición de cada
+tarjeta (por medio de AsyncOTCProtocol) son corrutinas de un solo bucle de
+eventos, que almacenan los registros (tap, LN, UV) en su propio SampleRing.
+"""
+
+import asyncio
+
+from otcCard.OTCProtocolError import OTCProtocolError
+from estCard.SampleRing import SampleRing
+
+
+class AsyncMeasure(object):
+    u"""
+    Medición del registro record (CardParameter, i.e. EstCard1V0._measure_
+    record) desde el dispositivo dev (AsyncOTCProtocol), a una taza de rate
+    lecturas por segundo (None para leerlas tan rápido como lo permita la
+    comunicación), almacenadas en buffer (SampleRing) de size registros.
+    """
+
+    def __init__(self, dev, record, rate=None, size=4096):
+        self.dev = dev
+        self.record = record
+        self.rate = rate
+
+        self.buffer = SampleRing(size)
+        self.errors = 0
+        self.error = None
+
+        self._stopped = asyncio.Event()
+
+    async def run(self):
+        u"""
+        Ejecuta la medición hasta que se detenga (ver stop()) o se acumulen
+        demasiados errores de comunicación (como en MeasureTask).
+        """
+        loop = asyncio.get_running_loop()
+        period = 1.0/self.rate if self.rate else 0
+        next_time = loop.time()
+
+        adr, size, codec = self.record.adr, self.record.size, self.record.codec
+        err_cnt = 0
+
+        try:
+            while (not self._stopped.is_set()) and (err_cnt < 5):
+                try:
+                    data = await self.dev.get_data(adr, size)
+                    self.buffer.put(codec.unpack(data))
+
+                    if err_cnt > 0:
+                        err_cnt -= 0.1
+
+                except OTCProtocolError:
+                    self.errors += 1
+                    err_cnt += 1
+
+                # Se espera hasta la siguiente lectura, o hasta que se detenga
+                # la medición :
+                if period:
+                    next_time = max(next_time + period, loop.time())
+                    try:
+                        await asyncio.wait_for(self._stopped.wait(),
+                                               next_time - loop.time())
+                    except asyncio.TimeoutError:
+                        pass
+
+            if err_cnt >= 5:
+                self.error = u'Demasiados errores de comunicación.'
+
+        finally:
+            self.buffer.close()
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,242 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Capture.py
+
+Formato binario de los registros de la medición (captura) de las tensiones,
+que reemplaza el registro en texto (CSV) línea por línea.
+
+El archivo de la captura consta de :
+
+  - La cabecera : la firma MAGIC, la longitud (uint32) de los metadatos y los
+    metadatos en formato JSON (modelo, escala, ganancias, hora de inicio y
+    nombres de las columnas), completados con espacios hasta un múltiplo de 8
+    bytes.
+
+  - Los bloques de registros, cada uno con su cabecera (BLOCK_HEADER) : la
+    firma BLOCK_MAGIC, el número de registros (count), el número de secuencia
+    del primer registro (seq) y la hora de su escritura (time.time()), seguida
+    de las columnas (tap, LN, UV) de count enteros de 16 bits (little endian)
+    cada una.
+
+La captura de varias tarjetas (multiplexada) registra en los metadatos la
+lista de los metadatos de cada tarjeta (cards) y sus bloques tienen además
+la columna card (primera), con el índice de la tarjeta en esa lista.
+
+El lector (CaptureReader) proyecta el archivo en memoria y devuelve las
+columnas directamente (sin interpretar su contenido), la función to_csv()
+convierte la captura al formato CSV del registro original.
+"""
+
+import sys
+import json
+import mmap
+import time
+import struct
+from array import array
+from datetime import datetime
+
+# numpy es opcional, sin numpy las columnas son del tipo array('H') :
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b'ESTCAP01'
+BLOCK_MAGIC = b'BLK0'
+
+# Cabecera de los bloques (firma, número de registros, secuencia y hora) :
+BLOCK_HEADER = struct.Struct('<4sIQd')
+
+COLUMNS = ('tap', 'LN', 'UV')
+
+
+def card_metadata(card):
+    u"""
+    Devuelve los metadatos de la tarjeta card (modelo, escala y ganancias de
+    las entradas).
+    """
+    return {
+        'model': card.id['hardware_model'],
+        'scale': float(card.scale),
+        'gains': dict((i, getattr(card, '_gain%s' % i))
+                      for i in card.inputs_available()),
+    }
+
+
+class CaptureWriter(object):
+    u"""
+    Escribe la captura en el archivo filename, con los metadatos de la
+    tarjeta card, o de cada tarjeta si card es una lista (captura multi-
+    plexada, ver write_block()).
+    """
+
+    def __init__(self, filename, card):
+        self.filename = filename
+        self.records = 0
+
+        start = datetime.now()
+        if isinstance(card, (list, tuple)):
+            self.metadata = {'cards': [card_metadata(c) for c in card]}
+            self.columns = ('card',) + COLUMNS
+        else:
+            self.metadata = card_metadata(card)
+            self.columns = COLUMNS
+
+        self.metadata.update({
+            'start': start.isoformat(),
+            'start_time': time.time(),
+            'columns': self.columns,
+        })
+
+        header = json.dumps(self.metadata).encode('utf-8')
+        header += b' ' * (-(len(MAGIC) + 4 + len(header)) % 8)
+
+        self.file = open(filename, 'wb')
+        self.file.write(MAGIC + struct.pack('<I', len(header)) + header)
+
+    def write_block(self, view, seq, timestamp=None, card=None):
+        u"""
+        Escribe un bloque con los registros de view (valores consecutivos
+        tap, LN, UV, i.e. una vista de SampleRing), cuyo número de secuencia
+        inicial es seq. En la captura multiplexada card es el índice de la
+        tarjeta de los registros.
+        """
+        count = len(view) // len(COLUMNS)
+        if count == 0:
+            return
+
+        self.file.write(BLOCK_HEADER.pack(BLOCK_MAGIC, count, seq,
+                        time.time() if timestamp is None else timestamp))
+
+        if 'card' in self.columns:
+            column = array('H', [card]) * count
+            if sys.byteorder == 'big':
+                column.byteswap()
+            self.file.write(column)
+
+        for c in range(len(COLUMNS)):
+            column = array('H', view[c::len(COLUMNS)])
+            if sys.byteorder == 'big':
+                column.byteswap()
+            self.file.write(column)
+
+        self.records += count
+
+    def close(self):
+        self.file.close()
+
+
+class CaptureReader(object):
+    u"""
+    Lee la captura del archivo filename, proyectado en memoria (mmap). Solo
+    se interpretan la cabecera y las cabeceras de los bloques, cuyas posi-
+    ciones, número de registros, secuencias y horas se mantienen en las
+    listas offsets, counts, seqs y times. Un bloque incompleto (i.e. si la
+    captura fue interrumpida) se ignora.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mm[:len(MAGIC)] != MAGIC:
+            self.mm.close()
+            raise ValueError(u'"%s" no es una captura.' % filename)
+
+        size, = struct.unpack_from('<I', self.mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.metadata = json.loads(self.mm[start:start + size].decode('utf-8'))
+        self.columns = tuple(self.metadata.get('columns', COLUMNS))
+
+        self.offsets, self.counts, self.seqs, self.times = [], [], [], []
+
+        offset = start + size
+        while offset + BLOCK_HEADER.size <= len(self.mm):
+            magic, count, seq, timestamp = BLOCK_HEADER.unpack_from(self.mm,
+                                                                    offset)
+            end = offset + BLOCK_HEADER.size + 2 * len(self.columns) * count
+            if (magic != BLOCK_MAGIC) or (end > len(self.mm)):
+                break
+
+            self.offsets.append(offset + BLOCK_HEADER.size)
+            self.counts.append(count)
+            self.seqs.append(seq)
+            self.times.append(timestamp)
+            offset = end
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def block(self, n, name):
+        u"""
+        Devuelve la columna name del bloque n, sin copiarla (numpy.ndarray o
+        memoryview de solo lectura).
+        """
+        count = self.counts[n]
+        offset = self.offsets[n] + 2 * count * self.columns.index(name)
+
+        if numpy is not None:
+            return numpy.frombuffer(self.mm, '<u2', count, offset)
+
+        view = memoryview(self.mm)[offset:offset + 2 * count].cast('H')
+        if sys.byteorder == 'big':
+            view = array('H', view)
+            view.byteswap()
+        return view
+
+    def column(self, name, first=0, last=None):
+        u"""
+        Devuelve la columna name (de los bloques first a last, excluido) en
+        un solo arreglo.
+        """
+        blocks = [self.block(n, name)
+                  for n in range(len(self.counts))[first:last]]
+
+        if numpy is not None:
+            return numpy.concatenate(blocks) if blocks else \
+                numpy.zeros(0, '<u2')
+
+        column = array('H')
+        for b in blocks:
+            column.extend(b)
+        return column
+
+    def close(self):
+        self.mm.close()
+
+
+def to_csv(capture_name, csv_name):
+    u"""
+    Convierte la captura capture_name al formato CSV del registro original
+    (cabecera con los metadatos y una línea por registro), en csv_name.
+    """
+    capture = CaptureReader(capture_name)
+    meta = capture.metadata
+
+    # En la captura multiplexada se agrega la columna de la tarjeta :
+    cards = meta.get('cards', [meta])
+    line = '%5d,%5d,%8d,%8d\n' if 'cards' in meta else '%5d,%8d,%8d\n'
+
+    with open(csv_name, 'w') as f:
+        for n, card in enumerate(cards):
+            if 'cards' in meta:
+                f.write('# Tarjeta      : %d\n' % n)
+            f.write('# Modelo       : %s\n' % card['model'])
+            f.write('# Escala       : %s\n' % card['scale'])
+            for name, gain in card['gains'].items():
+                f.write('# Ganancia %s-N : %d\n' % (name, gain))
+        f.write('# Hora         : %s\n#\n' % meta['start'].replace('T', ' '))
+        f.write('# CARD' if 'cards' in meta else '#')
+        f.write('  TAP   V(L-N)   V(U-V) \n')
+
+        columns = None
+        for n in range(len(capture.counts)):
+            columns = [capture.block(n, name) for name in capture.columns]
+            f.writelines(line % record for record in zip(*columns))
+        del columns
+
+    capture.close()
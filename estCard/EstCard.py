@@ -4,12 +4,79 @@
 __author__ = 'Oscar'
 
 import math
+import time
 import threading
+import struct
+import collections
+from estCard.SampleRing import SampleRing
 from otcCard.OTCProtocol import *
 from otcCard import *
 from common.report import report
 import logging
-import queue
+
+# numpy es opcional, sin numpy las estadísticas no calculan percentiles :
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class _Aggregate(object):
+    """
+    Agregado de un conjunto de muestras (cuadrados de la magnitud) : número,
+    suma, suma de las magnitudes (raíz cuadrada de las muestras), máximo,
+    mínimo e histograma (con numpy) de HIST_BINS intervalos de 2**HIST_SHIFT.
+    """
+    __slots__ = ('count', 'sum', 'sum_mag', 'max', 'min', 'hist')
+
+    HIST_SHIFT = 6
+    HIST_BINS = 1024
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0
+        self.sum_mag = 0.0
+        self.max = 0
+        self.min = 2**24 - 1
+        self.hist = None
+
+    def add_batch(self, samples):
+        if numpy is not None:
+            samples = numpy.asarray(samples)
+            count = samples.size
+            total = int(samples.sum(dtype='u8'))
+            sum_mag = float(numpy.sqrt(samples, dtype='f8').sum())
+            high, low = int(samples.max()), int(samples.min())
+            hist = numpy.bincount(numpy.minimum(samples >> self.HIST_SHIFT,
+                                                self.HIST_BINS - 1),
+                                  minlength=self.HIST_BINS)
+        else:
+            count = len(samples)
+            total = sum(samples)
+            sum_mag = math.fsum(map(math.sqrt, samples))
+            high, low = max(samples), min(samples)
+            hist = None
+
+        self.merge(count, total, sum_mag, high, low, hist)
+
+    def merge(self, count, total, sum_mag, high, low, hist):
+        if self.count == 0:
+            self.hist = None if hist is None else hist.copy()
+        elif (self.hist is not None) and (hist is not None):
+            self.hist += hist
+        else:
+            self.hist = None
+
+        self.count += count
+        self.sum += total
+        self.sum_mag += sum_mag
+        self.max = max(self.max, high)
+        self.min = min(self.min, low)
+
+    def merge_from(self, other):
+        if other.count:
+            self.merge(other.count, other.sum, other.sum_mag, other.max,
+                       other.min, other.hist)
 
 
 class Measure_Statistics(object):
@@ -17,37 +84,133 @@ class Measure_Statistics(object):
     Contenedor para el registro básico de las mediciones, i.e. el cálculo de
     los valores efectivo (rms), máximo (max) y mínimo (min). desde el cuadrado
     de su magnitud 'instantánea'.
+
+    Las muestras se agregan en bloques (add_batch(), preferentemente un arreglo
+    de numpy o un memoryview) y se acumulan desde el último arm(), así como en
+    intervalos de un segundo, con los que se calculan las estadísticas de las
+    ventanas móviles de hasta window_limit segundos (i.e. 1, 10 o 60 segundos)
+    : rms, max, min, std (desviación estándar de la magnitud), count y
+    percentile (este último requiere numpy).
+
+    Las ventanas comprenden los últimos window segundos completos (el inter-
+    valo en curso se incorpora al completarse), y su agregado se calcula una
+    sola vez por segundo, por lo que consultarlas no depende de su extensión.
+    El intervalo de una muestra es el del momento en que se agrega, por lo que
+    la resolución de las ventanas es la frecuencia con la que se agregan.
+
+    Además las muestras se acumulan en vueltas (laps), que concluye lap() : las
+    estadísticas de la última vuelta concluida se consultan con window=LAP
+    (e.g. las muestras entre dos presentaciones del monitor).
     """
 
-    def __init__(self, scale):
+    LAP = 'lap'
+
+    def __init__(self, scale, window_limit=60):
         self._scale = scale
+        self.window_limit = window_limit
+        self._windows = collections.deque()
+        self._cache = {}
         self.arm()
 
     def arm(self):
-        self._max = 0
-        self._min = 2**24 - 1
-        self._avg = 0
-        self._count = 0
+        self._total = _Aggregate()
+        self._running = _Aggregate()
+        self._lap = _Aggregate()
 
-    def add(self, sample):
-        self._avg += sample
-        if self._max < sample:
-            self._max = sample
-        if self._min > sample:
-            self._min = sample
+    def lap(self):
+        self._lap, self._running = self._running, _Aggregate()
 
-        self._count += 1
+    # Por compatibilidad, los valores acumulados desde arm() :
+    _count = property(lambda self: self._total.count)
+    _avg = property(lambda self: self._total.sum)
+    _max = property(lambda self: self._total.max)
+    _min = property(lambda self: self._total.min)
 
-    def max(self):
-        return math.sqrt(float(self._max))*self._scale
+    def add(self, sample):
+        self.add_batch((sample,))
 
-    def min(self):
-        return math.sqrt(float(self._min))*self._scale
+    def add_batch(self, samples, now=None):
+        if not len(samples):
+            return
 
-    def rms(self):
-        if self._count == 0:
+        batch = _Aggregate()
+        batch.add_batch(samples)
+        self._total.merge_from(batch)
+        self._running.merge_from(batch)
+
+        # Se agrega al intervalo (de un segundo) en curso, retirando los
+        # intervalos que exceden la ventana mas extensa :
+        second = int(time.monotonic() if now is None else now)
+        if (not self._windows) or (self._windows[-1][0] != second):
+            self._windows.append((second, _Aggregate()))
+            while self._windows[0][0] < second - self.window_limit:
+                self._windows.popleft()
+        self._windows[-1][1].merge_from(batch)
+
+    def _aggregate(self, window=None, now=None):
+        if window is None:
+            return self._total
+        if window == self.LAP:
+            return self._lap
+
+        if window > self.window_limit:
+            raise ValueError('La ventana excede %d segundos.'
+                             % self.window_limit)
+
+        # Los intervalos completos no cambian, por lo que el agregado de la
+        # ventana se conserva hasta el próximo segundo :
+        second = int(time.monotonic() if now is None else now)
+        cached = self._cache.get(window)
+        if (cached is not None) and (cached[0] == second):
+            return cached[1]
+
+        aggregate = _Aggregate()
+        for t, bucket in reversed(self._windows):
+            if t < second - window:
+                break
+            if t < second:
+                aggregate.merge_from(bucket)
+        self._cache[window] = (second, aggregate)
+        return aggregate
+
+    def count(self, window=None):
+        return self._aggregate(window).count
+
+    def max(self, window=None):
+        return math.sqrt(float(self._aggregate(window).max))*self._scale
+
+    def min(self, window=None):
+        return math.sqrt(float(self._aggregate(window).min))*self._scale
+
+    def rms(self, window=None):
+        aggregate = self._aggregate(window)
+        if aggregate.count == 0:
             return 0
-        return math.sqrt(float(self._avg)/self._count) * self._scale
+        return math.sqrt(float(aggregate.sum)/aggregate.count) * self._scale
+
+    def std(self, window=None):
+        aggregate = self._aggregate(window)
+        if aggregate.count == 0:
+            return 0
+        mean = aggregate.sum_mag/aggregate.count
+        return math.sqrt(max(0.0, aggregate.sum/aggregate.count - mean**2)) \
+            * self._scale
+
+    def percentile(self, p, window=None):
+        u"""
+        Devuelve el percentil p (0 a 100) de la magnitud de las muestras,
+        con la resolución del histograma (ver _Aggregate).
+        """
+        aggregate = self._aggregate(window)
+        if aggregate.hist is None:
+            raise ValueError('Los percentiles requieren el módulo numpy.')
+        if aggregate.count == 0:
+            return 0
+
+        rank = numpy.searchsorted(numpy.cumsum(aggregate.hist),
+                                  p/100.0*aggregate.count)
+        rank = min(int(rank), _Aggregate.HIST_BINS - 1)
+        return math.sqrt((rank + 0.5)*2**_Aggregate.HIST_SHIFT)*self._scale
 
 
 class ModeFlags(object):
@@ -93,39 +256,43 @@ class ModeFlags(object):
     feedbackEnable = Flag(4, 'Realimentación', 'Activa', 'Inactiva')
     splitEnable = Flag(5, u'Taps Superpuestos', 'Activa', 'Inactiva')
 
+    # Índice de las banderas por su nombre (ver ParameterIndex), con el
+    # nombre del atributo como valor, se completa al definir la clase :
+    flags = None
+
     def __init__(self, card):
         self.card = card
 
     @staticmethod
     def functionNames():
-        return [p.name for p in ModeFlags.__dict__.values()
-                if type(p) == ModeFlags.Flag]
+        return list(ModeFlags.flags)
 
     @staticmethod
     def getFunctionOf(name):
-        n_desc, desc = [(n, d) for n, d in ModeFlags.__dict__.items()
-                        if (type(d) == ModeFlags.Flag) and (d.name == name)][0]
-        return n_desc
+        return ModeFlags.flags[name]
 
     def getStatusStr(self, name):
-        # Obtiene el nombre del atributo del y el descriptor con el nombre de
+        # Obtiene el nombre del atributo del descriptor con el nombre de
         # función dado (name) :
-        n_desc, desc = [(n, d) for n, d in ModeFlags.__dict__.items()
-                        if (type(d) == ModeFlags.Flag) and (d.name == name)][0]
-
-        str = '%s : %s' % (name, getattr(self, n_desc))
+        str = '%s : %s' % (name, getattr(self, ModeFlags.flags[name]))
 
         return str
 
     def __str__(self):
         txt = ''
-        for name, desc in ModeFlags.__dict__.items():
-            if type(desc) == ModeFlags.Flag:
-                txt += '%25s : %s\n' % (desc.name, getattr(self, name))
+        for name, attr in ModeFlags.flags.names.items():
+            txt += '%25s : %s\n' % (name, getattr(self, attr))
 
         return txt
 
 
+ModeFlags.flags = ParameterIndex()
+for _attr, _flag in list(vars(ModeFlags).items()):
+    if type(_flag) == ModeFlags.Flag:
+        ModeFlags.flags.add(_flag.name, _attr)
+del _attr, _flag
+
+
 class Phase(object):
     """
     Contenedor de los parámetros asociados a las fases de medición (LN y UV) :
@@ -139,6 +306,11 @@ class Phase(object):
         self.card = card
         self.name = name
 
+        # Posición de la medición de la fase en los registros (tap, LN, UV)
+        # y cursor de las muestras de la medición en curso (ver attach()) :
+        self.column = 1 if name == 'LN' else 2
+        self.cursor = None
+
         try:
             self.stats = Measure_Statistics((self.card.scale /
                                              math.sqrt(self.gain/EstCard1V0.GAIN_NOM)))
@@ -150,56 +322,119 @@ class Phase(object):
     def gain(self):
         return getattr(self.card, '_gain'+self.name[0])
 
+    def attach(self, ring):
+        u'''
+        Inicia la estadística de las muestras del almacén ring (SampleRing),
+        que se consumen al consultarla (ver update()).
+        '''
+        if self.cursor is not None:
+            self.cursor.close()
+        self.cursor = ring.cursor()
+        self.stats.arm()
+
+    def update(self):
+        u'''
+        Agrega a la estadística las muestras pendientes de la medición.
+        '''
+        if self.cursor is None:
+            return
+
+        while True:
+            seq, view = self.cursor.drain()
+            if not view:
+                break
+            self.stats.add_batch(view[self.column::self.cursor.ring.width])
+
     @property
     def max(self):
+        self.update()
         return self.stats.max()
 
     @property
     def min(self):
+        self.update()
         return self.stats.min()
 
     @property
     def rms(self):
+        self.update()
         return self.stats.rms()
 
     def add(self, value):
         self.stats.add(value)
 
-    def __str__(self):
-        if (abs(self.max - self.rms) < 10) and                               \
-                (abs(self.rms - self.min) < 10):
-            return u'%6.2f (+%4.2f/-%4.2f)' % (self.rms,
-                                               self.max - self.rms, self.rms - self.min)
+    def lap(self):
+        u'''
+        Concluye la vuelta de la estadística con las muestras pendientes de la
+        medición (ver Measure_Statistics.lap()).
+        '''
+        self.update()
+        self.stats.lap()
+
+    def text(self, window=None):
+        u'''
+        Representación de la medición, acumulada desde attach(), de la ventana
+        de window segundos o de la última vuelta (window=LAP, ver Measure_
+        Statistics).
+        '''
+        self.update()
+        rms = self.stats.rms(window)
+        high, low = self.stats.max(window), self.stats.min(window)
+
+        if (abs(high - rms) < 10) and (abs(rms - low) < 10):
+            return u'%6.2f (+%4.2f/-%4.2f)' % (rms, high - rms, rms - low)
         else:
-            return u'%6.2f ( -.--/ -.--)' % (self.rms)
+            return u'%6.2f ( -.--/ -.--)' % (rms)
+
+    def __str__(self):
+        return self.text()
 
 
 class MeasureTask(threading.Thread):
     """
     Hilo de ejecución para la medición (y registro) de las tensiones L-N y U-V.
-    Como es usual es iniciada por el método start() y detenida ajustandoa False
-    su variable started, al invocar el método stop().
+    Como es usual es iniciada por el método start() y detenida por el método
+    stop(), wait_started() espera hasta que el hilo este en ejecución.
+
+    Las mediciones se realizan a una taza de rate lecturas por segundo (por
+    defecto default_rate, None para leerlas tan rápido como lo permita la
+    comunicación) y se almacenan en buffer (SampleRing) de size registros
+    (tap, LN, UV), del que las consumen las fases (Phase) y los registros.
     """
+    default_rate = None
 
-    def __init__(self, card):
+    def __init__(self, card, rate=None, size=4096):
         # Se prepara el hilo de ejecución, para su arranque :
         threading.Thread.__init__(self)
 
         self.card = card
+        self.rate = rate if rate is not None else MeasureTask.default_rate
+
+        self._started = threading.Event()
+        self._stopped = threading.Event()
 
-        # Se inicializa la estadística de medición de cada fase :
-        card.LN.stats.arm()
-        card.UV.stats.arm()
+        self.buffer = SampleRing(size)
 
-        self.started = False
+        # Se inicializa la estadística de medición de cada fase, que consumen
+        # las muestras desde este momento :
+        card.LN.attach(self.buffer)
+        card.UV.attach(self.buffer)
 
-        self.queue = queue.Queue(1000)
+    @property
+    def started(self):
+        return self._started.is_set() and not self._stopped.is_set()
+
+    def wait_started(self, timeout=None):
+        return self._started.wait(timeout)
 
     def run(self):
         self.card.log.debug('Measure Thread has started')
-        self.started = True
         self.error = None
         err_cnt = 0
+        self._started.set()
+
+        period = 1.0/self.rate if self.rate else 0
+        next_time = time.monotonic()
 
         # Durante la etapa de medición se tolera cierto número de errores,
         # que no son necesario reportarlos en la consola, solo los errores
@@ -207,18 +442,9 @@ class MeasureTask(threading.Thread):
         report.consoleSetLevel(logging.CRITICAL)
 
         try:
-            while (self.started and (err_cnt < 5)):
+            while (not self._stopped.is_set()) and (err_cnt < 5):
                 try:
-                    record_measure = self.card._measure_record
-
-                    self.card.LN.add(record_measure[1])
-                    self.card.UV.add(record_measure[2])
-
-                    # Retira el elemento mas antiguo de la cola si esta llena :
-                    if self.queue.full():
-                        self.queue.get()
-
-                    self.queue.put(record_measure)
+                    self.buffer.put(self.card._measure_record)
 
                     if err_cnt > 0:
                         err_cnt -= 0.1
@@ -226,6 +452,12 @@ class MeasureTask(threading.Thread):
                 except OTCProtocolError as e:
                     err_cnt += 1
 
+                # Se espera (sin consumir el procesador) hasta la siguiente
+                # lectura, o hasta que se detenga la medición :
+                if period:
+                    next_time = max(next_time + period, time.monotonic())
+                    self._stopped.wait(next_time - time.monotonic())
+
         except Exception as e:
             print('error', e)
             report.consoleSetLevel(logging.ERROR)
@@ -236,7 +468,8 @@ class MeasureTask(threading.Thread):
             # Se restaura la propagación de los errores a la consola :
             report.consoleSetLevel(logging.ERROR)
 
-            self.started = False
+            self._stopped.set()
+            self.buffer.close()
 
             self.card.log.debug('Measure Thread has stoped')
 
@@ -246,7 +479,7 @@ class MeasureTask(threading.Thread):
                     'Fallo la Medición, demasiados errores.')
 
     def stop(self):
-        self.started = False
+        self._stopped.set()
 
 
 # CalibrationFactor contiene la representación del factor de calibración de
@@ -316,100 +549,230 @@ class CalibrationFactor1V0(object):
             return '%6.4f [0x%04X]' % (self.effective, int(self.internal))
 
 
-def ThresholdSetFactory(card):
+class ThresholdValue(float):
+    u'''
+    Umbral de tensión (float) con su valor interno (internal).
     '''
-    Devuelve el vector de Umbrales del dispositivo card. El vector de umbrales
-    es un objeto del tipo (adhoc) ThresholdList cuyos elementos contienen dos
-    atributos sup e inf, que representan los umbrales del tap respectivo.
+    __slots__ = ('internal',)
+
+    def __new__(cls, value, internal):
+        this = float.__new__(cls, value)
+        this.internal = internal
+        return this
+
+    def __str__(self):
+        return '%6.2f [0x%04X]' % (self, self.internal)
+
+
+class ThresholdTable(object):
+    u'''
+    Tabla de los umbrales de tensión de los taps de la tarjeta card, respal-
+    dada por el bloque de los umbrales (_threshold, '<24H' en thresholdsAdr),
+    que se lee en una sola orden y se escribe como un bloque en una escritura
+    diferida (ver EstCard1V0.staged()). En el bloque los umbrales superior e
+    inferior del tap n son las palabras 2n y 2n + 1.
+
+    La conversión de los umbrales a su valor natural (tensión) y viceversa se
+    realiza en una sola operación para todos los taps (con numpy, si esta
+    disponible), al igual que la validación de la tabla (ver validate()).
+
+    Los elementos de la tabla (table[n]) representan los umbrales del tap n
+    por medio de sus atributos sup e inf, y el número de taps operativos es
+    len(table) o el atributo len (que además permite modificarlo).
     '''
 
-    # scaled_param devuelve el objeto del tipo ScaledParameter que contiene al
-    # parámetro (del tipo CardParameter) card_parameter., con las funciones de
-    # conversión adecuadas para representar los umbrales del dispositivo.
-    def scaled_param(card_parameter): return ScaledParameter(card_parameter,
-                                                             [lambda x: card.scale * math.sqrt(x*card.GAIN_NOM/65536),
-                                                              lambda x: int((x/card.scale)**2 * 65536/card.GAIN_NOM + 0.5)],
-                                                             [0, 32768],
-                                                             r'%6.2f [0x%04X]')
+    # Límites del valor interno de los umbrales :
+    limits = (0, 32768)
 
-    def tap_threshold(i, adr):
-        u'''
-        Devuelve un objeto (TapThreshold) con dos atributos : sup e inf, del tipo
-        ScaledParameter, del los umbrales superior e inferior del tap, cuya dire-
-        cción de almacenamiento en el dispositivo es adr.
-        Adicionalmente provee una presentación estandarizada para el par de los
-        umbrales del tap y la capacidad de leer y modificar el número de taps
-        operativos por medio de su propiedad len.
-        '''
-        class TapThreshold(object):
-            __sup = CardParameter(
-                adr, '<H', u'Umbral Superior #%i de Tensión' % i)
-            sup = scaled_param(__sup)
+    class Tap(object):
+        __slots__ = ('table', 'n')
 
-            __inf = CardParameter(
-                adr + 2, '<H', u'Umbral Inferior #%i de Tensión' % i)
-            inf = scaled_param(__inf)
+        def __init__(self, table, n):
+            self.table = table
+            self.n = n
 
-            def __init__(self, card):
-                self.card = card
+        @property
+        def sup(self):
+            return self.table.value(self.n, 'sup')
+
+        @sup.setter
+        def sup(self, value):
+            self.table.set(self.n, 'sup', value)
+
+        @property
+        def inf(self):
+            return self.table.value(self.n, 'inf')
+
+        @inf.setter
+        def inf(self, value):
+            self.table.set(self.n, 'inf', value)
+
+        def __str__(self):
+            return 'sup = %s , inf = %s' % (self.sup, self.inf)
 
-            def __str__(self):
-                return 'sup = %s , inf = %s' % (self.sup, self.inf)
+    def __init__(self, card):
+        self.card = card
 
-        return TapThreshold(card)
+    # Conversiones, de vectores de umbrales :
 
-    class ThresholdList(object):
-        # TODO Parametro para reajustar el número de taps utilizados,
-        __tapsOpRange = CardParameter(
-            card.tapsOpRangeAdr, '<B', u'Taps Utilizados')
+    def naturals(self, internals):
+        u'''
+        Devuelve las tensiones de los valores internos internals.
+        '''
+        scale, k = self.card.scale, self.card.GAIN_NOM/65536
+        if numpy is not None:
+            return scale * numpy.sqrt(numpy.asarray(internals, dtype=float)*k)
+        return [scale * math.sqrt(x*k) for x in internals]
 
-        def __init__(self):
-            self.card = card
-            self.thresholds = list()
+    def internals(self, naturals):
+        u'''
+        Devuelve los valores internos (enteros) de las tensiones naturals.
+        '''
+        scale, k = self.card.scale, 65536/self.card.GAIN_NOM
+        if numpy is not None:
+            values = numpy.asarray(naturals, dtype=float)
+            return [int(x) for x in numpy.floor((values/scale)**2 * k + 0.5)]
+        return [int((x/scale)**2 * k + 0.5) for x in naturals]
 
-            for i in range(0, card.tapLimit):
-                self.thresholds.append(
-                    tap_threshold(i, card.thresholdsAdr + 4*i))
+    # Lectura :
 
-        def __getitem__(self, item):
-            return self.thresholds[item]
+    @property
+    def internal(self):
+        u'''
+        Contenido del bloque de los umbrales (tupla de 2*12 palabras).
+        '''
+        return tuple(self.card._threshold)
 
-        def __len__(self):
-            return self.__tapsOpRange
+    def values(self, count=None):
+        u'''
+        Devuelve las tensiones de los umbrales (superior, inferior) de los
+        primeros count taps (por defecto los operativos).
+        '''
+        if count is None:
+            count = len(self)
+        block = self.internal[:2*count]
+        volts = self.naturals(block)
+        return [(ThresholdValue(volts[2*n], block[2*n]),
+                 ThresholdValue(volts[2*n + 1], block[2*n + 1]))
+                for n in range(count)]
 
-        @property
-        def len(self):
-            return self.__tapsOpRange
+    def value(self, n, pos):
+        word = self.internal[2*n + (pos == 'inf')]
+        return ThresholdValue(self.naturals([word])[0], word)
 
-        @len.setter
-        def len(self, number_of_taps):
-            if number_of_taps > card.tapLimit:
-                raise ValueError(f'El numero de taps solicitados ({number_of_taps}) '
-                                 'excede la capacidad del dispositivo ({card.tapLimit}).')
-            self.__tapsOpRange = number_of_taps
+    # Validación y escritura :
 
-        def __str__(self):
-            txt = '  Tap     Superior         Inferior\n'
-            for i in range(self.len):
-                txt += '   %d   %s  %s\n' % (i + 1, self.thresholds[i].sup,
-                                             self.thresholds[i].inf)
-            return txt
+    def validate(self, sups, infs):
+        u'''
+        Verifica la tabla de los umbrales superiores sups e inferiores infs
+        (tensiones) : que no excedan los taps de la tarjeta, que no estén
+        invertidos y que los umbrales de taps consecutivos se traslapen (el
+        umbral superior de cada tap no puede ser menor que el inferior del
+        siguiente). Devuelve los valores internos (sups, infs), o levanta
+        ValueError.
+        '''
+        if len(sups) != len(infs):
+            raise ValueError(u'La tabla de umbrales esta incompleta.')
+        if len(sups) > self.card.tapLimit:
+            raise ValueError(f'El numero de taps ({len(sups)}) excede la '
+                             f'capacidad del dispositivo ({self.card.tapLimit}).')
+
+        if numpy is not None:
+            sup, inf = numpy.asarray(sups, float), numpy.asarray(infs, float)
+            inverted = numpy.flatnonzero(sup <= inf)
+            apart = numpy.flatnonzero(sup[:-1] < inf[1:])
+        else:
+            inverted = [n for n in range(len(sups)) if sups[n] <= infs[n]]
+            apart = [n for n in range(len(sups) - 1) if sups[n] < infs[n + 1]]
+
+        if len(inverted):
+            raise ValueError(f'Los umbrales del tap {inverted[0] + 1} estan '
+                             f'invertidos.')
+        if len(apart):
+            n = apart[0] + 1
+            raise ValueError(f'Los taps {n} y {n+1} no se traslapan.\n'
+                             f'(El umbral superior del tap {n} es menor que el '
+                             f'inferior del tap {n+1})')
+
+        internal_sups, internal_infs = self.internals(sups), self.internals(infs)
+        for n, word in enumerate(internal_sups + internal_infs):
+            if not (self.limits[0] <= word <= self.limits[1]):
+                raise ValueError(u'Valor interno (%d) fuera de rango .' % word)
+
+        return internal_sups, internal_infs
+
+    def write(self, sups, infs):
+        u'''
+        Escribe la tabla de umbrales (tensiones) de len(sups) taps operativos,
+        previamente validada (ver validate()), junto con el número de taps.
+        '''
+        internal_sups, internal_infs = self.validate(sups, infs)
 
-    return ThresholdList()
+        block = list(self.internal)
+        block[0:2*len(sups):2] = internal_sups
+        block[1:2*len(infs):2] = internal_infs
 
+        with self.card.staged():
+            self.stage(block)
+            if self.card._tapsOpRange != len(sups):
+                self.card._tapsOpRange = len(sups)
 
-def getAttributeParameter(name, container, typ):
-    for p in container.__dict__.keys():
-        if isinstance(container.__dict__[p], typ):
-            if container.__dict__[p].name == name:
-                return p
+    def set(self, n, pos, value):
+        u'''
+        Modifica el umbral pos ('sup' o 'inf') del tap n, a la tensión value.
+        '''
+        word = self.internals([value])[0]
+        if not (self.limits[0] <= word <= self.limits[1]):
+            raise ValueError(u'Valor interno (%d) fuera de rango .' % word)
 
-    return None
+        block = list(self.internal)
+        block[2*n + (pos == 'inf')] = word
+        with self.card.staged():
+            self.stage(block)
 
+    def stage(self, block):
+        u'''
+        Registra en la escritura diferida activa el bloque de los umbrales
+        block, solo las palabras que difieren del contenido actual (para no
+        reescribir la EEPROM innecesariamente), y memoriza el nuevo bloque.
+        '''
+        card = self.card
+        param = type(card)._threshold
+        for n, (old, new) in enumerate(zip(self.internal, block)):
+            if old != new:
+                card._stage.write(param.adr + 2*n, struct.pack('<H', new),
+                                  param)
+        param.value[card] = tuple(block)
+
+    # Secuencia de los taps :
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self.Tap(self, n)
+                    for n in range(*item.indices(self.card.tapLimit))]
+        if not (-self.card.tapLimit <= item < self.card.tapLimit):
+            raise IndexError(item)
+        return self.Tap(self, item % self.card.tapLimit)
+
+    def __len__(self):
+        return self.card._tapsOpRange
 
-def isAttributeName(name, container, typ):
-    return name in [container.__dict__[p].name
-                    for p in container.__dict__.keys() if isinstance(container.__dict__[p], typ)]
+    @property
+    def len(self):
+        return self.card._tapsOpRange
+
+    @len.setter
+    def len(self, number_of_taps):
+        if number_of_taps > self.card.tapLimit:
+            raise ValueError(f'El numero de taps solicitados ({number_of_taps}) '
+                             f'excede la capacidad del dispositivo ({self.card.tapLimit}).')
+        self.card._tapsOpRange = number_of_taps
+
+    def __str__(self):
+        txt = '  Tap     Superior         Inferior\n'
+        for n, (sup, inf) in enumerate(self.values()):
+            txt += '   %d   %s  %s\n' % (n + 1, sup, inf)
+        return txt
 
 
 class EstCard1V0(OTCCard):
@@ -463,6 +826,17 @@ class EstCard1V0(OTCCard):
     _tapStatus = CardParameter(tapStatusAdr, '<H', u'Tap Activo')
     # _tapsFlags = CardParameter(0xE076, '<B', u'Tap Flags')
 
+    # Alias de los nombres de los parámetros (ver get() y set()) :
+    parameterAliases = {'Tap': 'Tap Activo',
+                        'Escala': 'Escala de las mediciones',
+                        'Ganancia L': 'Ganancia Fase L - Neutro',
+                        'Ganancia U': 'Ganancia Fase U - Neutro',
+                        'Ganancia V': 'Ganancia Fase V - Neutro',
+                        'Serie': 'Número de Serie',
+                        'Cliente': 'Nombre del Cliente',
+                        'Umbrales': 'Umbrales de Tensión',
+                        'Modo': 'Modo de Operación'}
+
     # Palabra Clave para activar el control remoto :
     PASSWORD = "CFG_USER"
     CLR_PSW = "--------"
@@ -516,7 +890,7 @@ class EstCard1V0(OTCCard):
     _gainU = CardParameter(gainUAdr, '<H', 'Ganancia Fase U - Neutro')
     _gainV = CardParameter(gainVAdr, '<B', 'Ganancia Fase V - Neutro')
     gainL = ScaledParameter(_gainL,
-                            [lambda x: math.sqrt(x/EstCard1V0.GAIN_NOM),
+                            [lambda x: (x/EstCard1V0.GAIN_NOM) ** 0.5,
                              lambda x: x**2 * EstCard1V0.GAIN_NOM],
                             fmt=r'%7.5f [0x%04X]')
 
@@ -538,10 +912,15 @@ class EstCard1V0(OTCCard):
                  'EstCard13V1': 6, 'EstMAQ-I4M': 4, 'EstCard 32V0': 10,
                  'EstCard 23V5': 10}
 
-    # Contenido total de la EEPROM :
-    _eepromLow = CardParameter(eepromAdr, '<128B', 'Mitad baja de la EEPROM')
-    _eepromHigh = CardParameter(
-        eepromAdr+128, '<128B', 'Mitad alta de la EEPROM')
+    # Grupos de parámetros (nombres de los atributos) que se leen juntos (ver
+    # prefetch()) :
+    _measureParameters = ('_scale', '_gainL', '_gainU', '_gainV')
+    _infoParameters = ('_client', '_date', '_serie', '_vin', '_vout', '_reg',
+                       '_rs', '_rd', '_vref')
+
+    # Los parámetros de la EEPROM se conservan entre ejecuciones en una imagen
+    # persistente (ver openImage()), salvo que se deshabilite :
+    use_image = True
 
     def __init__(self, card):
         # Se heredan las propiedades básicas de card (puerto serie, reporte e
@@ -554,6 +933,13 @@ class EstCard1V0(OTCCard):
         # TODO Debe verificarse el modelo de hardware  antes de validar isKnown
         self.isKnown = True
 
+        # Se recupera la imagen de la EEPROM de ejecuciones previas :
+        self.openImage()
+
+        # La escala y las ganancias (necesarias para las fases de medición)
+        # son contiguas, se leen en una sola orden :
+        self.prefetch(self._measureParameters)
+
         # Se asignan los contenedores de los parámetros de cada fase de medición :
         self.LN = Phase(self, 'LN')
         self.UV = Phase(self, 'UV')
@@ -568,49 +954,156 @@ class EstCard1V0(OTCCard):
         # Bandera para indicar si se esta en el modo remoto :
         self._remote_mode = False
 
-        self.threshold = ThresholdSetFactory(self)
+        self.threshold = ThresholdTable(self)
 
     # Salvo algunas excepciones, en general los parámetros del dispositivo y por
     # ende los atributos de EstCard, solo se leen o modifican una vez y resulta
     # conveniente identificarlos por su nombre 'natural' mas que por el nombre
     # formal del atributo que lo representa, con esta funcionalidad se incluyen
-    # las funciones get() y set():
+    # las funciones get() y set(). Los nombres se buscan en los índices de la
+    # clase (parameters) y de las banderas del modo de operación (ModeFlags.
+    # flags), sin distinguir mayúsculas ni acentos, o por sus alias :
+    def lookup(self, name):
+        u'''
+        Devuelve el objeto (la tarjeta o sus banderas del modo de operación) y
+        el nombre del atributo del parámetro name.
+        '''
+        # Los parámetros del dispositivo son de dos tipos, ModeFlags o
+        # CardParameter, primero se busca el nombre exacto :
+        indexes = [(ModeFlags.flags, self.modeFlags),
+                   (type(self).parameters, self)]
+        for index, obj in indexes:
+            if name in index.names:
+                return obj, index.names[name]
+
+        for index, obj in indexes:
+            found = index.find(name)
+            if found is not None:
+                return obj, index.names[found]
+
+        suggestions = ModeFlags.flags.suggest(name) + \
+            type(self).parameters.suggest(name)
+        msg = '%s no es un parámetro de EstCard.' % name
+        if suggestions:
+            msg += ' Quizás : %s' % ', '.join("'%s'" % s.strip()
+                                              for s in suggestions)
+        raise ValueError(msg)
+
     def set(self, name, value):
-        # Los parámetros del dispositivo son de dos tipos ...
+        obj, attr = self.lookup(name)
         try:
-            # ModeFlags :
-            if isAttributeName(name, ModeFlags, ModeFlags.Flag):
-                setattr(self.modeFlags,
-                        getAttributeParameter(name, ModeFlags, ModeFlags.Flag), value)
-                return
-            # o CardParameter ...
-            else:
-                for cls in type(self).__mro__:
-                    if isAttributeName(name, cls, CardParameter):
-                        setattr(self, getAttributeParameter(
-                            name, cls, CardParameter), value)
-                        return
+            setattr(obj, attr, value)
         except struct.error as e:
             raise ValueError('Error : El valor no tiene el formato correcto.')
 
-        raise ValueError('%s no es un parámetro de EstCard.' % name)
-
     def get(self, name):
-        if isAttributeName(name,  ModeFlags, ModeFlags.Flag):
-            return getattr(self.modeFlags,
-                           getAttributeParameter(name, ModeFlags,  ModeFlags.Flag))
-        else:
-            for cls in type(self).__mro__:
-                if isAttributeName(name, cls, CardParameter):
-                    return getattr(self, getAttributeParameter(name, cls, CardParameter))
+        obj, attr = self.lookup(name)
+        return getattr(obj, attr)
+
+    def prefetch(self, names):
+        u'''
+        Lee los parámetros cuyos nombres de atributo son names, con el menor
+        número de ordenes (ver read_parameters()), los parámetros que ya han
+        sido leídos o escritos no se vuelven a leer.
+        '''
+        read_parameters(self, [getattr(type(self), n) for n in names])
+
+    @classmethod
+    def imageCheckSize(cls):
+        u'''
+        Devuelve el tamaño de la región de la EEPROM que se compara con la
+        imagen para validarla, desde su inicio hasta el final del último pará-
+        metro (no volátil) de la EEPROM de la clase, i.e. todos los parámetros
+        que pueden obtenerse de la imagen. Se lee en una sola orden.
+        '''
+        end = max(p.adr + p.size for p in cls.parameterList()
+                  if (p.typ != 'volatil') and
+                  (cls.eepromAdr <= p.adr < cls.eepromAdr + cls.eepromSize))
+        return min(end - cls.eepromAdr, cls.eepromSize)
 
-        raise ValueError('%s no es un parámetro de EstCard.' % name)
+    def openImage(self):
+        u'''
+        Asocia a la tarjeta la imagen persistente de su EEPROM, identificada
+        por el modelo de hardware y el número de serie. La imagen se valida
+        comparando los primeros imageCheckSize() bytes de la EEPROM (todos los
+        parámetros de la tarjeta, incluido el número de serie), que se leen
+        en una sola orden, si no coinciden la imagen se descarta. Nótese que
+        la validación no detecta las modificaciones en el resto de la EEPROM
+        realizadas por otros medios, en tal caso debe deshabilitarse la imagen
+        (use_image).
+
+        Si el número de serie esta vacío o no es imprimible (e.g. una tarjeta
+        sin programar), no identifica a la tarjeta y no se utiliza la imagen.
+        '''
+        if not self.use_image:
+            return
+
+        size = self.imageCheckSize()
+        try:
+            check = bytes(self.dev.getData(self.eepromAdr, size))
+        except OTCProtocolError as e:
+            raise OTCProtocolError(u'No se pudo validar la imagen de la '
+                                   u'EEPROM.', e, self)
+
+        start = self.serieAdr - self.eepromAdr
+        serie = check[start:start + type(self)._serie.size]
+        serie = serie.split(b'\x00')[0].decode('latin-1')
+        if not serie.strip() or not serie.isprintable():
+            self.log.debug(u'El número de serie (%r) no identifica a la '
+                           u'tarjeta, no se utiliza la imagen.', serie)
+            return
+
+        try:
+            image = PersistentImage(self.eepromAdr, self.eepromSize,
+                                    PersistentImage.path(
+                                        self.id['hardware_model'], serie))
+        except (OSError, ValueError) as e:
+            self.log.warning(u'No se pudo abrir la imagen de la EEPROM '
+                             u'(%s).' % e)
+            return
+
+        if image.load(self.eepromAdr, size) != check:
+            self.log.debug(u'La imagen de la EEPROM no es válida, se descarta.')
+            image.clear()
+        image.store(self.eepromAdr, check)
+
+        self._image = image
+
+    def staged(self, verify=False):
+        u'''
+        Devuelve una sesión de escritura diferida sobre la EEPROM (ver
+        WriteStage), en la que las modificaciones de los parámetros se
+        escriben al terminar, agrupadas en el menor número de ordenes :
+
+            with card.staged():
+                ...
+        '''
+        return WriteStage(self, self.eepromAdr, self.eepromSize, verify)
+
+    def eepromRegion(self):
+        u'''
+        Devuelve la región de la EEPROM (ver MemoryRegion), para la lectura y
+        escritura de su contenido completo.
+        '''
+        return MemoryRegion(self, self.eepromAdr, self.eepromSize)
 
     @property
     def eeprom(self):
-        contents = list(self._eepromLow)
-        contents.extend(self._eepromHigh)
-        return tuple(contents)
+        # El contenido se lee siempre de la tarjeta (no de la imagen), ya que
+        # se utiliza para su respaldo :
+        return self.eepromRegion().read()
+
+    def restore(self, data, verify=True, keep_serie=True):
+        u'''
+        Restaura el contenido completo de la EEPROM (data, bytes o bytearray
+        de eepromSize bytes, por ejemplo de su respaldo), solo se escriben las
+        páginas que difieren del contenido actual y opcionalmente (verify) se
+        verifica su CRC. Salvo que keep_serie sea falso, se conserva el número
+        de serie de la tarjeta (para copiar la configuración de otra tarjeta).
+        Devuelve el CRC del contenido escrito.
+        '''
+        preserve = [(self.serieAdr, type(self)._serie.size)] if keep_serie else []
+        return self.eepromRegion().write(data, verify, preserve=preserve)
 
     # Número Máximo de la Tarjeta :
 
@@ -653,16 +1146,13 @@ class EstCard1V0(OTCCard):
 
     # Métodos de Arranque y Detención de la captura de la medición :
 
-    def StartMeasure(self):
+    def StartMeasure(self, rate=None):
         if not math.isnan(self.scale):
             # Se inicializa el hilo de ejecución para la medición :
-            self.measure = MeasureTask(self)
-            self.measure.setDaemon(True)
-            self.LN.stats.arm()
-            self.UV.stats.arm()
+            self.measure = MeasureTask(self, rate)
+            self.measure.daemon = True
             self.measure.start()
-            while not self.measure.started:
-                continue
+            self.measure.wait_started()
         else:
             raise ValueError('Error : No se puede proseguir, '
                              'la escala es inválida (NAN).')
@@ -671,8 +1161,7 @@ class EstCard1V0(OTCCard):
         # Se detiene el hilo de ejecución de la medición :
         if 'measure' in self.__dict__.keys():
             self.measure.stop()
-            while self.measure.is_alive():
-                continue
+            self.measure.join()
 
     def calibrator(self, input, ref):
         class Calibrator(object):
@@ -829,6 +1318,9 @@ class EstCard1V2(EstCard1V0):
         # TODO Debe verificarse el modelo de hardware  antes de validar isKnown
         self.isKnown = True
 
+        # Se recupera la imagen de la EEPROM de ejecuciones previas :
+        self.openImage()
+
     @property
     def measureMode(self):
         return ['L Cal', 'U Cal', 'V Cal'][self._measureMode]
@@ -848,9 +1340,9 @@ class EstCard1V2(EstCard1V0):
             raise ValueError('Asignación del modo de medición '
                              'con un valor incorrecto.')
 
-    def StartMeasure(self, mode):
+    def StartMeasure(self, mode, rate=None):
         self.measureMode = mode
-        EstCard1V0.StartMeasure(self)
+        EstCard1V0.StartMeasure(self, rate)
 
     def ExitRemoteMode(self):
         # CtrEst1V2, maneja correcamente el cierre del modo de configuración, al
@@ -870,9 +1362,18 @@ class EstCard(OTCCard):
     def __new__(self, comm_name, throughput_limit=False):
         # Se crea una instancia de la clase base (OTCCard) con el fin de obtener
         # laidentificación del software :
-        card = OTCCard(OTCProtocol(comm_name, throughput_limit),
-                       report.getLogger('EstCard'))
+        dev = OTCProtocol(comm_name, throughput_limit)
+        try:
+            return self._identify(OTCCard(dev, report.getLogger('EstCard')))
 
+        # Si la identificación (o la creación de la instancia) falla se cierra
+        # el puerto, que de lo contrario quedaría abierto :
+        except Exception:
+            dev.close()
+            raise
+
+    @staticmethod
+    def _identify(card):
         # Se identifica el núcleo de software de tarjeta y se devuelve una
         # instancia para la versión correspondiente :
         if card.id['software_kernel'] == 'CtrEst 1V0':
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Replay.py
+
+Análisis posterior (reproducción) de las capturas de la medición (ver el
+módulo Capture) : las estadísticas de las fases (Measure_Statistics) en
+cualquier intervalo de tiempo y el tap activo en cada momento.
+
+La hora de cada registro se interpola entre las horas de escritura de los
+bloques (la del bloque anterior, o la de inicio de la captura, y la del
+propio bloque). El índice del tap activo (sus cambios) se calcula bloque a
+bloque y se conserva junto a la captura (archivo .tapidx.npz), de manera que
+solo se calcula una vez.
+
+En la captura de varias tarjetas (multiplexada) la reproducción se limita
+a los bloques de una de ellas.
+
+Este módulo requiere numpy.
+"""
+
+import math
+import bisect
+
+import numpy
+
+from estCard.Capture import CaptureReader
+from estCard.EstCard import Measure_Statistics, EstCard1V0
+
+
+class CaptureReplay(object):
+    u"""
+    Reproducción de la captura del archivo filename, o de la tarjeta card (su
+    índice) si es una captura multiplexada.
+    """
+
+    def __init__(self, filename, card=0):
+        self.capture = CaptureReader(filename)
+        self.metadata = self.capture.metadata
+
+        # Bloques de la captura que se reproducen :
+        self.blocks = list(range(len(self.capture.counts)))
+        self.card = None
+        if 'cards' in self.metadata:
+            self.blocks = [n for n in self.blocks
+                           if self.capture.block(n, 'card')[0] == card]
+            self.metadata = dict(self.metadata, **self.metadata['cards'][card])
+            self.card = card
+
+        self.counts = [self.capture.counts[n] for n in self.blocks]
+        self.firsts = numpy.concatenate(([0], numpy.cumsum(self.counts,
+                                                           dtype='i8')))
+        self.times = numpy.array([self.capture.times[n] for n in self.blocks],
+                                 'f8')
+        self.starts = numpy.concatenate(([self.metadata['start_time']],
+                                         self.times[:-1]))
+
+        self._load_tap_index()
+
+    def __len__(self):
+        return int(self.firsts[-1])
+
+    def close(self):
+        self.capture.close()
+
+    # Correspondencia entre la hora y el índice de los registros :
+
+    def index_at(self, t):
+        u"""
+        Devuelve el índice del primer registro con hora igual o posterior a t.
+        """
+        n = int(numpy.searchsorted(self.times, t))
+        if n >= len(self.times):
+            return len(self)
+
+        start, end = self.starts[n], self.times[n]
+        frac = (t - start) / (end - start) if end > start else 0.0
+        k = int(numpy.ceil(max(0.0, frac) * self.counts[n])) - 1
+        return int(self.firsts[n]) + max(0, k)
+
+    def time_of(self, index):
+        u"""
+        Devuelve la hora (interpolada) del registro index.
+        """
+        n = int(numpy.searchsorted(self.firsts, index, 'right')) - 1
+        k = index - self.firsts[n]
+        start, end = self.starts[n], self.times[n]
+        return float(start + (k + 1) * (end - start) / self.counts[n])
+
+    # Estadísticas de las fases :
+
+    def statistics(self, phase, start=None, end=None):
+        u"""
+        Devuelve las estadísticas (Measure_Statistics) de la fase phase ('LN'
+        o 'UV') de los registros entre las horas start y end (por defecto
+        toda la captura), con la escala y ganancia de la cabecera.
+        """
+        gain = self.metadata['gains'].get(phase[0], 57000)
+        stats = Measure_Statistics(self.metadata['scale'] /
+                                   math.sqrt(gain / EstCard1V0.GAIN_NOM))
+
+        first = 0 if start is None else self.index_at(start)
+        last = len(self) if end is None else self.index_at(end)
+
+        for n, column in self._blocks(phase, first, last):
+            stats.add_batch(column, now=self.times[n])
+
+        return stats
+
+    def _blocks(self, name, first, last):
+        # Devuelve las secciones de la columna name de cada bloque, entre los
+        # registros first y last (excluido) :
+        n = int(numpy.searchsorted(self.firsts, first, 'right')) - 1
+        while (n < len(self.counts)) and (self.firsts[n] < last):
+            column = self.capture.block(self.blocks[n], name)
+            lo = max(first - self.firsts[n], 0)
+            hi = min(last - self.firsts[n], len(column))
+            if hi > lo:
+                yield n, column[lo:hi]
+            n += 1
+
+    # Índice del tap activo :
+
+    def _load_tap_index(self):
+        index_name = self.capture.filename + ('.tapidx.npz' if self.card is None
+                                              else '.%d.tapidx.npz' % self.card)
+        try:
+            index = numpy.load(index_name)
+            if int(index['records']) == len(self):
+                self.tap_firsts = index['firsts']
+                self.tap_values = index['values']
+                return
+        except (OSError, KeyError, ValueError):
+            pass
+
+        firsts, values = [], []
+        last_tap = None
+        for n in range(len(self.counts)):
+            taps = self.capture.block(self.blocks[n], 'tap')
+            if not len(taps):
+                continue
+
+            changes = numpy.flatnonzero(taps[1:] != taps[:-1]) + 1
+            if taps[0] != last_tap:
+                changes = numpy.concatenate(([0], changes))
+
+            firsts.append(changes + self.firsts[n])
+            values.append(taps[changes])
+            last_tap = taps[-1]
+
+        self.tap_firsts = numpy.concatenate(firsts) if firsts else \
+            numpy.zeros(0, 'i8')
+        self.tap_values = numpy.concatenate(values) if values else \
+            numpy.zeros(0, 'u2')
+
+        try:
+            numpy.savez(index_name, records=len(self), firsts=self.tap_firsts,
+                        values=self.tap_values)
+        except OSError:
+            pass
+
+    def tap_at(self, t):
+        u"""
+        Devuelve el tap activo a la hora t (None si es anterior a la captura).
+        """
+        index = self.index_at(t)
+        n = bisect.bisect_right(self.tap_firsts, min(index, len(self) - 1)) - 1
+        return int(self.tap_values[n]) if n >= 0 else None
+
+    def tap_intervals(self, start=None, end=None):
+        u"""
+        Devuelve la lista de los intervalos (hora inicial, hora final, tap)
+        en los que el tap permaneció activo, entre las horas start y end.
+        """
+        first = 0 if start is None else self.index_at(start)
+        last = len(self) if end is None else self.index_at(end)
+
+        bounds = list(self.tap_firsts) + [len(self)]
+        intervals = []
+        for n, tap in enumerate(self.tap_values):
+            lo, hi = max(bounds[n], first), min(bounds[n + 1], last)
+            if hi > lo:
+                intervals.append((self.time_of(lo), self.time_of(hi - 1),
+                                  int(tap)))
+        return intervals
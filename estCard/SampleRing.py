@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+SampleRing.py
+
+Almacén circular de las muestras de la medición (registros de width valores
+enteros i.e. (tap, LN, UV)), con un solo productor (el hilo de medición) y
+uno o mas consumidores, cada uno con su propio cursor (RingCursor).
+
+El almacén se reserva al crearse (array de capacity*width elementos) y cada
+muestra se identifica por su número de secuencia (monótono creciente), el
+productor no utiliza bloqueos : escribe la muestra y luego incrementa head,
+los consumidores obtienen las muestras pendientes como vistas (memoryview)
+del almacén, sin copiarlas.
+
+Si un consumidor se retrasa mas de capacity muestras, las muestras sobre-
+escritas se contabilizan en su atributo dropped. Por la misma razón, las
+vistas devueltas por RingCursor.drain() deben procesarse antes que el pro-
+ductor complete una vuelta al almacén.
+"""
+
+import struct
+import threading
+from array import array
+
+
+class SampleRing(object):
+    u"""
+    Almacén circular de capacity registros de width valores del tipo typecode
+    (ver el módulo array).
+    """
+
+    def __init__(self, capacity=4096, width=3, typecode='H'):
+        self.capacity = capacity
+        self.width = width
+
+        self.data = array(typecode, bytes(capacity * width *
+                                          array(typecode).itemsize))
+        self.view = memoryview(self.data)
+
+        # Número de secuencia de la siguiente muestra (i.e. el número de
+        # muestras recibidas) :
+        self.head = 0
+        self.closed = False
+
+        self._record = struct.Struct('=%d%s' % (width, typecode))
+        self._bytes = self.view.cast('B')
+        # Eventos de los cursores, la tupla se reemplaza (no se modifica) al
+        # agregar o retirar un cursor :
+        self._events = ()
+
+    def put(self, record):
+        u"""
+        Agrega la muestra record (una secuencia de width valores).
+        """
+        offset = (self.head % self.capacity) * self._record.size
+        self._record.pack_into(self._bytes, offset, *record)
+        self.head += 1
+
+        for event in self._events:
+            event.set()
+
+    def close(self):
+        u"""
+        Indica que el productor ha terminado, los consumidores en espera son
+        liberados.
+        """
+        self.closed = True
+        for event in self._events:
+            event.set()
+
+    def cursor(self, oldest=False):
+        u"""
+        Devuelve un nuevo cursor para consumir las muestras, desde la siguiente
+        muestra, o desde la mas antigua disponible si oldest es verdadero.
+        """
+        return RingCursor(self, oldest)
+
+    def __len__(self):
+        return min(self.head, self.capacity)
+
+
+class RingCursor(object):
+    u"""
+    Cursor de un consumidor de SampleRing, seq es el número de secuencia de
+    la siguiente muestra a consumir y dropped el número de muestras perdidas
+    (sobre-escritas antes de consumirse).
+    """
+
+    def __init__(self, ring, oldest=False):
+        self.ring = ring
+        self.seq = max(0, ring.head - ring.capacity) if oldest else ring.head
+        self.dropped = 0
+
+        self.event = threading.Event()
+        ring._events += (self.event,)
+
+    def pending(self):
+        return self.ring.head - self.seq
+
+    def drain(self, n=None):
+        u"""
+        Consume hasta n muestras pendientes (todas por defecto) y devuelve la
+        tupla (seq, view), donde seq es el número de secuencia de la primera
+        muestra y view la vista (memoryview) de sus valores, consecutivos de
+        width en width. La vista no cruza el final del almacén, por lo que
+        pueden quedar muestras pendientes aún con n = None.
+        """
+        ring = self.ring
+        head = ring.head
+
+        lag = head - self.seq
+        if lag > ring.capacity:
+            self.dropped += lag - ring.capacity
+            self.seq = head - ring.capacity
+
+        start = self.seq % ring.capacity
+        count = min(head - self.seq, ring.capacity - start)
+        if n is not None:
+            count = min(count, n)
+
+        seq = self.seq
+        self.seq += count
+
+        return (seq, ring.view[start * ring.width:(start + count) * ring.width])
+
+    def wait(self, timeout=None):
+        u"""
+        Espera (hasta timeout segundos) que existan muestras pendientes o que
+        el almacén se cierre. Devuelve verdadero si es así.
+        """
+        self.event.clear()
+        if self.pending() or self.ring.closed:
+            return True
+        return self.event.wait(timeout)
+
+    def close(self):
+        u"""
+        Desvincula el cursor del almacén.
+        """
+        self.ring._events = tuple(e for e in self.ring._events
+                                  if e is not self.event)
@@ -2,3 +2,4 @@
 # -*- coding: utf-8 -*-
 
 from estCard.EstCard import *
+from estCard.SampleRing import *
@@ -0,0 +1,350 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+AsyncOTCProtocol.py
+
+Versión asíncrona (asyncio) de OTCProtocol, con las mismas reglas del pro-
+tocolo (ver OTCProtocol), de manera que un solo bucle de eventos (event loop)
+pueda atender las sesiones de varios dispositivos.
+
+El puerto serie se abre en modo no bloqueante (timeout = 0), los bytes reci-
+bidos se procesan a medida que llegan (el bucle de eventos notifica que el
+descriptor del puerto tiene datos disponibles) hasta completar las respues-
+tas de las ordenes pendientes. En los sistemas en los que el bucle no puede
+vigilar el descriptor del puerto (i.e. Windows), este se consulta periódica-
+mente cada poll_interval segundos.
+
+Las ordenes se encadenan (pipelining) : se envían sin esperar la respuesta
+de las anteriores, hasta un máximo de window ordenes pendientes, y como el
+protocolo garantiza una respuesta por orden, las respuestas se asignan en el
+orden de envío (como en OTCProtocol.batch()). Una respuesta inválida que
+termina con el byte de respuesta (ACK/NACK) solo afecta a su orden, pero si
+vence el tiempo límite de una orden o se recibe una respuesta no reconocible
+de una orden SET se pierde la sincronización, y fallan todas las ordenes
+pendientes. Antes de transmitir la siguiente orden se descartan los bytes
+recibidos durante resync_gap segundos (i.e. las respuestas tardías de las
+ordenes fallidas), como lo hace OTCProtocol antes de cada orden.
+"""
+
+import asyncio
+import logging
+import collections
+
+import serial
+
+from .OTCProtocolError import OTCProtocolError
+from .OTCProtocol import OTCProtocol, ACK_CHAR, NACK_CHAR, XMIT_BURST, \
+    XMIT_BYTE, encode_get, encode_set, decode_data, _TERMINATOR
+import otcCard.SerialDevice as SerialDevice
+from common.report import report, WIRE_TX, WIRE_RX
+
+
+class AsyncOTCProtocol(object):
+    u"""
+    Adopta el puerto serie comm_name para la comunicación con el dispositivo,
+    bajo las reglas del protocolo OTCProtocol, desde el bucle de eventos loop
+    (por defecto el bucle en curso), con hasta window ordenes pendientes (por
+    defecto OTCProtocol.batch_window).
+    """
+
+    # Tiempo límite (por defecto) de la respuesta de las ordenes :
+    timeout = 0.5
+
+    # Periodo de consulta del puerto, si el bucle no puede vigilarlo :
+    poll_interval = 0.002
+
+    # Tiempo durante el cual se descartan los bytes recibidos después de
+    # perder la sincronización :
+    resync_gap = 0.05
+
+    def __init__(self, comm_name, throughput_limit=False, xmit_mode=None,
+                 loop=None, window=None):
+        self.log = report.getLogger(u'AsyncOTCProtocol.' + str(comm_name))
+
+        self.throughput_limit = throughput_limit
+        self.xmit_mode = xmit_mode or XMIT_BURST
+        if self.xmit_mode not in [XMIT_BURST, XMIT_BYTE]:
+            raise ValueError(u'El modo de transmisión "%s" no es válido.'
+                             % self.xmit_mode)
+
+        # Con el simulador de Proteus se mantiene una sola orden pendiente :
+        if window is None:
+            window = OTCProtocol.batch_window
+        if throughput_limit or (window < 1):
+            window = 1
+        self.window = window
+
+        self._loop = loop or asyncio.get_running_loop()
+
+        # Se definen los parámetros de operación del puerto serie (los mismos
+        # de OTCProtocol), pero sin tiempos de espera en la lectura :
+        self._comm = SerialDevice()
+        self._comm.port = comm_name
+        self._comm.baudrate = 57600
+        self._comm.bytesize = 8
+        self._comm.parity = 'N'
+        self._comm.stopbits = serial.STOPBITS_TWO
+        self._comm.timeout = 0
+        self._comm.xonxoff = 0
+        self._comm.rtscts = 0
+        self._comm.dsrdtr = 0
+
+        self.log.debug(u'Abriendo el puerto serie : %s', str(self._comm))
+        self._comm.open()
+
+        self._cnt_bytes = 0
+
+        # Memoria de contención de los bytes recibidos y aún no procesados, y
+        # las ordenes pendientes de respuesta (en el orden de envío), como
+        # tuplas (orden, tamaño de la respuesta, futuro de la respuesta) :
+        self._rx = bytearray()
+        self._pending = collections.deque()
+
+        # Hora (del bucle) hasta la que se descartan los bytes recibidos antes
+        # de la próxima transmisión, si se perdió la sincronización :
+        self._resync = None
+
+        # Las ordenes se transmiten de a una, con hasta window pendientes :
+        self._xmit_lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(window)
+
+        self._poller = None
+        try:
+            self._loop.add_reader(self._comm.fileno(), self._on_readable)
+            self._fd = self._comm.fileno()
+        except (NotImplementedError, AttributeError, ValueError):
+            self._fd = None
+            self._poller = self._loop.create_task(self._poll())
+
+    # Recepción :
+
+    def _on_readable(self):
+        try:
+            chunk = self._comm.read(max(1, self._comm.in_waiting))
+        except serial.SerialException as e:
+            self._lost(OTCProtocolError(u'El puerto %s no responde.'
+                                        % self._comm.port, e, self))
+            return
+
+        if chunk:
+            self._trace(WIRE_RX, chunk)
+            self._cnt_bytes += len(chunk)
+            self._rx += chunk
+            self._parse()
+
+    async def _poll(self):
+        while True:
+            if self._comm.in_waiting:
+                self._on_readable()
+            await asyncio.sleep(self.poll_interval)
+
+    def _parse(self):
+        u"""
+        Identifica las respuestas de las ordenes pendientes en los bytes
+        recibidos, los bytes recibidos sin ordenes pendientes se descartan.
+        """
+        while self._rx:
+            if not self._pending:
+                del self._rx[:]
+                return
+
+            cmd, size, reply = self._pending[0]
+
+            # La respuesta de la orden SET es el byte de respuesta (ACK/NACK) :
+            if cmd == 'S':
+                ans = bytes(self._rx[:1])
+                if ans not in (ACK_CHAR, NACK_CHAR):
+                    self._lost(OTCProtocolError(u'El dispositivo envió una '
+                                                u'respuesta no reconocible.', None, self))
+                    return
+
+                del self._rx[:1]
+                self._pending.popleft()
+                if not reply.done():
+                    reply.set_result(ans == ACK_CHAR)
+                continue
+
+            # La respuesta de la orden GET termina con el byte de respuesta :
+            end = _TERMINATOR.search(self._rx)
+            if end is None:
+                return
+
+            end = end.start()
+            ans = bytes(self._rx[end:end + 1])
+            frame = bytes(self._rx[:end])
+            del self._rx[:end + 1]
+            self._pending.popleft()
+
+            # La orden pudo ser cancelada, pero su respuesta igualmente se
+            # retira :
+            if reply.done():
+                continue
+
+            try:
+                data = decode_data(frame)
+            except ValueError as e:
+                self.log.debug(str(e))
+                reply.set_exception(OTCProtocolError(u'Se recibio una secuencia '
+                                                     u'de escape desconocida', None, self))
+                continue
+
+            if (len(data) != size) or (ans != ACK_CHAR):
+                reply.set_exception(OTCProtocolError(u'El dispositivo rechazo la '
+                                                     u'lectura o la respuesta esta incompleta '
+                                                     u'(%d en lugar de %d bytes).'
+                                                     % (len(data), size), None, self))
+                continue
+
+            reply.set_result(memoryview(data))
+
+    def _lost(self, error):
+        u"""
+        Se perdió la sincronización con las respuestas, todas las ordenes
+        pendientes fallan con error.
+        """
+        while self._pending:
+            cmd, size, reply = self._pending.popleft()
+            if not reply.done():
+                reply.set_exception(error)
+        del self._rx[:]
+        self._resync = self._loop.time() + self.resync_gap
+
+    async def _discard(self):
+        u"""
+        Descarta los bytes recibidos hasta el fin del intervalo de resincroni-
+        zación (ver _lost()), incluidos los pendientes en el puerto.
+        """
+        await asyncio.sleep(max(0.0, self._resync - self._loop.time()))
+        self._resync = None
+
+        try:
+            waiting = self._comm.in_waiting
+            if waiting:
+                self._trace(WIRE_RX, self._comm.read(waiting))
+        except serial.SerialException:
+            pass
+        del self._rx[:]
+
+    def _trace(self, direction, data):
+        # Como en OTCProtocol, el registro binario (en el puerto serie)
+        # reemplaza a las líneas de texto del reporte :
+        if report.wire is None and OTCProtocol.log_bytes and self.log.isEnabledFor(logging.DEBUG):
+            if direction == WIRE_TX:
+                self.log.debug(u'Trasmitiendo : 0x%s', data.hex().upper())
+            else:
+                self.log.debug(u'Se recibió [%d] : 0x%s', len(data),
+                               data.hex().upper())
+
+    # Transmisión :
+
+    async def _xmit(self, frame):
+        self._trace(WIRE_TX, frame)
+
+        if self.xmit_mode == XMIT_BURST:
+            self._comm.write(frame)
+        else:
+            stop_time = self._comm.stopbits / self._comm.baudrate
+            for d in frame:
+                self._comm.write(bytes([d]))
+                await asyncio.sleep(stop_time)
+
+        if self.throughput_limit:
+            await asyncio.sleep(0.05)
+
+    async def _transact(self, cmd, frame, size, timeout):
+        if timeout is None:
+            timeout = self.timeout
+
+        async with self._slots:
+            reply = self._loop.create_future()
+
+            # La orden se registra como pendiente antes de transmitirla, las
+            # respuestas se asignan en el orden de envío :
+            async with self._xmit_lock:
+                if self._resync is not None:
+                    await self._discard()
+
+                self._pending.append((cmd, size, reply))
+                try:
+                    await self._xmit(frame)
+                except OTCProtocolError as e:
+                    self._lost(OTCProtocolError(u'Fallo de Transmisión.', e, self))
+
+            # El tiempo límite se cuenta desde la transmisión de la orden :
+            try:
+                return await asyncio.wait_for(reply, timeout)
+
+            except asyncio.TimeoutError:
+                error = OTCProtocolError(u'El dispositivo no responde (timeout).',
+                                         None, self)
+                self._lost(error)
+                raise error
+
+    async def get_data(self, adr, size, timeout=None):
+        u"""
+        Lee size bytes desde la dirección adr en el dispositivo y los devuelve
+        (memoryview), el tiempo límite de la respuesta es timeout segundos
+        (por defecto el atributo timeout).
+        """
+        try:
+            return await self._transact('G', encode_get(adr, size), size,
+                                        timeout)
+
+        except OTCProtocolError as e:
+            raise OTCProtocolError(u'No se pudo obtener el contenido de '
+                                   u'0x%04X / 0x%02X bytes.' % (adr, size), e, self)
+
+    async def set_data(self, adr, data, timeout=None):
+        u"""
+        Escribe la secuencia de bytes data desde la dirección adr en el dispo-
+        sitivo, devuelve True/False según la respuesta (ACK/NACK), el tiempo
+        límite de la respuesta es timeout segundos (por defecto el atributo
+        timeout).
+        """
+        data = bytes(data)
+        try:
+            return await self._transact('S', encode_set(adr, data), 0, timeout)
+
+        except OTCProtocolError as e:
+            raise OTCProtocolError(u'No se pudo modificar el contenido de '
+                                   u'0x%04X / 0x%02X bytes.' % (adr, len(data)), e, self)
+
+    async def batch(self, commands, timeout=None):
+        u"""
+        Versión asíncrona de OTCProtocol.batch() : ejecuta la secuencia de
+        ordenes commands, tuplas ('G', adr, size) o ('S', adr, data), encade-
+        nadas, y devuelve la lista de sus resultados. Las ordenes fallidas se
+        repiten una vez.
+        """
+        async def execute(cmd):
+            for attempt in (0, 1):
+                try:
+                    if cmd[0] in ['G', b'G']:
+                        return await self.get_data(cmd[1], cmd[2], timeout)
+                    elif cmd[0] in ['S', b'S']:
+                        return await self.set_data(cmd[1], cmd[2], timeout)
+                    raise ValueError(u'Batch : La orden "%s" no es válida.'
+                                     % str(cmd[0]))
+                except OTCProtocolError:
+                    if attempt:
+                        raise
+
+        results = await asyncio.gather(*[execute(cmd) for cmd in commands],
+                                       return_exceptions=True)
+        for r in results:
+            if isinstance(r, Exception):
+                raise r
+        return results
+
+    def close(self):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+        if self._poller is not None:
+            self._poller.cancel()
+
+        if self._pending:
+            self._lost(OTCProtocolError(u'Se cerro el puerto serie.', None, self))
+
+        self._comm.close()
+        self.log.debug(u'Se cerro el puerto serie : %s', str(self._comm.port))
@@ -0,0 +1,555 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+MemoryImage.py
+
+Define la imagen (espejo) de una región de memoria del dispositivo remoto, su
+variante persistente en un archivo (PersistentImage) y la sesión de escritura
+diferida (WriteStage) que se apoya en ella.
+
+La imagen registra el contenido conocido de cada byte de la región (leído o
+escrito), la sesión de escritura diferida además registra los bytes modifi-
+cados (sucios), para finalmente escribirlos en el dispositivo con el menor
+número de ordenes SET, en segmentos limitados en las fronteras de las páginas
+de PAGE_SIZE bytes.
+
+MemoryRegion transfiere el contenido completo de una región (por ejemplo la
+EEPROM) desde y hacia una memoria de bytes (bytearray o memoryview), para su
+respaldo y restauración : lee en bloques alineados con las páginas, escribe
+solo las páginas que difieren del contenido actual y verifica el resultado
+por medio de su CRC.
+"""
+
+import os
+import re
+import mmap
+import zlib
+
+from .OTCProtocolError import OTCProtocolError
+
+# Tamaño de las páginas de escritura, las ordenes SET no deben atravesar sus
+# fronteras :
+PAGE_SIZE = 16
+
+
+class MemoryImage(object):
+    u"""
+    Imagen de la región de memoria de size bytes desde la dirección adr, el
+    contenido se mantiene en el atributo data y el atributo known indica por
+    cada byte si su contenido es conocido (1) o no (0).
+    """
+
+    def __init__(self, adr, size):
+        self.adr = adr
+        self.size = size
+
+        self.data = bytearray(size)
+        self.known = bytearray(size)
+
+    def contains(self, adr, size):
+        u"""
+        Indica si los size bytes desde adr pertenecen a la región.
+        """
+        return (adr >= self.adr) and (adr + size <= self.adr + self.size)
+
+    def isKnown(self, adr, size):
+        u"""
+        Indica si el contenido de los size bytes desde adr es conocido.
+        """
+        start = adr - self.adr
+        return self.contains(adr, size) and \
+            not (0 in self.known[start:start + size])
+
+    def store(self, adr, data):
+        u"""
+        Registra data como el contenido conocido desde la dirección adr, la
+        parte que no pertenece a la región se ignora.
+        """
+        start = max(adr, self.adr)
+        end = min(adr + len(data), self.adr + self.size)
+        if start >= end:
+            return
+
+        self.data[start - self.adr:end - self.adr] = \
+            data[start - adr:end - adr]
+        self.known[start - self.adr:end - self.adr] = b'\x01'*(end - start)
+
+    def load(self, adr, size):
+        u"""
+        Devuelve el contenido de los size bytes desde adr, o None si no es
+        conocido en su totalidad.
+        """
+        if not self.isKnown(adr, size):
+            return None
+        return bytes(self.data[adr - self.adr:adr - self.adr + size])
+
+    def clear(self, adr=None, size=None):
+        u"""
+        Olvida el contenido de los size bytes desde adr, o de toda la región
+        si no se especifican.
+        """
+        if adr is None:
+            self.known[:] = bytes(self.size)
+            return
+
+        start = max(adr, self.adr)
+        end = min(adr + size, self.adr + self.size)
+        if start < end:
+            self.known[start - self.adr:end - self.adr] = bytes(end - start)
+
+    def close(self):
+        pass
+
+
+class PersistentImage(MemoryImage):
+    u"""
+    Imagen de la región de memoria que se conserva entre las ejecuciones del
+    programa, en el archivo filename proyectado en memoria (mmap) con el
+    contenido (data) seguido de los indicadores de los bytes conocidos (known).
+    Si el archivo no existe o no corresponde a la región, se crea vacío.
+    """
+
+    def __init__(self, adr, size, filename):
+        MemoryImage.__init__(self, adr, size)
+
+        self.filename = filename
+
+        mode = 'r+b'
+        if (not os.path.isfile(filename)) or \
+                (os.path.getsize(filename) != 2*size):
+            mode = 'w+b'
+
+        with open(filename, mode) as f:
+            if mode == 'w+b':
+                f.write(bytes(2*size))
+                f.flush()
+            self.mm = mmap.mmap(f.fileno(), 2*size)
+
+        view = memoryview(self.mm)
+        self.data = view[:size]
+        self.known = view[size:]
+
+    @staticmethod
+    def path(*key):
+        u"""
+        Devuelve el nombre del archivo de la imagen identificada por los
+        elementos de key (i.e. modelo y número de serie), en el directorio
+        ~/.estapp (que se crea si no existe). Los caracteres no admitidos en
+        el nombre se reemplazan por su código (%XX), de manera que claves
+        diferentes no compartan el archivo. Levanta ValueError si algún
+        elemento esta vacío.
+        """
+        keys = [str(k).strip(' \x00') for k in key]
+        if not all(keys):
+            raise ValueError(u'La identificación de la imagen (%r) esta '
+                             u'incompleta.' % (key,))
+
+        folder = os.path.join(os.path.expanduser('~'), '.estapp')
+        os.makedirs(folder, exist_ok=True)
+
+        name = '_'.join(re.sub(r'[^0-9A-Za-z .-]',
+                               lambda m: '%%%02X' % ord(m.group()), k)
+                        for k in keys)
+        return os.path.join(folder, name + '.img')
+
+    def close(self):
+        if self.mm is None:
+            return
+
+        self.data.release()
+        self.known.release()
+        self.data = self.known = None
+
+        self.mm.flush()
+        self.mm.close()
+        self.mm = None
+
+
+class WriteStage(MemoryImage):
+    u"""
+    Sesión de escritura diferida sobre la región de memoria de size bytes
+    desde adr del dispositivo card. Se utiliza como un gestor de contexto :
+
+        with WriteStage(card, adr, size) :
+            ...
+
+    Mientras la sesión esta activa, las escrituras de los parámetros (Card-
+    Parameter) en la región se registran en la imagen, en lugar de enviarse
+    al dispositivo. Al terminar (sin excepciones) se escriben todos los bytes
+    modificados, agrupados por página, en una sola secuencia de ordenes SET
+    (OTCProtocol.batch()), opcionalmente (verify) se comprueba el contenido
+    escrito por medio de su lectura.
+
+    Si el bloque termina con una excepción las escrituras se descartan.
+    """
+
+    def __init__(self, card, adr, size, verify=False):
+        MemoryImage.__init__(self, adr, size)
+
+        self.card = card
+        self.verify = verify
+
+        self.dirty = bytearray(size)
+
+        # Parámetros cuyo valor memorizado proviene de una escritura diferida :
+        self.touched = set()
+
+        # Sesión que contiene a la actual (las sesiones anidadas se unen a la
+        # primera) :
+        self.outer = None
+
+    def write(self, adr, data, param=None):
+        u"""
+        Registra la escritura de data desde la dirección adr (del parámetro
+        param). Devuelve False si la escritura no pertenece a la región y
+        debe realizarse de inmediato.
+        """
+        if not self.contains(adr, len(data)):
+            return False
+
+        self.store(adr, data)
+        self.dirty[adr - self.adr:adr - self.adr + len(data)] = \
+            b'\x01'*len(data)
+
+        if param is not None:
+            self.touched.add(param)
+
+        return True
+
+    def fill(self, adr, data):
+        u"""
+        Registra data, leído del dispositivo desde la dirección adr, como el
+        contenido conocido de los bytes no modificados (los modificados conser-
+        van el valor a escribir). Devuelve data con el contenido de los bytes
+        modificados, i.e. el que tendrá el dispositivo al terminar la sesión.
+        """
+        data = bytearray(data)
+        start = max(adr, self.adr)
+        end = min(adr + len(data), self.adr + self.size)
+
+        for n in range(start - self.adr, end - self.adr):
+            if self.dirty[n]:
+                data[self.adr + n - adr] = self.data[n]
+            else:
+                self.data[n] = data[self.adr + n - adr]
+                self.known[n] = 1
+
+        return bytes(data)
+
+    def segments(self):
+        u"""
+        Devuelve la lista de las escrituras [(adr, data), ...] necesarias
+        para actualizar los bytes modificados, en cada página se escribe
+        desde el primer al último byte modificado, siempre que el contenido
+        de los bytes intermedios sea conocido.
+        """
+        segments = []
+        first = self.adr - (self.adr % PAGE_SIZE)
+        for page in range(first, self.adr + self.size, PAGE_SIZE):
+            start = max(page, self.adr) - self.adr
+            end = min(page + PAGE_SIZE, self.adr + self.size) - self.adr
+
+            seg_start = None
+            for n in range(start, end):
+                if self.dirty[n]:
+                    if seg_start is None:
+                        seg_start = n
+                    seg_end = n + 1
+
+                elif (seg_start is not None) and not self.known[n]:
+                    # El byte no es conocido, se cierra el segmento :
+                    segments.append((self.adr + seg_start,
+                                     bytes(self.data[seg_start:seg_end])))
+                    seg_start = None
+
+            if seg_start is not None:
+                segments.append((self.adr + seg_start,
+                                 bytes(self.data[seg_start:seg_end])))
+
+        return segments
+
+    def commit(self):
+        u"""
+        Escribe los bytes modificados en el dispositivo y opcionalmente
+        verifica el resultado.
+        """
+        segments = self.segments()
+        if not segments:
+            return
+
+        card = self.card
+        card.log.debug(u'Escritura diferida de %d bytes en %d ordenes.'
+                       % (sum(len(d) for _, d in segments), len(segments)))
+
+        try:
+            answers = card.dev.batch([('S', adr, data)
+                                      for adr, data in segments])
+
+            rejected = [adr for (adr, _), ans in zip(segments, answers)
+                        if not ans]
+            if rejected:
+                raise OTCProtocolError(u'El dispositivo rechazo la escritura '
+                                       u'en %s.' % ', '.join('0x%04X' % adr
+                                                             for adr in rejected))
+
+            if self.verify:
+                replies = card.dev.batch([('G', adr, len(data))
+                                          for adr, data in segments])
+                failed = [adr for (adr, data), rep in zip(segments, replies)
+                          if bytes(rep) != data]
+                if failed:
+                    raise OTCProtocolError(u'La verificación de la escritura '
+                                           u'fallo en %s.' % ', '.join('0x%04X' % adr
+                                                                      for adr in failed))
+
+        except OTCProtocolError as e:
+            # El contenido escrito en el dispositivo es incierto :
+            if card._image is not None:
+                for adr, data in segments:
+                    card._image.clear(adr, len(data))
+
+            self.discard()
+            raise OTCProtocolError(u'No se pudo completar la escritura '
+                                   u'diferida.', e, card)
+
+        # La imagen (persistente) del dispositivo se actualiza con lo escrito :
+        if card._image is not None:
+            for adr, data in segments:
+                card._image.store(adr, data)
+
+        del self.dirty[:]
+        self.dirty.extend(bytes(self.size))
+        self.touched.clear()
+
+    def discard(self):
+        u"""
+        Descarta las escrituras registradas, los valores memorizados de los
+        parámetros afectados se invalidan.
+        """
+        for param in self.touched:
+            param.value.pop(self.card, None)
+
+        del self.dirty[:]
+        self.dirty.extend(bytes(self.size))
+        self.touched.clear()
+
+    def __enter__(self):
+        self.outer = self.card._stage
+        if self.outer is None:
+            self.card._stage = self
+        return self.card._stage
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.outer is not None:
+            return False
+
+        self.card._stage = None
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+        return False
+
+
+class MemoryRegion(object):
+    u"""
+    Transferencia del contenido completo de la región de memoria de size bytes
+    desde adr del dispositivo card. Las lecturas se emiten en una sola
+    secuencia de ordenes GET (OTCProtocol.batch()), en bloques alineados con
+    las páginas cuyo tamaño depende del enlace (ver chunkSize()), y las
+    escrituras solo actualizan las páginas que difieren del contenido actual
+    del dispositivo.
+    """
+
+    # Tamaño de los bloques de lectura (múltiplo de PAGE_SIZE y menor que el
+    # tamaño máximo de una lectura, 255 bytes) :
+    chunk_size = 128
+
+    # Si la proporción de las lecturas repetidas o fallidas en el enlace (ver
+    # OTCProtocol.metrics) supera lossy_rate, se utilizan bloques de
+    # lossy_chunk_size bytes, cuya repetición es menos costosa :
+    lossy_rate = 0.05
+    lossy_chunk_size = 2*PAGE_SIZE
+
+    def __init__(self, card, adr, size):
+        self.card = card
+        self.adr = adr
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    @staticmethod
+    def crc(data):
+        u"""
+        Devuelve el CRC-32 del contenido data.
+        """
+        return zlib.crc32(data) & 0xFFFFFFFF
+
+    def chunkSize(self):
+        u"""
+        Devuelve el tamaño de los bloques de lectura según el enlace : con el
+        simulador de Proteus (throughput_limit) una página, si el enlace tiene
+        pérdidas lossy_chunk_size bytes y en otro caso chunk_size bytes.
+        """
+        dev = self.card.dev
+        if dev.throughput_limit:
+            return PAGE_SIZE
+
+        gets = dev.metrics.by_command['G']
+        if gets.commands and \
+                (gets.retries + gets.errors) > self.lossy_rate * gets.commands:
+            return self.lossy_chunk_size
+
+        return self.chunk_size
+
+    def chunks(self, size=None):
+        u"""
+        Devuelve la lista de las lecturas (adr, size) de la región en bloques
+        de hasta size bytes (por defecto chunkSize()) alineados con las
+        páginas.
+        """
+        if size is None:
+            size = self.chunkSize()
+
+        chunks = []
+        adr, end = self.adr, self.adr + self.size
+        while adr < end:
+            n = min(size - (adr % PAGE_SIZE), end - adr)
+            chunks.append((adr, n))
+            adr += n
+        return chunks
+
+    def read(self, into=None):
+        u"""
+        Lee el contenido de la región en into (bytearray o memoryview de size
+        bytes), o en una nueva instancia de bytearray, que se devuelve. El
+        contenido leído se registra en la imagen del dispositivo.
+        """
+        if into is None:
+            into = bytearray(self.size)
+        view = memoryview(into).cast('B')
+        if len(view) != self.size:
+            raise ValueError(u'La memoria de %d bytes no corresponde a la '
+                             u'región de %d bytes.' % (len(view), self.size))
+
+        card = self.card
+        chunks = self.chunks()
+        card.log.debug(u'Lectura de la región 0x%04X [0x%04X] en %d ordenes.',
+                       self.adr, self.size, len(chunks))
+
+        try:
+            replies = card.dev.batch([('G', adr, size) for adr, size in chunks])
+        except OTCProtocolError as e:
+            raise OTCProtocolError(u'Fallo la lectura de la región 0x%04X '
+                                   u'[0x%04X].' % (self.adr, self.size), e, card)
+
+        for (adr, size), data in zip(chunks, replies):
+            view[adr - self.adr:adr - self.adr + size] = data
+
+        if card._image is not None:
+            card._image.store(self.adr, view)
+
+        return into
+
+    def diff(self, current, data):
+        u"""
+        Devuelve la lista de las escrituras [(adr, data), ...] necesarias para
+        reemplazar el contenido current por data, en cada página que difiere
+        se escribe desde el primer al último byte diferente.
+        """
+        segments = []
+        for start in range(0, self.size, PAGE_SIZE):
+            end = min(start + PAGE_SIZE, self.size)
+            if current[start:end] == data[start:end]:
+                continue
+
+            changed = [n for n in range(start, end) if current[n] != data[n]]
+            segments.append((self.adr + changed[0],
+                             bytes(data[changed[0]:changed[-1] + 1])))
+
+        return segments
+
+    def write(self, data, verify=True, current=None, preserve=()):
+        u"""
+        Escribe el contenido data (size bytes) en la región, solo en las
+        páginas que difieren del contenido actual current (por defecto se lee
+        del dispositivo), en una sola secuencia de ordenes SET. Los bytes de
+        las regiones preserve [(adr, size), ...] conservan su contenido actual
+        (por ejemplo el número de serie, al copiar la configuración de otra
+        tarjeta).
+
+        Opcionalmente (verify) se lee nuevamente la región y se compara su CRC
+        con el de data. Devuelve el CRC del contenido escrito.
+        """
+        data = bytearray(memoryview(data).cast('B'))
+        if len(data) != self.size:
+            raise ValueError(u'El contenido de %d bytes no corresponde a la '
+                             u'región de %d bytes.' % (len(data), self.size))
+
+        card = self.card
+        if current is None:
+            current = self.read()
+
+        for adr, size in preserve:
+            start = max(adr, self.adr) - self.adr
+            end = min(adr + size, self.adr + self.size) - self.adr
+            if start < end:
+                data[start:end] = current[start:end]
+
+        segments = self.diff(current, data)
+        card.log.debug(u'Escritura de %d páginas de la región 0x%04X [0x%04X].',
+                       len(segments), self.adr, self.size)
+
+        try:
+            answers = card.dev.batch([('S', adr, seg) for adr, seg in segments])
+
+            rejected = [adr for (adr, _), ans in zip(segments, answers)
+                        if not ans]
+            if rejected:
+                raise OTCProtocolError(u'El dispositivo rechazo la escritura '
+                                       u'en %s.' % ', '.join('0x%04X' % adr
+                                                             for adr in rejected))
+
+        except OTCProtocolError as e:
+            # El contenido escrito en el dispositivo es incierto :
+            self.forget(segments)
+            raise OTCProtocolError(u'No se pudo escribir la región 0x%04X '
+                                   u'[0x%04X].' % (self.adr, self.size), e, card)
+
+        self.forget(segments)
+        if card._image is not None:
+            card._image.store(self.adr, data)
+
+        crc = self.crc(data)
+        if verify:
+            written = self.read()
+            if self.crc(written) != crc:
+                failed = [adr for adr, _ in self.diff(written, data)]
+                self.forget(segments)
+                raise OTCProtocolError(u'La verificación de la región 0x%04X '
+                                       u'fallo (CRC 0x%08X, esperado 0x%08X) en '
+                                       u'%s.' % (self.adr, self.crc(written), crc,
+                                                 ', '.join('0x%04X' % adr
+                                                           for adr in failed)),
+                                       None, card)
+
+        return crc
+
+    def forget(self, segments):
+        u"""
+        Invalida los valores memorizados de los parámetros (CardParameter) de
+        la tarjeta afectados por las escrituras segments, y su contenido en la
+        imagen del dispositivo.
+        """
+        card = self.card
+        for adr, data in segments:
+            if card._image is not None:
+                card._image.clear(adr, len(data))
+
+            for name, attr in type(card).parameters.names.items():
+                p = getattr(type(card), attr)
+                if (p.adr < adr + len(data)) and (adr < p.adr + p.size):
+                    p.value.pop(card, None)
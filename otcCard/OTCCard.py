@@ -18,9 +18,21 @@ __author__ = 'Oscar'
 
 from otcCard.ext_struct import ext_struct
 from weakref import WeakKeyDictionary
+import asyncio
+import collections
+import difflib
+import re
+import unicodedata
 from otcCard.OTCProtocol import *
 import logging
 
+# numpy es opcional, sin numpy las conversiones de ScaledParameter.naturals()
+# se aplican elemento a elemento :
+try :
+  import numpy
+except ImportError :
+  numpy = None
+
 # Direcciones de las cadenas de identificación del Modelo/Versión
 HARDWARE_MODEL_ADR     = 0x0000
 HARDWARE_VERSION_ADR   = 0x0012
@@ -37,6 +49,76 @@ SOFTWARE_REVISION_SIZE = 0x0012
 PRODUCTION_DATE_SIZE   = 0x0006
 
 
+def parameter_key(name) :
+  u'''
+  Devuelve la clave de búsqueda del nombre name : en minúsculas, sin acentos
+  y con las palabras separadas por un espacio (sin signos de puntuación).
+  '''
+  name = unicodedata.normalize('NFKD', str(name))
+  name = u''.join(c for c in name if not unicodedata.combining(c))
+  return u' '.join(re.findall(r'\w+', name.lower()))
+
+
+class ParameterIndex(object) :
+  u'''
+  Índice de los parámetros por su nombre 'natural' (e.g. 'Tap Activo'), que
+  asocia a cada nombre un valor (e.g. el nombre del atributo). La búsqueda
+  (find()) reconoce el nombre exacto, su clave (ver parameter_key()) o sus
+  alias, y suggest() devuelve los nombres aproximados.
+  '''
+  def __init__(self) :
+    self.names = collections.OrderedDict()
+    self.keys = {}
+
+  def add(self, name, value, *aliases) :
+    self.names[name] = value
+    for alias in (name,) + aliases :
+      self.keys[parameter_key(alias)] = name
+
+  def alias(self, alias, name) :
+    self.keys[parameter_key(alias)] = name
+
+  def find(self, name) :
+    u'''
+    Devuelve el nombre natural del parámetro name (nombre, clave o alias),
+    None si no se encuentra.
+    '''
+    if name in self.names :
+      return name
+    return self.keys.get(parameter_key(name))
+
+  def suggest(self, name, n = 3) :
+    u'''
+    Devuelve (hasta n) los nombres naturales aproximados a name.
+    '''
+    found = []
+    for key in difflib.get_close_matches(parameter_key(name), self.keys, n,
+                                                                          0.6) :
+      if self.keys[key] not in found :
+        found.append(self.keys[key])
+    return found
+
+  def __contains__(self, name) :
+    return self.find(name) is not None
+
+  def __getitem__(self, name) :
+    found = self.find(name)
+    if found is None :
+      raise KeyError(name)
+    return self.names[found]
+
+  def __iter__(self) :
+    return iter(self.names)
+
+  def __len__(self) :
+    return len(self.names)
+
+
+# Descripción de un parámetro (ver OTCCard.parameterList()) :
+ParameterInfo = collections.namedtuple('ParameterInfo',
+                                       'name attribute adr size typ')
+
+
 class OTCCard(object) :
   u'''
   Clase base para los dispositivos que utilizan el protocolo OTCProtocol,
@@ -50,6 +132,61 @@ class OTCCard(object) :
   (en el puerto dev) y la obtención de la identificación del hardware y
   software (nombre/kernel, versión y revisión).
   '''
+  # Sesión de escritura diferida activa (ver MemoryImage.WriteStage) :
+  _stage = None
+
+  # Imagen persistente de la memoria del dispositivo (ver PersistentImage) :
+  _image = None
+
+  # Sesión asíncrona (AsyncOTCProtocol) del dispositivo, utilizada por el
+  # acceso asíncrono a los parámetros (ver CardParameter.aget()) :
+  adev = None
+
+  # Alias de los nombres naturales de los parámetros, {alias : nombre} (ver
+  # parameters) :
+  parameterAliases = {}
+
+  # Índice de los parámetros (CardParameter) de la clase, por su nombre
+  # natural, con el nombre del atributo como valor. Se construye una vez por
+  # clase (ver __init_subclass__()) :
+  parameters = ParameterIndex()
+
+  def __init_subclass__(cls, **kwargs) :
+    super().__init_subclass__(**kwargs)
+
+    # Los parámetros de las subclases prevalecen sobre los heredados :
+    index = ParameterIndex()
+    for klass in reversed(cls.__mro__) :
+      for attr, p in vars(klass).items() :
+        if isinstance(p, CardParameter) :
+          index.add(p.name, attr, attr.lstrip('_'))
+
+    for klass in reversed(cls.__mro__) :
+      for alias, name in vars(klass).get('parameterAliases', {}).items() :
+        if name in index.names :
+          index.alias(alias, name)
+
+    cls.parameters = index
+
+  @classmethod
+  def parameterOf(cls, name) :
+    u'''
+    Devuelve el descriptor (CardParameter) del parámetro name (nombre natu-
+    ral, alias o nombre del atributo).
+    '''
+    return getattr(cls, cls.parameters[name])
+
+  @classmethod
+  def parameterList(cls) :
+    u'''
+    Devuelve la lista de los parámetros de la clase (ParameterInfo), orde-
+    nados por su dirección.
+    '''
+    return sorted([ParameterInfo(name, attr, getattr(cls, attr).adr,
+                                 getattr(cls, attr).size, getattr(cls, attr).typ)
+                   for name, attr in cls.parameters.names.items()],
+                  key = lambda p : (p.adr, p.name))
+
   def __init__(self, dev, log, ) :
     if not isinstance(dev, OTCProtocol) :
        raise ValueError(u'El primer argumento debe ser del tipo OTCProtocol.')
@@ -65,26 +202,31 @@ class OTCCard(object) :
 
       _hardware_model    = CardParameter(HARDWARE_MODEL_ADR   ,
                                '<' + str(HARDWARE_MODEL_SIZE)    + 's',
-                                         u'Modelo de Hardware'  ).__get__(self)
+                                         u'Modelo de Hardware'  )
       _hardware_version  = CardParameter(HARDWARE_VERSION_ADR ,
                                '<' + str(HARDWARE_VERSION_SIZE)  + 's',
-                                         u'Versión de Hardware' ).__get__(self)
+                                         u'Versión de Hardware' )
 
       _software_kernel   = CardParameter(SOFTWARE_KERNEL_ADR  ,
-                 '<' + str(SOFTWARE_KERNEL_SIZE)   + 's', u'Modelo de Software'  ).__get__(self)
+                 '<' + str(SOFTWARE_KERNEL_SIZE)   + 's', u'Modelo de Software'  )
       _software_release  = CardParameter(SOFTWARE_VERSION_ADR ,
-                 '<' + str(SOFTWARE_RELEASE_SIZE)  + 's', u'Versión del Software' ).__get__(self)
+                 '<' + str(SOFTWARE_RELEASE_SIZE)  + 's', u'Versión del Software' )
       _software_revision = CardParameter(SOFTWARE_REVISION_ADR,
-                 '<' + str(SOFTWARE_REVISION_SIZE) + 's', u'Revisión del Software').__get__(self)
+                 '<' + str(SOFTWARE_REVISION_SIZE) + 's', u'Revisión del Software')
 
       #_production_date = CardParameter(PRODUCTION_DATE_ADR  ,
       #          '<' + PRODUCTION_DATE_SIZE   *'s', u'Fecha de Producción' )
 
-      self._id = { u'hardware_model'    : _hardware_model    ,
-                   u'hardware_version'  : _hardware_version  ,
-                   u'software_kernel'   : _software_kernel   ,
-                   u'software_release'  : _software_release  ,
-                   u'software_revision' : _software_revision  }
+      # Las cadenas de identificación son contiguas y se leen en una sola
+      # orden :
+      ids = read_parameters(self, [_hardware_model, _hardware_version,
+                       _software_kernel, _software_release, _software_revision])
+
+      self._id = { u'hardware_model'    : ids[_hardware_model]    ,
+                   u'hardware_version'  : ids[_hardware_version]  ,
+                   u'software_kernel'   : ids[_software_kernel]   ,
+                   u'software_release'  : ids[_software_release]  ,
+                   u'software_revision' : ids[_software_revision]  }
 
     except OTCProtocolError as e:
       raise OTCProtocolError(u'No se pudo obtener la identificación '
@@ -103,6 +245,9 @@ class OTCCard(object) :
 
 
   def close(self) :
+    if self._image is not None :
+      self._image.close()
+      self._image = None
     self.dev.close()
 
 
@@ -181,9 +326,10 @@ class CardParameter(object) :
 
     self.fmt = fmt
 
-    # Se calcula el tamaño de la secuencia de bytes que representa el
-    # parámetro :
-    self.size = ext_struct.calcsize(fmt)
+    # Se compila el formato (una sola vez) y se obtiene el tamaño de la
+    # secuencia de bytes que representa el parámetro :
+    self.codec = ext_struct.compile(fmt)
+    self.size = self.codec.size
 
 
     if (typ == 'normal') or (typ == 'volatil') :
@@ -193,52 +339,98 @@ class CardParameter(object) :
                            u'es admisible para el argumento typ.' % str(typ))
 
 
-  def __get__(self, instance, owner = None) :
+  @staticmethod
+  def cardOf(instance) :
+    u"""
+    Devuelve la tarjeta (subclase de OTCCard) a la que accede un descriptor
+    desde instance, i.e. instance misma o su atributo card.
+    """
     # Se verifica que instance sea o que contenga un atributo denominado card,
     # sea una instancia de la clase OTCCard :
     if isinstance(instance, OTCCard) :
-      card = instance
+      return instance
     elif 'card' in instance.__dict__ :
-      card = instance.card
-    else :
-      instance.log.exception(u'RemoteParameter.__get__ : '
-             u'La instancia o su atributo card no es una subclase de OTCCard.')
-      raise ValueError('La instancia o su atributo card no es una '
-                                                        'subclase de OTCCard.')
+      return instance.card
 
-    # La lectura desde el dispositivo es incondicional si es volátil o su valor
-    # no se ha leído o escrito antes :
-    try :
-      if (self.typ != 'volatil') :
-        return self.value[card]
-    except :
-      pass
+    instance.log.exception(u'RemoteParameter.cardOf : '
+           u'La instancia o su atributo card no es una subclase de OTCCard.')
+    raise ValueError('La instancia o su atributo card no es una '
+                                                      'subclase de OTCCard.')
 
-    try :
-      card.log.debug (u"Lectura del parámetro '%s' [0x%04X / 0x%02X]"
-                                             %(self.name, self.adr, self.size))
 
-      # Lectura del la secuencia de bytes del valor del parámetro :
-      val = card.dev.getData(self.adr, self.size)
+  def isCached(self, card) :
+    u"""
+    Indica si el valor del parámetro en card puede obtenerse de la memoria
+    espejo (sin utilizar el interfaz de comunicación), la cual se completa
+    con la imagen persistente del dispositivo, si el parámetro es parte de
+    su contenido conocido.
+    """
+    if self.typ == 'volatil' :
+      return False
+
+    if card in self.value :
+      return True
+
+    image = card._image
+    if (image is not None) and image.isKnown(self.adr, self.size) :
+      card.log.debug(u"Parámetro '%s' recuperado de la imagen.", self.name)
+      self.decode(card, image.load(self.adr, self.size))
+      return True
+
+    return False
+
 
-      # Para normalizar la identificación de los componentes del parámetro se
-      # convierte en una cadena de caracteres ...
-      #val = "".join(map(chr, val))
-      card.log.debug (u"Valor del parámetro : <%s>" %repr(val))
+  def decode(self, card, val) :
+    u"""
+    Decodifica la secuencia de bytes val, leída del dispositivo card, y
+    memoriza el valor resultante.
+    """
+    if card.log.isEnabledFor(logging.DEBUG) :
+      card.log.debug (u"Valor del parámetro : <%s>", repr(bytes(val)))
+
+    if (card._image is not None) and (self.typ != 'volatil') :
+      card._image.store(self.adr, bytes(val))
+
+    # Durante una escritura diferida se registra el contenido leído, en razón
+    # de completar los segmentos a escribir, sin reemplazar los bytes ya
+    # modificados (el valor resultante los incluye) :
+    if card._stage is not None :
+      val = card._stage.fill(self.adr, bytes(val))
 
-      # Se decodifica el paquete de datos :
-      val = ext_struct.unpack(self.fmt, val)
+    # Se decodifica el paquete de datos :
+    val = self.codec.unpack(val)
 
-      # Por convención (y facilidad de uso) si el parámetro solo contiene un
-      # solo elemento, se trabaja como una instancia simple, sino como una
-      # tupla :
-      if len(val) == 1 : val = val[0]
+    # Por convención (y facilidad de uso) si el parámetro solo contiene un
+    # solo elemento, se trabaja como una instancia simple, sino como una
+    # tupla :
+    if len(val) == 1 : val = val[0]
 
-      # Se memoriza el último valor del parámetro (En razón de evitar el
-      # uso del interfaz ante sub-siguientes operaciones de lectura) :
-      self.value[card] = val
+    # Se memoriza el último valor del parámetro (En razón de evitar el
+    # uso del interfaz ante sub-siguientes operaciones de lectura) :
+    self.value[card] = val
 
-      return val
+    return val
+
+
+  def __get__(self, instance, owner = None) :
+    # Acceso desde la clase, se devuelve el descriptor :
+    if instance is None :
+      return self
+
+    card = CardParameter.cardOf(instance)
+
+    # La lectura desde el dispositivo es incondicional si es volátil o su valor
+    # no se ha leído o escrito antes :
+    if self.isCached(card) :
+      return self.value[card]
+
+    try :
+      card.log.debug (u"Lectura del parámetro '%s' [0x%04X / 0x%02X]",
+                                             self.name, self.adr, self.size)
+
+      # Lectura del la secuencia de bytes del valor del parámetro y su
+      # decodificación :
+      return self.decode(card, card.dev.getData(self.adr, self.size))
 
     except OTCProtocolError as e:
       self.value[card] = None
@@ -251,21 +443,38 @@ class CardParameter(object) :
 
 
   def __set__(self, instance, *val) :
-    # Se verifica que instance sea o que contenga un atributo denominado card,
-    # sea una instancia de la clase OTCCard :
-    if isinstance(instance, OTCCard) :
-      card = instance
-    elif 'card' in instance.__dict__ :
-      card = instance.card
-    else :
-      instance.log.exception(u'RemoteParameter.__set__ : '
-             u'La instancia o su atributo card no es una subclase de OTCCard.')
-      raise ValueError('La instancia o su atributo card no es una '
-                                                        'subclase de OTCCard.')
+    card = CardParameter.cardOf(instance)
+
+    card.log.debug (u"Escritura del parámetro '%s' [0x%04X / 0x%02X}",
+                                            self.name, self.adr, self.size)
+
+    try :
+      val_str = self.encode(card, val)
+
+      # Se actualiza el valor del parámetro en el dispositivo remoto,
+      # en segmentos limitados  en las frontera de 16 bytes :
+      for substr_adr, substr in self.segments(val_str) :
+        card.dev.setData(substr_adr, substr)
+
+      self.written(card, val_str)
+      return
+
+    except OTCProtocolError as e:
+      self.failed(card)
+      raise OTCProtocolError(u'No se pudo modificar "%s".'%self.name, e, card)
+
+    except Exception as e:
+      card.log.exception(u'RemoteParameter.__set__ : '
+                u'Fallo inesperado al modificar el parámetro : %s.'% self.name)
+      raise e
 
-    card.log.debug (u"Escritura del parámetro '%s' [0x%04X / 0x%02X}" %
-                                            (self.name, self.adr, self.size))
 
+  def encode(self, card, val) :
+    u"""
+    Codifica el valor val (argumentos de __set__()) del parámetro en card,
+    y lo memoriza. Devuelve la secuencia de bytes a escribir en el disposi-
+    tivo, vacía si la escritura se registró en la escritura diferida.
+    """
     # En general el argumento que contienen el valor del parámetro es una
     # tupla/lista o diccionario de sus elementos, no obstante por flexi-
     # bilidad cuando el parámetro en si consta de un solo elemento (i.e.
@@ -281,42 +490,107 @@ class CardParameter(object) :
     else :
       val = (val,)
 
+    # Se codifica val en una cadena de caracteres :
+    val_str = self.codec.pack(*val)
+
+    # Se memoriza el último valor del parámetro (En razón de evitar el uso
+    # del interfaz ante sub-siguientes operaciones de lectura) y en razón que
+    # los números en punto flotante son afectados por el redondeo se prefiere
+    # reconstruir los valores desde la cadena de bytes :
+    self.value[card] = self.codec.unpack(val_str)
+    if len(self.value[card]) == 1 :
+      self.value[card] = self.value[card][0]
+
+    # Durante una escritura diferida, la escritura solo se registra (si
+    # pertenece a la región de la sesión) :
+    if (card._stage is not None) and card._stage.write(self.adr, val_str,
+                                                                     self) :
+      val_str = b''
+
+    return val_str
+
+
+  def segments(self, val_str) :
+    u"""
+    Devuelve los segmentos (adr, bytes) de la escritura de val_str, limita-
+    dos en las fronteras de 16 bytes.
+    """
+    substr_adr = self.adr
+    while len(val_str) > 0 :
+      substr_len = 16 - (substr_adr & 0x0F)
+      yield (substr_adr, val_str[0: substr_len])
+      substr_adr += substr_len
+      val_str = val_str[substr_len:]
+
+
+  def written(self, card, val_str) :
+    u"""
+    Registra la escritura exitosa de val_str en card.
+    """
+    # Se actualiza la imagen persistente del dispositivo :
+    if (card._image is not None) and val_str and (self.typ != 'volatil') :
+      card._image.store(self.adr, val_str)
+
+    card.log.debug (u"Escritura del parámetro '%s' exitosa.", self.name)
+
+
+  def failed(self, card) :
+    u"""
+    Registra el fallo de la escritura en card.
+    """
+    self.value.pop(card, None)
+
+    # El contenido del dispositivo es incierto :
+    if card._image is not None :
+      card._image.clear(self.adr, self.size)
+
+
+  # Acceso asíncrono, por medio de la sesión card.adev (AsyncOTCProtocol) :
+
+  async def aget(self, instance) :
+    u"""
+    Versión asíncrona de la lectura del parámetro (__get__()).
+    """
+    card = CardParameter.cardOf(instance)
+
+    if self.isCached(card) :
+      return self.value[card]
+
     try :
-      # Se codifica val en una cadena de caracteres :
-      val_str = ext_struct.pack(self.fmt, *val)
+      card.log.debug (u"Lectura del parámetro '%s' [0x%04X / 0x%02X]",
+                                             self.name, self.adr, self.size)
+      return self.decode(card, await card.adev.get_data(self.adr, self.size))
 
-      # Se memoriza el último valor del parámetro (En razón de evitar el uso
-      # del interfaz ante sub-siguientes operaciones de lectura) y en razón que
-      # los números en punto flotante son afectados por el redondeo se prefiere
-      # reconstruir los valores desde la cadena de bytes :
-      self.value[card] = ext_struct.unpack(self.fmt, val_str)
-      if len(self.value[card]) == 1 :
-        self.value[card] = self.value[card][0]
+    except OTCProtocolError as e:
+      self.value[card] = None
+      raise OTCProtocolError( u'Fallo la lectura de "%s".' %self.name, e, card)
 
-      # Se actualiza el valor del parámetro en el dispositivo remoto,
-      # en segmentos limitados  en las frontera de 16 bytes :
-      substr_adr = self.adr
-      while len(val_str) > 0 :
-        substr_len = 16 - (substr_adr & 0x0F)
-        card.dev.setData(substr_adr, val_str[0: substr_len])
-        substr_adr += substr_len
-        val_str = val_str[substr_len:]
-
-      # En este punto self.value es una tupla, tipo que es inconveniente cuando
-      # solo existe un solo valor, y se requiere manipularlo directamente :
-      if len(val) == 1 : val = val[0]
-
-      card.log.debug (u"Escritura del parámetro '%s' exitosa." %self.name)
-      return
+
+  async def aset(self, instance, *val) :
+    u"""
+    Versión asíncrona de la escritura del parámetro (__set__()), los seg-
+    mentos de la escritura se envían encadenados.
+    """
+    card = CardParameter.cardOf(instance)
+
+    card.log.debug (u"Escritura del parámetro '%s' [0x%04X / 0x%02X}",
+                                            self.name, self.adr, self.size)
+
+    try :
+      val_str = self.encode(card, val)
+      results = await asyncio.gather(*[card.adev.set_data(substr_adr, substr)
+                          for substr_adr, substr in self.segments(val_str)],
+                                     return_exceptions = True)
+      for r in results :
+        if isinstance(r, Exception) :
+          raise r
+
+      self.written(card, val_str)
 
     except OTCProtocolError as e:
-      del self.value[card]
+      self.failed(card)
       raise OTCProtocolError(u'No se pudo modificar "%s".'%self.name, e, card)
 
-    except Exception as e:
-      card.log.exception(u'RemoteParameter.__set__ : '
-                u'Fallo inesperado al modificar el parámetro : %s.'% self.name)
-      raise e
 
   def __len__(self) :
     """
@@ -325,6 +599,109 @@ class CardParameter(object) :
     return self.size
 
 
+# Tamaño máximo de una lectura (el protocolo lo codifica en un byte) :
+MAX_READ_SIZE = 0xFF
+
+# Número máximo de bytes (sin interés) entre dos parámetros para que se lean
+# en una misma orden, es mas eficiente leerlos que emitir una nueva orden :
+READ_GAP = 8
+
+
+def plan_reads(params, max_size = MAX_READ_SIZE, gap = READ_GAP) :
+  u"""
+  Agrupa los parámetros params (instancias de CardParameter) en el menor
+  número de lecturas de hasta max_size bytes, uniendo los parámetros cuyas
+  direcciones se superponen o están separadas hasta gap bytes.
+  Devuelve la lista de las lecturas como tuplas (adr, size, parámetros).
+  """
+  plan = []
+  for p in sorted(set(params), key = lambda p : (p.adr, p.size)) :
+    if plan :
+      adr, size, group = plan[-1]
+      end = max(adr + size, p.adr + p.size)
+      if (p.adr <= adr + size + gap) and (end - adr <= max_size) :
+        plan[-1] = (adr, end - adr, group + [p])
+        continue
+
+    plan.append((p.adr, p.size, [p]))
+
+  return plan
+
+
+def read_parameters(instance, params, refresh = False) :
+  u"""
+  Lee los parámetros params (instancias de CardParameter) del dispositivo al
+  que se accede desde instance, con el menor número de ordenes GET (ver
+  plan_reads()) emitidas en una sola secuencia (OTCProtocol.batch()).
+  Los valores se memorizan como si se hubiesen leído individualmente, y se
+  devuelven en un diccionario indexado por el parámetro. Salvo que refresh
+  sea verdadero, los parámetros memorizados (no volátiles) no se leen.
+  """
+  card = CardParameter.cardOf(instance)
+
+  values = dict()
+  to_read = []
+  for p in params :
+    if not refresh and p.isCached(card) :
+      values[p] = p.value[card]
+    else :
+      to_read.append(p)
+
+  if not to_read :
+    return values
+
+  plan = plan_reads(to_read)
+  card.log.debug(u'Lectura de %d parámetros en %d ordenes.',
+                                                    len(to_read), len(plan))
+
+  try :
+    replies = card.dev.batch([('G', adr, size) for adr, size, _ in plan])
+
+  except OTCProtocolError as e :
+    raise OTCProtocolError(u'Fallo la lectura de %s.' %
+            ', '.join('"%s"' %p.name for p in to_read), e, card)
+
+  for (adr, size, group), data in zip(plan, replies) :
+    for p in group :
+      values[p] = p.decode(card, data[p.adr - adr : p.adr - adr + p.size])
+
+  return values
+
+
+async def aread_parameters(instance, params, refresh = False) :
+  u"""
+  Versión asíncrona de read_parameters(), las lecturas se encadenan por medio
+  de la sesión asíncrona del dispositivo (card.adev).
+  """
+  card = CardParameter.cardOf(instance)
+
+  values = dict()
+  to_read = []
+  for p in params :
+    if not refresh and p.isCached(card) :
+      values[p] = p.value[card]
+    else :
+      to_read.append(p)
+
+  if not to_read :
+    return values
+
+  plan = plan_reads(to_read)
+
+  try :
+    replies = await card.adev.batch([('G', adr, size) for adr, size, _ in plan])
+
+  except OTCProtocolError as e :
+    raise OTCProtocolError(u'Fallo la lectura de %s.' %
+            ', '.join('"%s"' %p.name for p in to_read), e, card)
+
+  for (adr, size, group), data in zip(plan, replies) :
+    for p in group :
+      values[p] = p.decode(card, data[p.adr - adr : p.adr - adr + p.size])
+
+  return values
+
+
 class CardParameterList(list) :
   '''
   Encapsula una lista de parámetros del tipo CardParameter contiguos.
@@ -417,6 +794,28 @@ class ScaledParameter(object) :
       self.fmt = lambda x : fmt %(x, x.internal)
 
 
+  def toNatural(self, value) :
+    return self.__funs[0](value)
+
+  def toInternal(self, value) :
+    return self.__funs[1](value)
+
+  def naturals(self, values) :
+    u'''
+    Devuelve los valores naturales de la secuencia de valores internos values,
+    en una sola operación (numpy.ndarray) si numpy esta disponible y la fun-
+    ción de conversión lo admite, sino como una lista.
+    '''
+    return _convert(self.__funs[0], values)
+
+  def internals(self, values) :
+    u'''
+    Devuelve los valores internos de la secuencia de valores naturales values
+    (ver naturals()).
+    '''
+    return _convert(self.__funs[1], values)
+
+
   def __set__(self, instance, value):
     value = self.__funs[1](value)
 
@@ -432,31 +831,55 @@ class ScaledParameter(object) :
 
 
   def __get__(self, instance, owner):
-    card_parameter = self.card_parameter
-    remote_value = card_parameter.__get__(instance, owner)
-    funs = self.__funs
+    if instance is None :
+      return self
+    return ScaledValue(self, self.card_parameter.__get__(instance, owner),
+                                                                     instance)
+
+
+class ScaledValue(float) :
+  u'''
+  Valor de ScaledParameter : su valor natural (float), con el valor interno
+  (internal), el descriptor (parameter) y la instancia (tarjeta) de la que
+  se leyó. La clase es única (con __slots__), no se define en cada lectura.
+  '''
+  __slots__ = ('parameter', 'internal_value', 'instance')
 
-    class __FloatParameter(float) :
-      def __new__(cls, internal_value) :
-        return float.__new__(cls, funs[0](internal_value))
+  def __new__(cls, parameter, internal_value, instance = None) :
+    this = float.__new__(cls, parameter.toNatural(internal_value))
+    this.parameter = parameter
+    this.internal_value = internal_value
+    this.instance = instance
+    return this
 
-      def __init__(this, internal_value) :
-        this.internal_value = internal_value
+  @property
+  def internal(self):
+    return self.internal_value
 
-      @property
-      def internal(this):
-        return this.internal_value
+  @internal.setter
+  def internal(self, value):
+    limits = self.parameter.limits
+    if (value < limits[0]) or (value > limits[1]) :
+      raise ValueError('Valor interno (%d) fuera de rango .' % value)
+    self.parameter.card_parameter.__set__(self.instance, value)
 
-      @internal.setter
-      def internal(this, value):
-        if (value < self.limits[0]) or (value > self.limits[1]) :
-          raise ValueError('Valor interno (%d) fuera de rango .' % value)
-        card_parameter.__set__(instance, value)
+  def ScaledBy(self, factor) :
+    p = self.parameter
+    return ScaledValue(p, p.toInternal(p.toNatural(self.internal) * factor),
+                                                                  self.instance)
 
-      def ScaledBy(this, factor) :
-        return this.__class__(funs[1](funs[0](this.internal)*factor))
+  def __str__(self):
+    return self.parameter.fmt(self)
 
-      def __str__(this):
-        return self.fmt(this)
 
-    return __FloatParameter(remote_value)
+def _convert(fun, values) :
+  u'''
+  Aplica la función de conversión fun a la secuencia values, en una sola
+  operación con numpy (si esta disponible y fun lo admite).
+  '''
+  if numpy is not None :
+    try :
+      return fun(numpy.asarray(values, dtype = float))
+    except (TypeError, ValueError) :
+      pass
+  return [fun(v) for v in values]
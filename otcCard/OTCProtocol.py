@@ -1,14 +1,18 @@
 ﻿#!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import re
 import struct
 import sys
 import threading
-from time import sleep
+import collections
+import logging
+from time import sleep, perf_counter
 
 from .OTCProtocolError import OTCProtocolError
+from . import metrics as _metrics
 import otcCard.SerialDevice as SerialDevice
-from common.report import report
+from common.report import report, WIRE_TX, WIRE_RX
 import serial
 
 # Caracteres Especiales :
@@ -24,6 +28,20 @@ SpecialChar = [ESCAPE_CHAR, EXIT_CHAR, GET_CHAR, SET_CHAR, ACK_CHAR, NACK_CHAR]
 EncodedChar = [ESCAPE_CHAR, EXIT_CHAR, GET_CHAR, SET_CHAR]
 DecodedChar = [ESCAPE_CHAR, ACK_CHAR, NACK_CHAR]
 
+# Modos de transmisión de las ordenes :
+#   XMIT_BURST : La orden completa se emite en una sola escritura, el espacia-
+#                miento entre caracteres lo impone la UART según los bits de
+#                parada configurados en el puerto.
+#   XMIT_BYTE  : Cada byte se emite por separado seguido de una pausa equiva-
+#                lente a los bits de parada (para adaptadores que no los honran).
+XMIT_BURST = 'burst'
+XMIT_BYTE = 'byte'
+
+# Expresión para localizar el byte de respuesta (ACK/NACK) que termina una
+# respuesta, nótese que ambos siempre se transmiten como secuencias de escape
+# dentro de los datos :
+_TERMINATOR = re.compile(b'[' + re.escape(ACK_CHAR + NACK_CHAR) + b']')
+
 # TODO Remover
 # Direcciones de las cadenas de identificación del Modelo/Versión
 HARDWARE_MODEL_ADR = 0x0000
@@ -44,6 +62,58 @@ PRODUCTION_DATE_SIZE = 0x0006
 def com_list(): return SerialDevice.com_list()
 
 
+def encode_data(data_bytes):
+    u"""
+    Substituye los caracteres especiales de data_bytes por sus secuencias de
+    escape.
+    """
+    for ch in EncodedChar:
+        data_bytes = data_bytes.replace(ch,
+                                        ESCAPE_CHAR + bytes([0x1B ^ ord(ch) ^ 0x55]))
+    return data_bytes
+
+
+def decode_data(data_bytes):
+    u"""
+    Reemplaza las secuencias de escape de data_bytes por los bytes que
+    representan, en una sola pasada, y devuelve el resultado (bytearray).
+    Levanta ValueError si encuentra una secuencia de escape desconocida.
+    """
+    if ESCAPE_CHAR not in data_bytes:
+        return bytearray(data_bytes)
+
+    # Cada segmento (excepto el primero) se inicia con el segundo byte de
+    # una secuencia de escape :
+    segments = bytes(data_bytes).split(ESCAPE_CHAR)
+    data = bytearray(segments[0])
+    for segment in segments[1:]:
+        byte = (segment[0] ^ ESCAPE_CHAR[0] ^ 0x55) if segment else 0x55
+
+        if not (bytes([byte]) in DecodedChar):
+            raise ValueError(u'Secuencia de escape desconocida '
+                             u'ESC (0x1B) / 0x%02X' % byte)
+
+        data.append(byte)
+        data += segment[1:]
+
+    return data
+
+
+def encode_get(adr, size):
+    u"""
+    Devuelve la orden GET (codificada) para leer size bytes desde adr.
+    """
+    return GET_CHAR + encode_data(struct.pack('<HB', adr, size))
+
+
+def encode_set(adr, data_bytes):
+    u"""
+    Devuelve la orden SET (codificada) para escribir data_bytes desde adr.
+    """
+    return SET_CHAR + encode_data(struct.pack('<HB', adr, len(data_bytes)) +
+                                  data_bytes)
+
+
 class OTCProtocolErrorX(Exception):
     def __init__(self, msg, cause=None, obj=None):
         self.msg = msg
@@ -130,9 +200,26 @@ class OTCProtocol:
 
     """
 
-    def __init__(self, comm_name, throughput_limit=False):
+    # Modo de transmisión utilizado cuando no se especifica al crear la
+    # instancia :
+    default_xmit_mode = XMIT_BURST
+
+    # Número máximo de ordenes pendientes de respuesta en batch() :
+    batch_window = 4
+
+    # El reporte (nivel DEBUG) de los bytes transmitidos y recibidos es
+    # opcional, pues su costo distorsiona los tiempos de la comunicación, con
+    # el registro binario (report.wire, ver SerialDevice) se omite :
+    log_bytes = False
+
+    def __init__(self, comm_name, throughput_limit=False, xmit_mode=None,
+                 device=None):
         u"""
         Toma control del puerto serie comm_name y lo prepara para la comunicación.
+        El argumento xmit_mode selecciona el modo de transmisión de las ordenes
+        (XMIT_BURST o XMIT_BYTE), por defecto default_xmit_mode. El argumento
+        device reemplaza al puerto serie por otro dispositivo con la misma API
+        (por ejemplo ReplayDevice).
         """
 
         # Cuando comm_name es None, solo después de abrir el puerto (caso de
@@ -152,9 +239,16 @@ class OTCProtocol:
         # para definir si se limita o no el volumen de datos :
         self.throughput_limit = throughput_limit
 
+        if xmit_mode is None:
+            xmit_mode = OTCProtocol.default_xmit_mode
+        if xmit_mode not in [XMIT_BURST, XMIT_BYTE]:
+            raise ValueError(u'El modo de transmisión "%s" no es válido.'
+                             % xmit_mode)
+        self.xmit_mode = xmit_mode
+
         with self._lock:
             # Puerto serie utilizado para la comunicación :
-            self.__comm = SerialDevice()
+            self.__comm = SerialDevice() if device is None else device
 
             # Se definen los parámetros de operación del puerto serie :
             self.__comm.port = comm_name
@@ -182,6 +276,44 @@ class OTCProtocol:
 
         self._cnt_bytes = 0
 
+        # Memoria de contención de los bytes recibidos y aún no procesados, y
+        # la hora de recepción de cada lectura (con el total de bytes recibidos
+        # al concluirla) para atribuirla a las respuestas que contiene :
+        self.__rx = bytearray()
+        self.__arrivals = collections.deque()
+
+        # Indica si se perdió la sincronización con las respuestas del
+        # dispositivo (ver batch()) :
+        self.__lost = False
+
+        # Métricas de la comunicación (ver el módulo metrics), con la hora de
+        # recepción del primer byte de la respuesta en curso, el número de
+        # bytes (en la línea) de la última respuesta y su byte final :
+        self.metrics = _metrics.metrics(self.__comm.port)
+        self.__first = None
+        self.__rxBytes = 0
+        self.__ans = None
+
+    def __trace(self, direction, data):
+        u"""
+        Registra en el reporte (si log_bytes) los bytes data transmitidos o
+        recibidos (direction WIRE_TX o WIRE_RX), salvo que se registren en
+        el registro binario (report.wire) del puerto serie.
+        """
+        if report.wire is None and self.log_bytes and self.log.isEnabledFor(logging.DEBUG):
+            if direction == WIRE_TX:
+                self.log.debug(u'Trasmitiendo : 0x%s', data.hex().upper())
+            else:
+                self.log.debug(u'Se recibió [%d] : 0x%s', len(data),
+                               data.hex().upper())
+
+    def __stopTime(self):
+        u"""
+        Devuelve la duración de los bits de parada de un caracter, según la
+        configuración del puerto serie.
+        """
+        return self.__comm.stopbits / self.__comm.baudrate
+
     def __xmit(self, data):
         u"""
         Transmite 'data'. Si no puede hacerlo dentro del límite de tiempo
@@ -189,15 +321,22 @@ class OTCProtocol:
         excepción (del tipo OTCProtocolError).
         """
         try:
-            self.log.debug(u'Trasmitiendo : 0x%s' % data.hex().upper())
-
-            # Se debería emitir simplemente 'self.__comm.write(data) ', pero PySerial no honra
-            # los bits de parada, luego tiene que trasmitirse cada byte despues de su correspondiente
-            # tiempo de espera :
-            for d in data:
-                self.__comm.write(bytes([d]))
-                sleep(2/self.__comm.baudrate)
-                self.log.debug(u'Trasmitiendo : {!r} {!r}'.format(d, type(d)))
+            self.__trace(WIRE_TX, data)
+
+            if self.xmit_mode == XMIT_BURST:
+                # La UART inserta los bits de parada configurados en el puerto
+                # (STOPBITS_TWO) entre caracteres, por lo que la orden completa
+                # se emite en una sola escritura :
+                self.__comm.write(data)
+
+            else:
+                # Algunos adaptadores no honran los bits de parada, luego tiene
+                # que trasmitirse cada byte despues de su correspondiente tiempo
+                # de espera :
+                stop_time = self.__stopTime()
+                for d in data:
+                    self.__comm.write(bytes([d]))
+                    sleep(stop_time)
 
             self.__comm.flush()
 
@@ -207,22 +346,72 @@ class OTCProtocol:
         except OTCProtocolError as e:
             raise OTCProtocolError(u'Fallo de Transmisión (timeout).', e, self)
 
-    def __rcve(self):
+    def __flushInput(self):
+        u"""
+        Descarta los bytes recibidos pendientes de procesar.
         """
-        Espera por la recepción de 1 byte desde el dispositivo.
+        self.__comm.flushInput()
+        del self.__rx[:]
+        self.__arrivals.clear()
+
+    def __receive(self):
+        u"""
+        Agrega a la memoria de contención de recepción todo lo que el puerto
+        tenga disponible (al menos 1 byte) en una sola lectura, que solo espera
+        si no hay bytes pendientes (i.e. no espera por el resto de la respuesta,
+        que puede ser más corta que la esperada, e.g. NACK_CHAR).
+        Levanta una excepción si el dispositivo no responde (timeout).
         """
-        from time import sleep
-        self.log.debug('Recibiendo (1 byte) ...')
-        byte = self.__comm.read(1)
-        self._cnt_bytes += 1
+        chunk = self.__comm.read(max(1, self.__comm.inWaiting()))
 
-        if (byte == b'') or (byte is None):
+        if (chunk == b'') or (chunk is None):
+            self.__lost = True
             raise OTCProtocolError(u'El dispositivo no responde (timeout).',
                                    None, self)
 
-        self.log.debug(u'Se recibió [%d] : 0x%s,' %
-                       (self._cnt_bytes, byte.hex().upper()))
-        self.log.debug(u'Queued : %d' % (self.__comm.inWaiting()))
+        arrival = perf_counter()
+        if self.__first is None:
+            self.__first = arrival
+        self.__trace(WIRE_RX, chunk)
+
+        self._cnt_bytes += len(chunk)
+        self.__rx += chunk
+        self.__arrivals.append((self._cnt_bytes, arrival))
+
+    def __startReply(self):
+        u"""
+        Se inicia la recepción de una respuesta (ver __measure()). Si su primer
+        byte ya fue recibido (e.g. en batch()), se le atribuye la hora de la
+        lectura que lo contiene.
+        """
+        position = self._cnt_bytes - len(self.__rx)
+        while self.__arrivals and (self.__arrivals[0][0] <= position):
+            self.__arrivals.popleft()
+        self.__first = self.__arrivals[0][1] if self.__rx else None
+        self.__rxBytes = 0
+        self.__ans = None
+
+    def __measure(self, cmd, adr, size, frame, start, retries=0, error=False):
+        u"""
+        Registra en las métricas la orden cmd (de la trama frame, transmitida
+        desde start) y su respuesta.
+        """
+        first = None if self.__first is None else max(0.0, self.__first - start)
+        self.metrics.command(cmd, adr, size, len(frame), self.__rxBytes, first,
+                             perf_counter() - start, retries,
+                             self.__ans == NACK_CHAR, error)
+
+    def __rcve(self):
+        """
+        Espera por la recepción de 1 byte desde el dispositivo.
+        """
+        if not self.__rx:
+            self.__receive()
+
+        byte = bytes(self.__rx[:1])
+        del self.__rx[:1]
+        self.__rxBytes += 1
+        self.__ans = byte
         return byte
 
     def __RcveAns(self):
@@ -233,7 +422,8 @@ class OTCProtocol:
         identificada.
         """
         try:
-            self.log.debug(u'Recibiendo la respuesta (ACK/NACK) ...')
+            if self.log_bytes:
+                self.log.debug(u'Recibiendo la respuesta (ACK/NACK) ...')
             ans = self.__rcve()
         except OTCProtocolError as e:
             raise OTCProtocolError(u'El dispositivo no envió '
@@ -243,7 +433,8 @@ class OTCProtocol:
             self.log.debug(u'Respuesta de Rechazo (NACK).')
             return False
         elif ans == ACK_CHAR:
-            self.log.debug(u'Respuesta de aceptación (ACK).')
+            if self.log_bytes:
+                self.log.debug(u'Respuesta de aceptación (ACK).')
             return True
 
         raise OTCProtocolError(u'El dispositivo envió una '
@@ -251,62 +442,118 @@ class OTCProtocol:
 
     def __RcveData(self, size):
         u"""
-        Recibe size bytes de datos y los devuelve. La secuencia de datos pueden
-        incluir secuencias de escape (caso en el cual solo se considera en la
-        cuenta como un dato, aún cuando su transmisión implica 2 bytes), la
-        secuencia de bytes que representan los datos debe terminar con un byte
-        de respuesta. Este último debe ser ACK_CHAR si se transmitieron los size
-        datos o NACK si la transmisión es parcial o nula.
+        Recibe size bytes de datos y los devuelve (como un memoryview). La secu-
+        encia de datos pueden incluir secuencias de escape (caso en el cual solo
+        se considera en la cuenta como un dato, aún cuando su transmisión impli-
+        ca 2 bytes), la secuencia de bytes que representan los datos debe termi-
+        nar con un byte de respuesta. Este último debe ser ACK_CHAR si se trans-
+        mitieron los size datos o NACK si la transmisión es parcial o nula.
         Levanta una excepción si el dispositivo devuelve NACK_CHAR, o si la
         transmisión es parcial o nula (timeout) o se recibe una secuencia de
         escape inválida.
         """
         try:
-            self.log.debug(u'Esperando la recepción de %d (data) bytes' % size)
-            data = b''
-            for i in range(0, size):
-                byte = self.__rcve()
-
-                if byte == ESCAPE_CHAR:
-                    byte = (self.__rcve()[0] ^ ESCAPE_CHAR[0]
-                            ^ 0x55).to_bytes(1, 'little')
-
-                    if not (byte in DecodedChar):
-                        self.log.debug(u'Secuencia de escape desconocida '
-                                       u'ESC (0x1B) / 0x%02X' % ord(byte))
-                        raise OTCProtocolError(u'Se recibio una secuencia '
-                                               u'de escape desconocida', None, self)
-                    self.log.debug(u'Secuencia de escape identificada '
-                                   u'para : 0x%02X' % ord(byte))
-
-                elif byte == ACK_CHAR:
+            if self.log_bytes:
+                self.log.debug(u'Esperando la recepción de %d (data) bytes',
+                               size)
+
+            # Se acumulan los bytes recibidos hasta identificar el byte de
+            # respuesta (solo se busca en los bytes nuevos) :
+            start = 0
+            while True:
+                end = _TERMINATOR.search(self.__rx, start)
+                if end is not None:
+                    break
+                start = len(self.__rx)
+                self.__receive()
+
+            # Se retira la respuesta de la memoria de contención (aún si no es
+            # válida) antes de decodificarla :
+            end = end.start()
+            ans = bytes(self.__rx[end:end + 1])
+            frame = bytes(self.__rx[:end])
+            del self.__rx[:end + 1]
+            self.__rxBytes += end + 1
+            self.__ans = ans
+
+            data = self.__decodeData(frame)
+
+            if len(data) < size:
+                if ans == ACK_CHAR:
                     raise OTCProtocolError(u'Se recibio ACK, truncando'
                                            u' la recepción (%d en lugar de %d bytes).'
-                                           % ((i+1), size), None, self)
+                                           % ((len(data) + 1), size), None, self)
+                raise OTCProtocolError(u'Se recibió (NACK), interrumpiendo'
+                                       u' la recepción (a %d en lugar de %d bytes).'
+                                       % ((len(data) + 1), size), None, self)
 
-                elif byte == NACK_CHAR:
-                    raise OTCProtocolError(u'Se recibió (NACK), interrumpiendo'
-                                           u' la recepción (a %d en lugar de %d bytes).'
-                                           % ((i+1), size), None, self)
-                data += byte
+            if len(data) > size:
+                raise OTCProtocolError(u'El dispositivo envió una '
+                                       u'respuesta no reconocible.', None, self)
 
-            if not self.__RcveAns():
+            if ans != ACK_CHAR:
+                self.log.debug(u'Respuesta de Rechazo (NACK).')
                 raise OTCProtocolError(u'El dispositivo rechazo la lectura.',
                                        None, self)
 
-            # return [b for b in data]
-            return data
+            return memoryview(data)
 
         except OTCProtocolError as e:
             raise OTCProtocolError(u'Fallo la Recepcion.', e, self)
 
-    def __encodeData(self, data_bytes):
-        # En este punto data puede contener los caracteres especiales
-        # que deben ser substituidos por sus secuencias de escape ...
-        for ch in EncodedChar:
-            data_bytes = data_bytes.replace(ch,
-                                            b'\x1B' + bytes([0x1B ^ ord(ch) ^ 0x55]))
-        # antes de enviarla :
+    def __decodeData(self, data_bytes):
+        u"""
+        Reemplaza las secuencias de escape de data_bytes por los bytes que
+        representan (ver decode_data()). Levanta una excepción si encuentra
+        una secuencia de escape desconocida.
+        """
+        try:
+            return decode_data(data_bytes)
+
+        except ValueError as e:
+            self.log.debug(str(e))
+            raise OTCProtocolError(u'Se recibio una secuencia '
+                                   u'de escape desconocida', None, self)
+
+    def __dataBytes(self, data, mode):
+        u"""
+        Convierte el argumento data de setData() en la secuencia de bytes a
+        escribir (ver setData()).
+        """
+        try:
+            if isinstance(data, str):
+                data_bytes = data
+            elif isinstance(data, int):
+                if mode in ['byte', 'uint8_t']:
+                    data_bytes = struct.pack('b', data)
+                elif mode in ['word', 'uint16_t']:
+                    data_bytes = struct.pack('<H', data)
+                elif mode in ['dword', 'uint32_t']:
+                    data_bytes = struct.pack('<I', data)
+                elif mode in ['uint40_t']:
+                    data_bytes = struct.pack('<Q', data)
+                else:
+                    if (data < 0) or (data >= 1099511627776):
+                        raise ValueError('argument out of range')
+                        sys.exit()
+
+                    self.log.exception(u'SetData : Tercer argumento '
+                                       u'(mode) inválido.')
+            elif isinstance(data, list):
+                data_bytes = b''
+                for item in data:
+                    data_bytes += struct.pack('<B', item)
+            elif isinstance(data, (bytes, bytearray, memoryview)):
+                data_bytes = bytes(data)
+            else:
+                raise ValueError(u'SetData : Primer argumento (data) no es '
+                                 u'un tipo válido (str, int o list de int).\n')
+
+        except Exception as e:
+            self.log.exception(u'SetData : Fallo inesperado al interpretar '
+                               u'los argumentos, detalle :\n')
+            raise e
+
         return data_bytes
 
     def getData(self, adr, size):
@@ -315,26 +562,29 @@ class OTCProtocol:
         como una lista.
         """
         with self._lock:
+            frame = encode_get(adr, size)
+            start = perf_counter()
 
             try:
-                self.log.debug(u'Lectura del contenido de %d bytes desde 0x%04X.'
-                               % (size, adr))
+                self.log.debug(u'Lectura del contenido de %d bytes desde 0x%04X.',
+                               size, adr)
 
                 # Limpia la memoria de contención de recepción :
-                self.__comm.flushInput()
+                self.__flushInput()
+                self.__startReply()
 
-                # Envía el comando según el protocolo, nótese que se asegura la con-
-                # versión a una secuencia de bytes de los parámetros importados :
-                cmd = GET_CHAR + self.__encodeData(struct.pack('<H', adr)
-                                                   + struct.pack('<B', size))
-                self.__xmit(cmd)
+                # Envía el comando según el protocolo :
+                start = perf_counter()
+                self.__xmit(frame)
 
                 # Se espera por la respuesta del comando :
                 ans = self.__RcveData(size)
 
+                self.__measure('G', adr, size, frame, start)
                 return ans
 
             except OTCProtocolError as e:
+                self.__measure('G', adr, size, frame, start, error=True)
                 raise OTCProtocolError(u'No se pudo obtener el contenido de '
                                        u'0x%04X / 0x%02X bytes.' % (adr, size), e, self)
 
@@ -351,63 +601,166 @@ class OTCProtocol:
         consideran válidos los bytes LSB de c/u.
         """
         with self._lock:
-            try:
-                if isinstance(data, str):
-                    data_bytes = data
-                elif isinstance(data, int):
-                    if mode in ['byte', 'uint8_t']:
-                        data_bytes = struct.pack('b', data)
-                    elif mode in ['word', 'uint16_t']:
-                        data_bytes = struct.pack('<H', data)
-                    elif mode in ['dword', 'uint32_t']:
-                        data_bytes = struct.pack('<I', data)
-                    elif mode in ['uint40_t']:
-                        data_bytes = struct.pack('<Q', data)
-                    else:
-                        if (data < 0) or (data >= 1099511627776):
-                            raise ValueError('argument out of range')
-                            sys.exit()
-
-                        self.log.exception(u'SetData : Tercer argumento '
-                                           u'(mode) inválido.')
-                elif isinstance(data, list):
-                    data_bytes = b''
-                    for item in data:
-                        data_bytes += struct.pack('<B', item)
-                elif isinstance(data, bytes):
-                    data_bytes = data
-                else:
-                    raise ValueError(u'SetData : Primer argumento (data) no es '
-                                     u'un tipo válido (str, int o list de int).\n')
-
-            except Exception as e:
-                self.log.exception(u'SetData : Fallo inesperado al interpretar '
-                                   u'los argumentos, detalle :\n')
-                raise e
+            data_bytes = self.__dataBytes(data, mode)
+            frame = encode_set(adr, data_bytes)
+            start = perf_counter()
 
             try:
                 self.log.debug(u'Modificación del contenido de %d bytes '
-                               u'desde 0x%04X.' % (len(data_bytes), adr))
+                               u'desde 0x%04X.', len(data_bytes), adr)
 
                 # Limpia la memoria de contención de recepción :
-                self.__comm.flushInput()
+                self.__flushInput()
+                self.__startReply()
 
-                # Envía el comando según el protocolo, nótese que se asegura la con-
-                # versión a una secuencia de bytes de los parámetros importados y se
-                # asegura de substituir los caracteres especiales por sus secuencias
-                # de escape :
-                cmd = SET_CHAR + self.__encodeData(struct.pack('<H', adr) + struct.pack('B',
-                                                                                        len(data_bytes)) + data_bytes)
-                self.__xmit(cmd)
+                # Envía el comando según el protocolo :
+                start = perf_counter()
+                self.__xmit(frame)
 
                 # Se espera por la respuesta del comando :
                 ans = self.__RcveAns()
+
+                self.__measure('S', adr, len(data_bytes), frame, start)
                 return ans
 
             except OTCProtocolError as e:
+                self.__measure('S', adr, len(data_bytes), frame, start,
+                               error=True)
                 raise OTCProtocolError(u'No se pudo modificar el contenido de '
                                        u'0x%04X / 0x%02X bytes.' % (adr, len(data_bytes)), e, self)
 
+    def batch(self, commands, window=None):
+        u"""
+        Ejecuta la secuencia de ordenes commands, cuyos elementos son tuplas
+        ('G', adr, size) u ('S', adr, data), con data según setData().
+
+        Las ordenes se envían una tras otra sin esperar la respuesta de las
+        anteriores, hasta un máximo de window ordenes pendientes (por defecto
+        batch_window), como el protocolo garantiza una respuesta por orden,
+        estas se asignan en el orden de envío.
+
+        Devuelve la lista de los resultados de cada orden, los datos leídos
+        (memoryview) para las ordenes GET y True/False (ACK/NACK) para las
+        ordenes SET.
+
+        Una respuesta inválida (secuencia de escape desconocida, longitud
+        incorrecta o NACK de una orden GET) no interrumpe la secuencia, pues
+        el byte de respuesta (ACK/NACK) que la termina resincroniza la comu-
+        nicación, y solo se repite la orden afectada. Si se pierde la sincro-
+        nización (timeout o respuesta no reconocible de una orden SET) no se
+        puede identificar la orden cuya respuesta se perdió, y se repiten todas
+        las ordenes. Las ordenes se repiten una vez de forma individual, si
+        vuelven a fallar se levanta una excepción.
+        """
+        if window is None:
+            window = self.batch_window
+
+        # Con el simulador de Proteus se mantiene una sola orden pendiente :
+        if self.throughput_limit or (window < 1):
+            window = 1
+
+        with self._lock:
+            # Se codifican las ordenes :
+            # (y se conservan la orden, la dirección y el tamaño para las
+            # métricas) :
+            frames = []
+            kinds = []
+            for cmd in commands:
+                if cmd[0] in ['G', GET_CHAR]:
+                    frames.append(encode_get(cmd[1], cmd[2]))
+                    kinds.append(('G', cmd[1], cmd[2]))
+                elif cmd[0] in ['S', SET_CHAR]:
+                    data_bytes = self.__dataBytes(cmd[2], 'byte')
+                    frames.append(encode_set(cmd[1], data_bytes))
+                    kinds.append(('S', cmd[1], len(data_bytes)))
+                else:
+                    raise ValueError(u'Batch : La orden "%s" no es válida.'
+                                     % str(cmd[0]))
+
+            self.log.debug(u'Ejecución de %d ordenes (ventana de %d ordenes).',
+                           len(frames), window)
+
+            results = [None]*len(frames)
+            sent_at = [None]*len(frames)
+            failed = []
+
+            # Limpia la memoria de contención de recepción :
+            self.__flushInput()
+
+            sent = 0
+            for n, cmd in enumerate(commands):
+                try:
+                    # Se completa la ventana de ordenes pendientes, en una sola
+                    # transmisión (un fallo en esta implica la perdida de la
+                    # sincronización) :
+                    self.__lost = True
+                    if sent < len(frames) and (sent - n) < window:
+                        upto = min(n + window, len(frames))
+                        sent_at[sent:upto] = [perf_counter()] * (upto - sent)
+                        self.__xmit(b''.join(frames[sent:upto]))
+                        sent = upto
+
+                    self.__lost = False
+                    self.__startReply()
+                    results[n] = self.__RcveReply(cmd)
+                    self.__measure(*kinds[n], frame=frames[n], start=sent_at[n])
+
+                except OTCProtocolError as e:
+                    if sent_at[n] is not None:
+                        self.__measure(*kinds[n], frame=frames[n],
+                                       start=sent_at[n], error=True)
+                    if not self.__lost:
+                        failed.append(n)
+                        continue
+
+                    # Se perdió la sincronización, como no se puede identificar
+                    # la orden cuya respuesta se perdió (las siguientes respuestas
+                    # se desplazan), se descartan todos los resultados y se repiten
+                    # todas las ordenes :
+                    self.log.debug(u'Batch : Se perdió la sincronización en la '
+                                   u'orden %d.', n)
+                    self.__flushInput()
+                    failed = list(range(len(frames)))
+                    break
+
+            # Se repiten las ordenes fallidas de forma individual :
+            for n in failed:
+                start = perf_counter()
+                try:
+                    self.__flushInput()
+                    self.__startReply()
+                    start = perf_counter()
+                    self.__xmit(frames[n])
+                    results[n] = self.__RcveReply(commands[n])
+                    self.__measure(*kinds[n], frame=frames[n], start=start,
+                                   retries=1)
+
+                except OTCProtocolError as e:
+                    self.__measure(*kinds[n], frame=frames[n], start=start,
+                                   retries=1, error=True)
+                    raise OTCProtocolError(u'Fallo la orden %s en 0x%04X de la '
+                                           u'secuencia.' % (str(commands[n][0]),
+                                                           commands[n][1]), e, self)
+
+            return results
+
+    def __RcveReply(self, cmd):
+        u"""
+        Recibe la respuesta de la orden cmd (ver batch()).
+        """
+        if cmd[0] in ['G', GET_CHAR]:
+            return self.__RcveData(cmd[2])
+
+        ans = self.__rcve()
+        if ans == ACK_CHAR:
+            return True
+        elif ans == NACK_CHAR:
+            return False
+
+        self.__lost = True
+        raise OTCProtocolError(u'El dispositivo envió una '
+                               u'respuesta no reconocible.', None, self)
+
     def close(self):
         self.__comm.close()
         self.log.debug(u'Se cerro el puerto serie : %s', str(self.__comm.port))
@@ -0,0 +1,351 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+ReplayDevice.py
+
+Reproducción de las sesiones registradas por SerialDevice en el registro
+binario (report.wire, ver common.report.WireTrace), para reproducir fuera de
+línea los fallos de la decodificación y de los tiempos de la comunicación,
+o comparar el rendimiento de la decodificación con el tráfico real.
+
+ReplayDevice reemplaza al puerto serie de OTCProtocol (ver el argumento
+device) : las escrituras se comparan con los bytes transmitidos registrados,
+como un flujo continuo, independiente de como se dividieron en los registros
+(e.g. byte a byte con XMIT_BYTE), y las diferencias se cuentan en mismatches.
+Las lecturas devuelven los bytes recibidos registrados una vez escritos los
+bytes transmitidos que los preceden en el registro (aún si estos corresponden
+a las ordenes siguientes de batch()), a la velocidad registrada (speed = 1),
+acelerada (speed > 1) o sin esperas (speed = None). Las lecturas sin bytes
+registradas (timeout) se reproducen como tales.
+
+replay() reproduce una sesión completa : agrupa las ordenes registradas (ver
+decode_commands() y ReplayDevice.next_commands()) y las ejecuta por medio de
+OTCProtocol.
+"""
+
+import re
+import struct
+from time import sleep, perf_counter
+
+from .OTCProtocolError import OTCProtocolError
+from .OTCProtocol import OTCProtocol, GET_CHAR, ESCAPE_CHAR, EncodedChar, \
+    _TERMINATOR
+from common.report import read_wire, WIRE_TX, WIRE_RX
+
+# Cada orden se inicia con su identificador ('G' o 'S'), que solo aparece
+# como una secuencia de escape dentro de la orden :
+_COMMAND = re.compile(b'[GS][^GS]*')
+
+
+def _decode_command(data_bytes):
+    u"""
+    Reemplaza las secuencias de escape de una orden (ver encode_data()) por
+    los bytes que representan. Levanta ValueError si encuentra una secuencia
+    de escape desconocida.
+    """
+    segments = data_bytes.split(ESCAPE_CHAR)
+    data = bytearray(segments[0])
+    for segment in segments[1:]:
+        if not segment:
+            raise ValueError(u'Secuencia de escape incompleta')
+        byte = segment[0] ^ ESCAPE_CHAR[0] ^ 0x55
+        if not (bytes([byte]) in EncodedChar):
+            raise ValueError(u'Secuencia de escape desconocida '
+                             u'ESC (0x1B) / 0x%02X' % byte)
+        data.append(byte)
+        data += segment[1:]
+
+    return data
+
+
+def decode_commands(frame):
+    u"""
+    Devuelve la lista de las ordenes de la trama frame (una o mas ordenes
+    codificadas), como tuplas ('G', adr, size) o ('S', adr, data). Las ordenes
+    incompletas o con secuencias de escape desconocidas se omiten.
+    """
+    commands = []
+    for m in _COMMAND.finditer(bytes(frame)):
+        try:
+            body = _decode_command(m.group()[1:])
+        except ValueError:
+            continue
+        if len(body) < 3:
+            continue
+
+        adr, size = struct.unpack_from('<HB', body)
+        if m.group()[:1] == GET_CHAR:
+            commands.append(('G', adr, size))
+        elif len(body) == 3 + size:
+            commands.append(('S', adr, bytes(body[3:])))
+
+    return commands
+
+
+class ReplayDevice(object):
+    u"""
+    Dispositivo que reproduce la sesión del puerto channel (por defecto el
+    primero) registrada en el archivo filename, a la velocidad speed (ver el
+    módulo), con la API de SerialDevice que utiliza OTCProtocol.
+    """
+
+    def __init__(self, filename, channel=None, speed=None):
+        self.records = []
+        for t, name, direction, data in read_wire(filename):
+            if channel is None:
+                channel = name
+            if name == channel:
+                self.records.append((t, direction, data))
+
+        self.channel = channel
+        self.speed = speed
+
+        # Parámetros de operación del puerto (los fija OTCProtocol) :
+        self.port = channel
+        self.baudrate = 57600
+        self.bytesize = 8
+        self.parity = 'N'
+        self.stopbits = 2
+        self.timeout = None
+        self.xonxoff = 0
+        self.rtscts = 0
+        self.dsrdtr = 0
+        self.is_open = False
+
+        # Diferencias entre los bytes escritos y los registrados :
+        self.mismatches = 0
+
+        # Flujo de los bytes transmitidos registrados, con la posición en este
+        # del final de cada registro (de transmisión) :
+        self._txStream = b''.join(data for t, direction, data in self.records
+                                  if direction == WIRE_TX)
+        self._txEnd = []
+        end = 0
+        for t, direction, data in self.records:
+            if direction == WIRE_TX:
+                end += len(data)
+            self._txEnd.append(end)
+
+        # Bytes del flujo ya escritos, próximo registro por liberar y bytes
+        # recibidos aún no leídos :
+        self._written = 0
+        self._pos = 0
+        self._rx = bytearray()
+
+        # Tiempos (registrado y de la reproducción) de la última transmisión
+        # registrada completada :
+        self._origin = None
+        self._txDone = 0
+
+    def __str__(self):
+        return u'ReplayDevice(%s, %d registros)' % (self.channel,
+                                                    len(self.records))
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def flush(self):
+        pass
+
+    # Transmisión :
+
+    def _txStart(self, n):
+        return self._txEnd[n] - (len(self.records[n][2])
+                                 if self.records[n][1] == WIRE_TX else 0)
+
+    def next_commands(self):
+        u"""
+        Descarta los bytes recibidos no leídos y el resto de la transmisión en
+        curso, y devuelve las ordenes de la próxima secuencia registrada, desde
+        la primera transmisión hasta que se reciben las respuestas de todas las
+        ordenes transmitidas (o una lectura sin bytes), como una tupla (ordenes,
+        bytes transmitidos). Devuelve None si no quedan transmisiones.
+        """
+        del self._rx[:]
+
+        n = self._pos
+        while (n < len(self.records)) and \
+                ((self.records[n][1] != WIRE_TX) or
+                 (self._txStart(n) < self._written)):
+            n += 1
+        if n == len(self.records):
+            return None
+
+        self._pos = n
+        self._written = self._txStart(n)
+
+        frame = bytearray()
+        commands = []
+        replies = 0
+        while n < len(self.records):
+            t, direction, data = self.records[n]
+            n += 1
+            if direction == WIRE_TX:
+                frame += data
+                commands = decode_commands(frame)
+                continue
+
+            replies += len(_TERMINATOR.findall(data))
+            if (replies >= len(commands)) or not data:
+                break
+
+        return commands, bytes(frame)
+
+    def write(self, data):
+        data = bytes(data)
+        n = len(data)
+
+        if data != self._txStream[self._written:self._written + n]:
+            self.mismatches += 1
+        self._written += n
+
+        # Se completaron transmisiones registradas, la reproducción de los
+        # tiempos se refiere a la última :
+        while (self._txDone < len(self.records)) and \
+                (self._txEnd[self._txDone] <= self._written):
+            t, direction, data = self.records[self._txDone]
+            if direction == WIRE_TX:
+                self._origin = (t, perf_counter())
+            self._txDone += 1
+        return n
+
+    # Recepción :
+
+    def _due(self, t):
+        u"""
+        Devuelve el tiempo de la reproducción que corresponde al tiempo t
+        registrado.
+        """
+        if not self.speed or self._origin is None:
+            return 0.0
+        return self._origin[1] + (t - self._origin[0]) / self.speed
+
+    def _release(self, until=None):
+        u"""
+        Agrega a los bytes recibidos los registros debidos hasta el tiempo until
+        (por defecto ahora), pasando por las transmisiones registradas ya
+        escritas, hasta la primera lectura sin bytes. Devuelve el tiempo del
+        próximo registro, None si es una lectura sin bytes o una transmisión
+        aún no escrita (o no hay mas registros).
+        """
+        if until is None:
+            until = perf_counter()
+
+        while self._pos < len(self.records):
+            t, direction, data = self.records[self._pos]
+            if direction == WIRE_TX:
+                if self._txEnd[self._pos] > self._written:
+                    return None
+                self._pos += 1
+                continue
+
+            if not data:
+                return None
+            due = self._due(t)
+            if due > until:
+                return due
+            self._rx += data
+            self._pos += 1
+        return None
+
+    def inWaiting(self):
+        self._release()
+        return len(self._rx)
+
+    @property
+    def in_waiting(self):
+        return self.inWaiting()
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else \
+            perf_counter() + self.timeout
+
+        while len(self._rx) < size:
+            due = self._release()
+            if len(self._rx) >= size:
+                break
+
+            if due is None:
+                # Una lectura sin bytes registrada se reproduce como tal :
+                if self._pos < len(self.records):
+                    t, direction, data = self.records[self._pos]
+                    if (direction == WIRE_RX) and not data:
+                        if self._rx:
+                            break
+                        wait = self._due(t) - perf_counter()
+                        if wait > 0:
+                            sleep(wait)
+                        self._pos += 1
+                break
+
+            # Se espera por el próximo registro, hasta el tiempo límite :
+            if (deadline is not None) and (due > deadline):
+                sleep(max(0.0, deadline - perf_counter()))
+                self._release()
+                break
+            sleep(max(0.0, due - perf_counter()))
+
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+    def flushInput(self):
+        del self._rx[:]
+
+    reset_input_buffer = flushInput
+
+
+def replay(filename, channel=None, speed=None, strict=True):
+    u"""
+    Reproduce por medio de OTCProtocol la sesión del puerto channel (por
+    defecto el primero) registrada en filename, a la velocidad speed.
+
+    Las secuencias registradas (ver ReplayDevice.next_commands()) con una
+    orden se ejecutan con getData() o setData(), y las que contienen varias
+    ordenes con batch() (con una ventana de igual tamaño). Devuelve la
+    instancia de OTCProtocol (ver su atributo metrics) y la lista de los
+    resultados de cada secuencia, tuplas (ordenes, resultado o excepción).
+
+    Si los bytes transmitidos difieren de los registrados (i.e. las respuestas
+    reproducidas no corresponden a las ordenes) y strict, levanta una
+    excepción (el número de diferencias es el atributo mismatches de la
+    instancia de OTCProtocol).
+    """
+    device = ReplayDevice(filename, channel, speed)
+    dev = OTCProtocol(device.port, device=device)
+
+    outcomes = []
+    while True:
+        sequence = device.next_commands()
+        if sequence is None:
+            break
+
+        commands, frame = sequence
+        if not commands:
+            # Transmisión no reconocible, se descarta :
+            device.write(frame)
+            continue
+
+        try:
+            if len(commands) > 1:
+                result = dev.batch(commands, window=len(commands))
+            elif commands[0][0] == 'G':
+                result = dev.getData(commands[0][1], commands[0][2])
+            else:
+                result = dev.setData(commands[0][1], commands[0][2])
+        except OTCProtocolError as e:
+            result = e
+
+        outcomes.append((commands, result))
+
+    dev.close()
+    dev.mismatches = device.mismatches
+    if strict and device.mismatches:
+        raise OTCProtocolError(u'La reproducción de %s difiere de la sesión '
+                               u'registrada (%d diferencias).'
+                               % (filename, device.mismatches), None, dev)
+    return dev, outcomes
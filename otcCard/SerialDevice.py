@@ -36,16 +36,18 @@ estándar y dependen del modelo/marca del dispositivo.
 Por el momento solo los dispositivos basados en el radio bñuetooth RN42 son
 soportados.
 
-La API se extiende con la función com_list(), que devuelve un vector cuyos
-elementos son los nombres de los dispositivos registrados como puerto serie,
-para Android devuelve el vector [None], de manera no devolver un vector vacío
-e informar que no existen puertos registrados, pero dejando la posibilidad
-que se seleccione al intentar conectarse, por medio del menú desplegado por
-defecto, en el dispositivo Android.
+La API se extiende con la función com_list(), que devuelve un diccionario
+cuyos valores son los nombres de los dispositivos registrados como puerto
+serie, indexados por su identificador en el sistema (en Windows el nombre del
+controlador, e.g. \\Device\\USBSER000, y en otro caso el nombre mismo), para
+Android devuelve el diccionario {'Bluetooth' : None}, de manera no devolver
+un diccionario vacío e informar que no existen puertos registrados, pero
+dejando la posibilidad que se seleccione al intentar conectarse, por medio
+del menú desplegado por defecto, en el dispositivo Android.
 
 """
 
-from common.report import report
+from common.report import report, WIRE_TX, WIRE_RX
 from .OTCProtocolError import OTCProtocolError
 
 # Android se reconoce por la existencia del módulo 'android' :
@@ -62,6 +64,10 @@ if not isAndroid :
   import serial.tools.list_ports
 
   class SerialDevice(serial.Serial) :
+    # Registro binario de los bytes transmitidos y recibidos (report.wire, ver
+    # common.report.WireTrace) y el canal del puerto en este :
+    _wire = None
+    _channel = None
 
     def __init__(self, *args, **kwargs):
       self.log = report.getLogger(u'SerialDevice')
@@ -75,13 +81,30 @@ if not isAndroid :
         raise OTCProtocolError('El puerto %s serie no existe o '
                                'no esta disponible.' % self.port, e, self)
 
-    def write(self, *args, **kwargs) :
+      self._wire = report.wire
+      if self._wire is not None :
+        self._channel = self._wire.channel(self.port)
+
+    def write(self, data) :
       try :
-        super().write(*args, **kwargs)
+        n = super().write(data)
 
       except (serial.SerialException, serial.SerialTimeoutException) as e :
         raise OTCProtocolError('El puerto %s no responde.' % self.port, e, self)
 
+      if self._wire is not None :
+        self._wire.record(self._channel, WIRE_TX, data)
+      return n
+
+    def read(self, size = 1) :
+      data = super().read(size)
+
+      # Una lectura sin bytes (con tiempo límite) se registra como tal, pues
+      # representa un timeout en la reproducción (ver ReplayDevice) :
+      if (self._wire is not None) and (data or self.timeout) :
+        self._wire.record(self._channel, WIRE_RX, data)
+      return data
+
 
   
     def com_list() :
@@ -94,21 +117,20 @@ if not isAndroid :
       #          aquellos que no están disponibles, i.e que están siendo utilizados
       #          por otra aplicación.
       import os
-      import winreg
    
-      port_list = []
+      port_list = {}
    
       # Existe un defecto en la función 'list_ports.comports' por la cual no
       # lista los puertos USB en Windows8 (y posiblemente 7) del módulo serial.
       # tools, como solución se obtiene la lista de puertos del registro de
       # windows directamente.
       if os.name == 'nt' :
+         import winreg
          path = 'HARDWARE\\DEVICEMAP\\SERIALCOMM'
    
          try:
             key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, path)
             i = 0
-            port_list = {}
             while 1 :
                val = winreg.EnumValue(key, i)
                port_list[str(val[0])] = str(val[1])
@@ -118,9 +140,10 @@ if not isAndroid :
             pass
    
       else :
-         com_ports = serial.tools.list_ports.comports()
-         for i in com_ports :
-            port_list += [i[0]]
+         # Con el mismo formato que en Windows (ver parsePort()), indexados
+         # por su nombre :
+         for p in serial.tools.list_ports.comports() :
+            port_list[p.device] = p.device
    
       return port_list
   
@@ -141,10 +164,10 @@ else :
 
   def com_list() :
    # Se supone que el dispositivo Android no tiene puertos serie nativos,
-   # se devuelve un vector con un elemento None, de manera de forzar el
+   # se devuelve un diccionario con un elemento None, de manera de forzar el
    # despliegue del navegador de dispositivos Bluettooth para la selección
    # por parte del usuario del dispositivo :
-   return [None]
+   return {u'Bluetooth' : None}
 
 
 
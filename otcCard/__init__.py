@@ -5,4 +5,7 @@ from .SerialDevice import *
 from .OTCCard import *
 from .OTCProtocol import *
 from .OTCProtocolError import *
+from .MemoryImage import *
 
+from .AsyncOTCProtocol import *
+from .ReplayDevice import *
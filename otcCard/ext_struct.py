@@ -1,6 +1,16 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+# Versión 1.06
+#   - Los formatos se compilan (ext_struct.compile()) en un codificador (Codec) que
+#     se memoriza, con los desplazamientos, tamaños y funciones de cada campo ya
+#     calculados. Las secuencias de formatos nativos se procesan con una sola
+#     instancia de struct.Struct.
+#   - Se corrigen los formatos g/j (números negativos), G/J y M/F en el orden '>',
+#     el rango de M/F (incluido el cero) y las cadenas de caracteres nulas.
+#   - Las cadenas de caracteres se codifican con la misma codificación con la que
+#     se decodifican ('ansi' o 'latin-1' si no esta disponible).
+#
 # Versión 1.05
 # Se corrige la invocación de fmt_len, sin incluir la clase.
 #
@@ -17,315 +27,470 @@
 
 import struct
 import math
+import codecs
+import functools
 
-class ext_struct(object) :
-  """ Extiende el módulo struct para incluir formatos adicionales, el uso y funcionalidad
-      de los métodos pack y unpack es la misma, pero incluye los siquientes formatos :
+# numpy es opcional, solo es necesario para las funciones de arreglos
+# (ext_struct.unpack_array() y ext_struct.pack_array()) :
+try :
+  import numpy
+except ImportError :
+  numpy = None
 
-      'S' : secuencia de bytes de la longitud especificada.
-      's' : cadena de caracteres truncada por la longiyud dada o hasta el
-            primer caracter nulo ('\x00').
-      'M' : Formato de Microchip de punto flotante de 24 bits.
-      'F' : Formato IEEE574 de punto flotante de 24 bits.
-      'j' : Número entero de 40 bits, con signo.
-      'J' : Número entero de 40 bits, sin signo.
-      'g' : Número entero de 24 bits, con signo.
-      'G' : Número entero de 24 bits, sin signo.
+# Codificación de las cadenas de caracteres, 'ansi' solo existe en Windows, en
+# los otros sistemas se utiliza latin-1 (que coincide en los caracteres usuales) :
+try :
+  codecs.lookup('ansi')
+  STR_ENCODING = 'ansi'
+except LookupError :
+  STR_ENCODING = 'latin-1'
+
+# Formatos del módulo struct y formatos adicionales de ext_struct :
+NATIVE_FMT = 'xcbB?hHiIlLqQnNefdspP'
+EXT_FMT    = 'gGjJMF'
+
+# Tipos de numpy de los formatos nativos admitidos en los arreglos :
+_NUMPY_TYPE = {'b':'i1', 'B':'u1', '?':'b1', 'h':'i2', 'H':'u2', 'i':'i4',
+               'I':'u4', 'l':'i4', 'L':'u4', 'q':'i8', 'Q':'u8', 'e':'f2',
+               'f':'f4', 'd':'f8', 'c':'S1'}
+
+# Tipos de los pasos de un Codec :
+_STRUCT, _STR, _EXT = range(3)
+
+
+def _float24_fields(val) :
+  """ Devuelve el signo, exponente sesgado y coeficiente de val, en los formatos
+      de punto flotante de 24 bits ('M' y 'F') :
 
+             s el signo :  s = 1 if N<0 else 0
+             e el exponente sesgado  = floor(log2(|N|) + 127
+             c el coeficiente        = round( |N|/2^(e-127) - 1 )
+
+      El número cero se representa por (0, 0, 0).
   """
-  # Diccionario de las longitudes de cada tipo de formato :
-  fmt_len = {'x':1, 'c':1, 'b':1, 'B':1, '?':1, 'h':2, 'H':2, 'i':4, 'I':4,
-             'l':4, 'L':4, 'q':8, 'Q':8, 'f':4, 'F':3, 'M':3, 'd':8, 's':1,
-             'g':3, 'G':3, 'J':5, 'j':5 }
+  if isinstance(val, bool) or not isinstance(val, (int, float)) :
+    raise ValueError("ext_struct : Los formatos 'M' y 'F' admiten numeros "
+                                             "enteros o de punto flotante.")
+  if val == 0 :
+    return (0, 0, 0)
 
-  fmt_base = {'F' : 'L', 'M' : 'L', 'G': 'L', 'J' : 'Q'}
+  sig = 1 if val < 0 else 0
+  val = abs(val)
 
-  @staticmethod
-  def __pack(b_order, fmt, val) :
-    if fmt in 'xcbB?hHiIlLqQnNefdspq' :
-      return struct.pack(b_order + fmt, val)
+  exp = int(math.floor(math.log2(val))) + 127
+  coeff = int((val/2**(exp - 127) - 1)*32768 + 0.5)
 
+  # El redondeo del coeficiente puede alcanzar la siguiente potencia de 2 :
+  if coeff == 32768 :
+    exp, coeff = exp + 1, 0
 
-    if fmt in ['g', 'j'] :
-      if not isinstance(val, (int)) :
-        raise ValueError('ext_struct : Los formatos g/G y j/J solo admiten argumentos instancias de int.')
+  if not (0 < exp < 256) :
+    raise ValueError('argument out of range')
 
-      fmt = fmt.upper()
+  return (sig, exp, coeff)
 
-      if (val < 0) :
-        val += 256**(ext_struct.fmt_len[fmt]) + val
 
-      if (val < 0) or (val >= 2**(8*ext_struct.fmt_len[fmt] - 1)) :
-        raise ValueError('argument out of range')
+def _float24_value(sig, exp, coeff) :
+  if (exp, coeff) == (0, 0) :
+    return 0.0
+  return (-1 if sig else 1) * (1 + coeff/32768) * 2**(exp - 127)
 
-    if fmt in ['G', 'J'] :
-      if not isinstance(val, (int)) :
-        raise ValueError('ext_struct : Los formatos g/G y j/J solo admiten argumentos instancias de int.')
 
-      if  (val < 0) or (val >= 2**(8*ext_struct.fmt_len[fmt])) :
+def _ext_handlers(fmt, order) :
+  """ Devuelve las funciones (pack, unpack) del formato adicional fmt, en el
+      orden de bytes order ('little' o 'big'), pack(val) devuelve la secuencia
+      de bytes de val y unpack(buf, offset) el valor codificado en buf desde
+      offset.
+  """
+  size = ext_struct.fmt_len[fmt]
+
+  if fmt in 'gGjJ' :
+    # Números enteros de 24 (g/G) y 40 (j/J) bits :
+    signed = fmt in 'gj'
+
+    def pack(val) :
+      if isinstance(val, bool) or not isinstance(val, int) :
+        raise ValueError('ext_struct : Los formatos g/G y j/J solo admiten '
+                                                 'argumentos instancias de int.')
+      try :
+        return val.to_bytes(size, order, signed = signed)
+      except OverflowError :
         raise ValueError('argument out of range')
 
-      if b_order  == '>' :
-        return struct.pack(b_order + ext_struct.fmt_base[fmt], val) #[fmt_len[fmt_base[fmt]] - fmt_len[fmt] : ]
+    def unpack(buf, offset) :
+      return int.from_bytes(buf[offset:offset + size], order, signed = signed)
 
-      elif b_order == '<' :
-        return struct.pack(b_order + ext_struct.fmt_base[fmt], val)[ : ext_struct.fmt_len[fmt] - ext_struct.fmt_len[ext_struct.fmt_base[fmt]]]
+  elif fmt == 'M' :
+    """ Formato de 24 bits de Microchip :
+                eeeeeeee sccccccc cccccccc
 
-      else :
-        raise ValueError('ext_struct : El orden de los bytes en los formato de números de 24 bits y 40 bits debe especificarse explicitamente.')
+        representa al número
+                N = ((s == 0)? 1 : -1) * (1 + c/32768) *2^(e - 127)
+    """
+    def pack(val) :
+      sig, exp, coeff = _float24_fields(val)
+      return (exp*65536 + sig*32768 + coeff).to_bytes(3, order)
 
-    if fmt == 'M' :
-      """ Formato de 24 bits de Microchip :
-                  eeeeeeee sccccccc cccccccc
+    def unpack(buf, offset) :
+      word = int.from_bytes(buf[offset:offset + 3], order)
+      return _float24_value(word & 0x8000, word >> 16, word & 0x7FFF)
 
-          representa al número
-                  N = ((s == 0)? 0 : 1) * (1 + c/32768) *2^(e - 127)
-          donde s, e y c representan :
-             s el signo :  s = 1 if N<0 else 0
-             e el exponente sesgado  = floor(log2(|N|) + 127
-             c el coeficiente        = round( |N|/2^(e-127) - 1 )
+  else :
+    """ Formato 'F' de 24 bits IEE754 :
+                seeeeeee eccccccc cccccccc
 
-          El número cero se representa por 0x000000.
-      """
-      if not isinstance(val, (int, float)) :
-        raise ValueError("ext_struct : El formato 'F' admite numeros enteros o de punto flotante.")
+        representa al número
+                N = ((s == 0)? 1 : -1) * (1 + c/32768) *2^(e - 127)
+    """
+    def pack(val) :
+      sig, exp, coeff = _float24_fields(val)
+      return (sig*128*65536 + exp*32768 + coeff).to_bytes(3, order)
 
-      if (val < 2 **(-127) * 32767) or (val > 2**(128) * 32767) :
-        raise ValueError('argument out of range')
+    def unpack(buf, offset) :
+      word = int.from_bytes(buf[offset:offset + 3], order)
+      return _float24_value(word >> 23, (word >> 15) & 0xFF, word & 0x7FFF)
 
-      if val == 0 :
-         exp, sig, coeff = (0,0,0)
-      else :
-        if val < 0  :
-          sig = 1
-          val = -val
-        else :
-          sig = 0
+  return (pack, unpack, size)
 
-        exp = int(math.floor(math.log2(val))) + 127
-        coeff = int((val/2**(exp - 127) - 1)*32768 + 0.5)
 
-      return struct.pack('<I', exp*65536 + sig*32768 + coeff)[:3]
+def _parse_fmt(fmt) :
+  """ Devuelve el prefijo del orden de los bytes de fmt ('' si no se espe-
+      cifica) y la lista de sus campos como tuplas (multiplicador, formato).
+  """
+  if fmt and (fmt[0] in '<>!=@') :
+    prefix, body = fmt[0], fmt[1:]
+  else :
+    prefix, body = '', fmt
 
-    if fmt == 'F' :
-      """ Formato de 24 bits IEE754 :
-                  seeeeeee eccccccc cccccccc
+  fields = []
+  i = 0
+  while i < len(body) :
+    if body[i].isspace() :
+      i += 1
+      continue
 
-          representa al número
-                  N = ((s == 0)? 0 : 1) * (1 + c/32768) *2^(e - 127)
-          donde s, e y c representan :
-             s el signo :  s = 1 if N<0 else 0
-             e el exponente sesgado  = floor(log2(|N|) + 127
-             c el coeficiente        = round( |N|/2^(e-127) - 1 )
+    j = i
+    while (j < len(body)) and body[j].isdigit() :
+      j += 1
+    multiplier = int(body[i:j]) if j > i else 1
 
-          El número cero se representa por 0x000000.
-      """
-      if not isinstance(val, (int, float)) :
-        raise ValueError("ext_struct : El formato 'M' admite numeros enteros o de punto flotante.")
+    if (j == len(body)) or not (body[j] in NATIVE_FMT + EXT_FMT) :
+      raise ValueError('ext_struct : El formato no es reconocido.')
 
-      if (val < 2 **(-127) * 32767) or (val > 2**(128) * 32767) :
-        raise ValueError('argument out of range')
+    fields.append((multiplier, body[j]))
+    i = j + 1
 
-      if val == 0 :
-         exp, sig, coeff = (0,0,0)
-      else :
-        if val < 0  :
-          sig = 1
-          val = -val
-        else :
-          sig = 0
+  return prefix, fields
 
-        exp = int(math.floor(math.log2(val))) + 127
-        coeff = int((val/2**(exp - 127) - 1)*32768 + 0.5)
 
-      return struct.pack('<I', exp*32768 + sig*128*65536 + coeff)[:3]
+def _decode_str(x) :
+  # Las cadenas se truncan en los caracteres nulos o espacios finales :
+  return x.rstrip(b'\x00 ').decode(STR_ENCODING)
 
-    raise ValueError('ext_struct : El formato no es reconocido.')
 
+class Codec(object) :
+  """ Codificador/decodificador de un formato de ext_struct, resultado de su
+      compilación (ver ext_struct.compile()).
 
-  @staticmethod
-  def pack(fmt, *val) :
-    # Se asegura que val sea una tupla :
-    if not isinstance(val, tuple) : val = (val,)
+      El formato se descompone en una lista de pasos (steps) con su despla-
+      zamiento : las secuencias de formatos nativos se agrupan en una sola
+      instancia de struct.Struct, las cadenas de caracteres se decodifican
+      individualmente y los formatos adicionales (gGjJMF) tienen sus propias
+      funciones.
 
-    # Se reconoce el orden de la conversión a bytes :
-    if fmt[0] in ['<', '>', '!', '@', '!'] :
-      _fmt = fmt[1:]
-      f0   = fmt[0]
-    else :
-      _fmt = fmt
-      f0   = ''
+      Atributos :
+        fmt   : formato.
+        size  : tamaño de la secuencia de bytes.
+        count : número de valores.
+  """
+  def __init__(self, fmt) :
+    self.fmt = fmt
+
+    prefix, fields = _parse_fmt(fmt)
+
+    # En los formatos nativos se utilizan los tamaños estándar sin alinea-
+    # miento (los de fmt_len) :
+    s_order = {'<' : '<', '>' : '>', '!' : '>'}.get(prefix, '=')
+    x_order = {'<' : 'little', '>' : 'big', '!' : 'big'}.get(prefix)
+
+    steps = []
+    offset = 0
+    count = 0
+
+    # Secuencia en curso de formatos nativos (formato, desplazamiento, valores) :
+    run = ['', 0, 0]
+
+    def close_run() :
+      if run[0] :
+        steps.append((_STRUCT, run[1], struct.Struct(s_order + run[0]), run[2]))
+      run[:] = ['', offset, 0]
+
+    for multiplier, code in fields :
+      if code in 'sp' :
+        close_run()
+        steps.append((_STR, offset, struct.Struct(s_order + str(multiplier) + code), 1))
+        offset += multiplier
+        count += 1
+
+      elif code in EXT_FMT :
+        if x_order is None :
+          raise ValueError('ext_struct : El orden de los bytes en los formato de '
+                 'números de 24 bits y 40 bits debe especificarse explicitamente.')
+        close_run()
+        handlers = _ext_handlers(code, x_order)
+        for n in range(multiplier) :
+          steps.append((_EXT, offset, handlers, 1))
+          offset += handlers[2]
+        count += multiplier
 
-    pack_bytes = b''
+      else :
+        if not run[0] :
+          run[1] = offset
+        run[0] += str(multiplier) + code if multiplier != 1 else code
+        offset += multiplier*struct.calcsize(s_order + code)
+        if code != 'x' :
+          run[2] += multiplier
+          count += multiplier
+
+    close_run()
+
+    self.steps = tuple(steps)
+    self.size = offset
+    self.count = count
+
+    # Si el formato solo consta de formatos nativos (el caso mas frecuente) se
+    # utiliza directamente struct.Struct :
+    if (len(steps) == 1) and (steps[0][0] == _STRUCT) :
+      self.pack = steps[0][2].pack
+      self.unpack_from = steps[0][2].unpack_from
+      self.unpack = steps[0][2].unpack_from
+
+
+  def pack(self, *val) :
+    """ Devuelve la secuencia de bytes de los valores val.
+    """
+    if len(val) != self.count :
+      raise struct.error('pack expected %d items for packing (got %d)'
+                                                      % (self.count, len(val)))
+    buf = bytearray(self.size)
+    i = 0
+    for kind, offset, obj, n in self.steps :
+      if kind == _STRUCT :
+        obj.pack_into(buf, offset, *val[i:i + n])
+      elif kind == _STR :
+        v = val[i]
+        obj.pack_into(buf, offset, v.encode(STR_ENCODING) if isinstance(v, str) else v)
+      else :
+        buf[offset:offset + obj[2]] = obj[0](val[i])
+      i += n
 
-    while _fmt :
-      multiplier = ''
-      while _fmt[0] in '0123456789' :
-        multiplier += _fmt[0]
-        _fmt = _fmt[1:]
+    return bytes(buf)
 
-      if not multiplier:
-        multiplier = '1'
 
-      if not (_fmt[0] in 'xcbB?hHiIlLqQnNefdspqgGjJ') :
-        ValueError('ext_struct : El formato no es reconocido.')
+  def unpack_from(self, buf, offset = 0) :
+    """ Devuelve la tupla de los valores codificados en buf desde offset.
+    """
+    if len(buf) - offset < self.size :
+      raise struct.error('unpack requires a buffer of %d bytes' % self.size)
 
-      if _fmt[0] in 'sp' :
-        pack_bytes += struct.pack(f0 + multiplier + _fmt[0], val[0].encode('utf-8'))
-        val = val[1:]
+    val = []
+    for kind, off, obj, n in self.steps :
+      if kind == _STRUCT :
+        val.extend(obj.unpack_from(buf, offset + off))
+      elif kind == _STR :
+        val.append(_decode_str(obj.unpack_from(buf, offset + off)[0]))
       else :
-        for n in range(int(multiplier)) :
-          pack_bytes += ext_struct.__pack(f0, _fmt[0], val[0])
-          val = val[1:]
+        val.append(obj[1](buf, offset + off))
 
-      _fmt = _fmt[1:]
+    return tuple(val)
 
-    return pack_bytes
 
+  def unpack(self, buf) :
+    return self.unpack_from(buf)
 
-  @staticmethod
-  def __unpack(b_order, fmt, packed_bytes) :
-    if fmt in 'xcbB?hHiIlLqQnNefdspq' :
-      return struct.unpack(b_order + fmt, packed_bytes)
-
-    if b_order == '>' :
-      packed_bytes =  (ext_struct.fmt_len[ext_struct.fmt_base[fmt.upper()]] - ext_struct.fmt_len[fmt])*b'\x00' + packed_bytes
-    elif b_order == '<' :
-      packed_bytes +=  (ext_struct.fmt_len[ext_struct.fmt_base[fmt.upper()]] - ext_struct.fmt_len[fmt])*b'\x00'
-    else :
-      raise ValueError('ext_struct : El orden de los bytes en los formato de números de 24 bits y 40 bits debe especificarse explicitamente.')
 
-    if fmt == 'M' :
-      """ Formato de 24 bits de Microchip :
-                  eeeeeeee sccccccc cccccccc
+def _array_format(fmt) :
+  """ Devuelve el prefijo del orden de los bytes, el formato y el multiplica-
+      dor del campo único de fmt, el formato de los elementos de un arreglo.
+  """
+  if numpy is None :
+    raise ImportError('ext_struct : Los arreglos requieren el módulo numpy.')
 
-          representa al número
-                  N = ((s == 0)? 0 : 1) * (1 + c/32768) *2^(e - 127)
-          donde s, e y c representan :
-             s el signo :  s = 1 if N<0 else 0
-             e el exponente sesgado  = floor(log2(|N|) + 127
-             c el coeficiente        = round( |N|/2^(e-127) - 1 )
+  prefix, fields = _parse_fmt(fmt)
+  if (len(fields) != 1) or not ((fields[0][1] in _NUMPY_TYPE) or
+                                (fields[0][1] in EXT_FMT)) :
+    raise ValueError('ext_struct : Los arreglos solo admiten un formato '
+                                          'numérico simple (i.e. "<H", "<M").')
 
-          El número cero se represnta po 0x000000.
-      """
-      if b_order == '>' :
-        tmp = packed_bytes[2]
-        packed_bytes[2] = packed_bytes[0]
-        packed_bytes[0] = tmp
+  if (fields[0][1] in EXT_FMT) and not (prefix in '<>!' and prefix) :
+    raise ValueError('ext_struct : El orden de los bytes en los formato de '
+                 'números de 24 bits y 40 bits debe especificarse explicitamente.')
 
-      sig = 1 if packed_bytes[1] < 128 else -1
-      exp = packed_bytes[2] - 127
-      coeff = 1 + ((0x7F & packed_bytes[1])*256 +  packed_bytes[0])/32768
+  return (prefix, fields[0][1], fields[0][0])
 
-      val = (sig*coeff*2**(exp) ,)
 
-      return val
+def _unpack_array(fmt, buffer, count, offset) :
+  prefix, code, multiplier = _array_format(fmt)
+  if count is None :
+    count = multiplier
 
-    if fmt == 'F' :
-      """ Formato de 24 bits IEE754 :
-                  seeeeeee eccccccc cccccccc
+  # Los formatos nativos se interpretan directamente sobre buffer (sin copia) :
+  if code in _NUMPY_TYPE :
+    order = {'<' : '<', '>' : '>', '!' : '>'}.get(prefix, '=')
+    return numpy.frombuffer(buffer, order + _NUMPY_TYPE[code], count, offset)
 
-          representa al número
-                  N = ((s == 0)? 0 : 1) * (1 + c/32768) *2^(e - 127)
-          donde s, e y c representan :
-             s el signo :  s = 1 if N<0 else 0
-             e el exponente sesgado  = floor(log2(|N|) + 127
-             c el coeficiente        = round( |N|/2^(e-127) - 1 )
+  # Los formatos adicionales se completan a palabras de 64 bits :
+  size = ext_struct.fmt_len[code]
+  raw = numpy.frombuffer(buffer, 'u1', count*size, offset).reshape(count, size)
 
-          El número cero se representa por 0x000000.
-      """
-      if b_order == '>' :
-        tmp = packed_bytes[2]
-        packed_bytes[2] = packed_bytes[0]
-        packed_bytes[0] = tmp
+  word = numpy.zeros((count, 8), 'u1')
+  if prefix == '<' :
+    word[:, :size] = raw
+    word = word.view('<u8').ravel().astype('i8')
+  else :
+    word[:, 8 - size:] = raw
+    word = word.view('>u8').ravel().astype('i8')
 
-      sig = 1 if packed_bytes[2] < 128 else -1
-      exp = (0x7F & packed_bytes[2])*2 + (1 if packed_bytes[1] > 127 else 0) - 127
-      coeff = 1 + ((0x7F & packed_bytes[1])*256 +  packed_bytes[0])/32768
+  if code in 'GJ' :
+    return word
 
-      val = (sig*coeff*2**(exp) ,)
+  if code in 'gj' :
+    return word - ((word >> (8*size - 1)) << (8*size))
 
-      return val
+  if code == 'M' :
+    sig, exp, coeff = word & 0x8000, word >> 16, word & 0x7FFF
+  else :
+    sig, exp, coeff = word >> 23, (word >> 15) & 0xFF, word & 0x7FFF
 
-    # Formatos g/G y j/J :
-    val = struct.unpack(b_order + ext_struct.fmt_base[fmt.upper()], packed_bytes)
+  val = numpy.ldexp(1 + coeff/32768, exp - 127)
+  val[sig != 0] *= -1
+  val[(exp == 0) & (coeff == 0)] = 0.0
 
-    if fmt in ['g', 'j'] :
-      if val[0] >= 2**(8*ext_struct.fmt_len[fmt] - 1) :
-        val = (val[0] - 256**(ext_struct.fmt_len[fmt]), )
+  return val
 
-    return val
 
+def _pack_array(fmt, values) :
+  prefix, code, multiplier = _array_format(fmt)
+  values = numpy.asarray(values).ravel()
 
-  @staticmethod
-  def unpack(fmt, packed_bytes) :
-    strip =  lambda x : strip(x[:-1]) if x[-1] in [0, ord(' ')] else x.decode('ansi')
+  if code in _NUMPY_TYPE :
+    order = {'<' : '<', '>' : '>', '!' : '>'}.get(prefix, '=')
+    dtype = numpy.dtype(order + _NUMPY_TYPE[code])
+    if (dtype.kind in 'iu') and values.size :
+      limits = numpy.iinfo(dtype)
+      if (values.min() < limits.min) or (values.max() > limits.max) :
+        raise ValueError('argument out of range')
+    return values.astype(dtype).tobytes()
 
-    # Se reconoce el orden de la conversión a bytes :
-    if fmt[0] in ['<', '>', '!', '@', '!'] :
-      _fmt = fmt[1:]
-      f0   = fmt[0]
+  size = ext_struct.fmt_len[code]
+
+  if code in 'gGjJ' :
+    if not (values.dtype.kind in 'iu') :
+      raise ValueError('ext_struct : Los formatos g/G y j/J solo admiten '
+                                                  'argumentos números enteros.')
+    word = values.astype('i8')
+    if code in 'gj' :
+      low, high = -(1 << (8*size - 1)), (1 << (8*size - 1)) - 1
+    else :
+      low, high = 0, (1 << 8*size) - 1
+    if word.size and ((word.min() < low) or (word.max() > high)) :
+      raise ValueError('argument out of range')
+
+  else :
+    # Formatos de punto flotante de 24 bits (ver _float24_fields()) :
+    val = values.astype('f8')
+    if not numpy.isfinite(val).all() :
+      raise ValueError('argument out of range')
+
+    zero = (val == 0)
+    sig = (val < 0).astype('i8')
+    frac, exp = numpy.frexp(numpy.abs(val))
+    exp = exp.astype('i8') + 126
+    coeff = numpy.floor((2*frac - 1)*32768 + 0.5).astype('i8')
+
+    carry = (coeff == 32768)
+    exp[carry] += 1
+    coeff[carry] = 0
+
+    if ((~zero) & ((exp <= 0) | (exp >= 256))).any() :
+      raise ValueError('argument out of range')
+    sig[zero], exp[zero], coeff[zero] = 0, 0, 0
+
+    if code == 'M' :
+      word = (exp << 16) | (sig << 15) | coeff
     else :
-      _fmt = fmt
-      f0   = ''
+      word = (sig << 23) | (exp << 15) | coeff
 
-    val = []
+  if prefix == '<' :
+    return word.astype('<u8').view('u1').reshape(-1, 8)[:, :size].tobytes()
+  return word.astype('>u8').view('u1').reshape(-1, 8)[:, 8 - size:].tobytes()
 
-    while _fmt :
-      multiplier = ''
-      while _fmt[0] in '0123456789' :
-        multiplier += _fmt[0]
-        _fmt = _fmt[1:]
 
-      if not multiplier :
-        multiplier = '1'
+class ext_struct(object) :
+  """ Extiende el módulo struct para incluir formatos adicionales, el uso y funcionalidad
+      de los métodos pack y unpack es la misma, pero incluye los siquientes formatos :
 
-      if not (_fmt[0] in 'xcbB?hHiIlLqQnNefdspqgGjJ') :
-        ValueError('ext_struct : El formato no es reconocido.')
+      'S' : secuencia de bytes de la longitud especificada.
+      's' : cadena de caracteres truncada por la longiyud dada o hasta el
+            primer caracter nulo ('\x00').
+      'M' : Formato de Microchip de punto flotante de 24 bits.
+      'F' : Formato IEEE574 de punto flotante de 24 bits.
+      'j' : Número entero de 40 bits, con signo.
+      'J' : Número entero de 40 bits, sin signo.
+      'g' : Número entero de 24 bits, con signo.
+      'G' : Número entero de 24 bits, sin signo.
 
-      if _fmt[0] in 'sp':
-        field = []
+      Cada formato se compila una sola vez (ver compile()), por lo que es
+      preferible conservar el Codec cuando el formato se utiliza a menudo.
+  """
+  # Diccionario de las longitudes de cada tipo de formato :
+  fmt_len = {'x':1, 'c':1, 'b':1, 'B':1, '?':1, 'h':2, 'H':2, 'i':4, 'I':4,
+             'l':4, 'L':4, 'q':8, 'Q':8, 'e':2, 'f':4, 'F':3, 'M':3, 'd':8,
+             's':1, 'g':3, 'G':3, 'J':5, 'j':5 }
 
-        for n in range(int(multiplier)) :
-          field.append( ext_struct.__unpack(f0, _fmt[0], packed_bytes[:ext_struct.fmt_len[_fmt[0]]])[0] )
-          packed_bytes = packed_bytes[ext_struct.fmt_len[_fmt[0]]:]
+  @staticmethod
+  @functools.lru_cache(maxsize = 256)
+  def compile(fmt) :
+    """ Devuelve el codificador (Codec) del formato fmt, los formatos compilados
+        se memorizan.
+    """
+    return Codec(fmt)
 
-        val.append(strip(b''.join(field)))
 
-      else :
-        for n in range(int(multiplier)) :
-          val.append( ext_struct.__unpack(f0, _fmt[0], packed_bytes[:ext_struct.fmt_len[_fmt[0]]])[0] )
-          packed_bytes = packed_bytes[ext_struct.fmt_len[_fmt[0]]:]
+  @staticmethod
+  def pack(fmt, *val) :
+    return ext_struct.compile(fmt).pack(*val)
 
-      _fmt = _fmt[1:]
 
-    return tuple(val)
+  @staticmethod
+  def unpack(fmt, packed_bytes) :
+    return ext_struct.compile(fmt).unpack(packed_bytes)
 
 
   @staticmethod
   def calcsize(fmt) :
-    if fmt[0] in ['<', '>', '!', '@', '!'] :
-      _fmt = fmt[1:]
-    else :
-      _fmt = fmt
+    return ext_struct.compile(fmt).size
 
-    c_size = 0
 
-    while _fmt :
-      multiplier = ''
-      while _fmt[0] in '0123456789' :
-        multiplier += _fmt[0]
-        _fmt = _fmt[1:]
+  @staticmethod
+  def unpack_array(fmt, buffer, count = None, offset = 0) :
+    """ Decodifica count elementos consecutivos del formato simple fmt (i.e.
+        '<H', '<G' o '<M') desde la posición offset de buffer, en un arreglo
+        de numpy. Si no se especifica count, se utiliza el multiplicador de
+        fmt (i.e. '<24H' decodifica 24 elementos).
 
-      if not (_fmt[0] in 'xcbB?hHiIlLqQnNefdspqgGjJ') :
-        ValueError('ext_struct : El formato no es reconocido.')
+        Los formatos nativos se interpretan directamente sobre buffer (sin
+        copia, el arreglo es de solo lectura si buffer es inmutable), los
+        formatos de 24 y 40 bits se decodifican en forma vectorial en
+        arreglos de int64 o float64 ('M' y 'F').
+    """
+    return _unpack_array(fmt, buffer, count, offset)
 
-      if multiplier == '' :
-        multiplier = 1
-      else :
-        multiplier = int(multiplier)
 
-      c_size += multiplier*ext_struct.fmt_len[_fmt[0]]
-      _fmt = _fmt[1:]
-
-    return c_size
+  @staticmethod
+  def pack_array(fmt, values) :
+    """ Devuelve la secuencia de bytes de los elementos de values (una
+        secuencia o arreglo de numpy) en el formato simple fmt, es la
+        función inversa de unpack_array().
+    """
+    return _pack_array(fmt, values)
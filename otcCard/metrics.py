@@ -0,0 +1,262 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+metrics.py
+
+Métricas de la comunicación por medio de OTCProtocol : por cada tipo de orden
+(GET y SET) se cuentan las ordenes, los bytes transmitidos y recibidos (en la
+línea, i.e. con las secuencias de escape), las repeticiones, los rechazos
+(NACK) y los fallos, y se registran en histogramas la latencia de las
+respuestas y el tiempo hasta el primer byte de la respuesta. Además se
+conservan los registros de las últimas ordenes (ProtocolMetrics.recent).
+
+Los histogramas son del tipo HDR (High Dynamic Range) : registran valores
+enteros (microsegundos) en intervalos con una precisión relativa constante
+(1/32), con un costo constante por valor y una memoria proporcional al
+logaritmo del rango de los valores.
+
+Las métricas de todas las sesiones (ver metrics()) pueden presentarse al
+terminar el programa o exportarse en formato JSON (ver dump_at_exit()).
+"""
+
+import sys
+import json
+import atexit
+import collections
+
+# Precisión de los histogramas : los valores menores que SUB_COUNT se regis-
+# tran exactamente, los mayores en HALF_COUNT intervalos por cada potencia
+# de 2 :
+SUB_BITS = 6
+SUB_COUNT = 1 << SUB_BITS
+HALF_COUNT = SUB_COUNT >> 1
+
+
+class Histogram(object):
+    u"""
+    Histograma HDR de valores enteros no negativos.
+    """
+
+    def __init__(self):
+        self.counts = []
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def index(value):
+        u"""
+        Devuelve el índice del intervalo de value.
+        """
+        if value < SUB_COUNT:
+            return value
+        shift = value.bit_length() - SUB_BITS
+        return shift * HALF_COUNT + (value >> shift)
+
+    @staticmethod
+    def lower(index):
+        u"""
+        Devuelve el menor valor del intervalo index.
+        """
+        if index < SUB_COUNT:
+            return index
+        shift = index // HALF_COUNT - 1
+        return (index - shift * HALF_COUNT) << shift
+
+    def record(self, value):
+        value = max(0, int(value))
+
+        i = self.index(value)
+        if i >= len(self.counts):
+            self.counts.extend([0] * (i + 1 - len(self.counts)))
+        self.counts[i] += 1
+
+        self.count += 1
+        self.total += value
+        if (self.min is None) or (value < self.min):
+            self.min = value
+        if (self.max is None) or (value > self.max):
+            self.max = value
+
+    def merge(self, other):
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+
+        self.count += other.count
+        self.total += other.total
+        for v in (other.min, other.max):
+            if v is not None:
+                self.min = v if self.min is None else min(self.min, v)
+                self.max = v if self.max is None else max(self.max, v)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        u"""
+        Devuelve el valor del percentil p (0 a 100), i.e. el mayor valor del
+        intervalo que lo contiene (limitado por el máximo registrado).
+        """
+        if not self.count:
+            return 0
+
+        rank = max(1, int(p / 100.0 * self.count + 0.5))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(self.lower(i + 1) - 1, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean(),
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+            # Intervalos no vacíos (menor valor, cuenta) :
+            'buckets': [(self.lower(i), c) for i, c in enumerate(self.counts)
+                        if c],
+        }
+
+
+class CommandMetrics(object):
+    u"""
+    Métricas de un tipo de orden (GET o SET).
+    """
+
+    def __init__(self):
+        self.commands = 0
+        self.payload = 0
+        self.tx_bytes = 0
+        self.rx_bytes = 0
+        self.retries = 0
+        self.nacks = 0
+        self.errors = 0
+        self.latency = Histogram()
+        self.first_byte = Histogram()
+
+    def to_dict(self):
+        d = dict((k, v) for k, v in self.__dict__.items()
+                 if not isinstance(v, Histogram))
+        d['latency_us'] = self.latency.to_dict()
+        d['first_byte_us'] = self.first_byte.to_dict()
+        return d
+
+
+# Registro de una orden en ProtocolMetrics.recent :
+CommandRecord = collections.namedtuple('CommandRecord',
+                                       'cmd adr size tx_bytes rx_bytes first_byte '
+                                       'latency retries nack error')
+
+
+class ProtocolMetrics(object):
+    u"""
+    Métricas de la sesión name (el puerto serie) de OTCProtocol, con los
+    registros de las últimas recent_size ordenes.
+    """
+    recent_size = 256
+
+    def __init__(self, name):
+        self.name = name
+        self.by_command = {'G': CommandMetrics(), 'S': CommandMetrics()}
+        self.recent = collections.deque(maxlen=self.recent_size)
+
+    def command(self, cmd, adr, size, tx_bytes, rx_bytes, first_byte, latency,
+                retries=0, nack=False, error=False):
+        u"""
+        Registra la orden cmd ('G' o 'S') de size bytes en adr, con tx_bytes y
+        rx_bytes bytes en la línea, los tiempos (en segundos) hasta el primer
+        byte de la respuesta (None si no se recibió) y hasta su recepción
+        completa (latency), el número de repeticiones y si fue rechazada
+        (nack) o fallo (error).
+        """
+        m = self.by_command[cmd]
+        m.commands += 1
+        m.payload += size
+        m.tx_bytes += tx_bytes
+        m.rx_bytes += rx_bytes
+        m.retries += retries
+        m.nacks += bool(nack)
+        m.errors += bool(error)
+
+        if not error:
+            m.latency.record(latency * 1e6)
+        if first_byte is not None:
+            m.first_byte.record(first_byte * 1e6)
+
+        self.recent.append(CommandRecord(cmd, adr, size, tx_bytes, rx_bytes,
+                                         first_byte, latency, retries, nack,
+                                         error))
+
+    def to_dict(self):
+        return {'name': self.name,
+                'commands': dict((k, m.to_dict())
+                                 for k, m in self.by_command.items())}
+
+    def summary(self):
+        u"""
+        Devuelve el resumen (texto) de las métricas.
+        """
+        lines = [u'Métricas de OTCProtocol en %s :' % self.name]
+        for cmd, m in sorted(self.by_command.items()):
+            if not m.commands:
+                continue
+            lat = m.latency
+            lines.append(u'  %s : %d ordenes, %d/%d bytes (tx/rx), %d repeticiones, '
+                         u'%d NACK, %d fallos' % (cmd, m.commands, m.tx_bytes,
+                                                  m.rx_bytes, m.retries, m.nacks,
+                                                  m.errors))
+            lines.append(u'      latencia [us] : media %.0f, p50 %d, p90 %d, '
+                         u'p99 %d, máx %s' % (lat.mean(), lat.percentile(50),
+                                              lat.percentile(90), lat.percentile(99),
+                                              lat.max))
+            lines.append(u'      primer byte [us] : p50 %d, p99 %d'
+                         % (m.first_byte.percentile(50),
+                            m.first_byte.percentile(99)))
+        return u'\n'.join(lines)
+
+
+# Métricas de todas las sesiones :
+registry = []
+
+
+def metrics(name):
+    u"""
+    Devuelve (y registra) las métricas de una nueva sesión name.
+    """
+    m = ProtocolMetrics(name)
+    registry.append(m)
+    return m
+
+
+def export_json(filename):
+    u"""
+    Exporta las métricas de todas las sesiones en formato JSON.
+    """
+    with open(filename, 'w') as f:
+        json.dump([m.to_dict() for m in registry], f, indent=1)
+
+
+def dump_at_exit(filename=None):
+    u"""
+    Al terminar el programa presenta el resumen de las métricas (en la salida
+    de errores) o, si se especifica filename, las exporta en formato JSON.
+    """
+    def dump():
+        if filename is not None:
+            export_json(filename)
+            return
+        for m in registry:
+            if any(c.commands for c in m.by_command.values()):
+                sys.stderr.write(m.summary() + u'\n')
+
+    atexit.register(dump)